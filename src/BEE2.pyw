@@ -45,6 +45,8 @@ DEFAULT_SETTINGS = {
         'allow_any_folder_as_game': '0',
         'mute_sounds': '0',
         'show_wip_items': '0',
+        # Parse package objects using multiple threads
+        'parallel_load': '1',
     },
     'Debug': {
         # Show exceptions in dialog box when crash occurs
@@ -113,6 +115,7 @@ if __name__ == '__main__':
                 'Debug', 'log_missing_ent_count'),
             log_incorrect_packfile=GEN_OPTS.get_bool(
                 'Debug', 'log_incorrect_packfile'),
+            parallel=GEN_OPTS.get_bool('General', 'parallel_load', True),
         )
         UI.load_packages(pack_data)
         LOGGER.info('Done!')
@@ -1,6 +1,9 @@
 """Read and write lumps in Source BSP files.
 
 """
+import mmap
+import operator
+import os
 import struct
 
 from enum import Enum
@@ -107,64 +110,244 @@ class BSP_LUMPS(Enum):
 
 LUMP_COUNT = max(lump.value for lump in BSP_LUMPS) + 1  # 64 normally
 
+# When rewriting the last lump in place, the old and new data are
+# compared in blocks of this size to skip the unchanged start.
+COMPARE_SIZE = 1024 * 1024
+
+
+def move_game_lump(data, offset_change: int):
+    """Adjust the offsets in a GAME_LUMP, after it was moved in the file.
+
+    The sub-lumps are located with offsets from the start of the BSP, so
+    these need to be changed whenever the GAME_LUMP moves.
+    """
+    if offset_change == 0:
+        return data
+    data = bytearray(data)
+    count, = struct.unpack_from('<i', data, 0)
+    for index in range(count):
+        # Each is id, flags, version, offset, length.
+        pos = 4 + 16 * index + 8
+        offset, = struct.unpack_from('<i', data, pos)
+        struct.pack_into('<i', data, pos, offset + offset_change)
+    return data
+
 
 class BSP:
-    """A BSP file."""
+    """A BSP file.
+
+    The file is memory-mapped when first needed, so lumps can be read
+    without copying. Call close() (or use this as a context manager) to
+    release the file.
+    """
     def __init__(self, filename):
         self.filename = filename
         self.map_revision = -1  # The map's revision count
         self.lumps = {}
         self.header_off = 0
+        self._file = None
+        self._mmap = None
+        # Lump -> new data, for changes not yet written.
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_mmap(self) -> mmap.mmap:
+        """Open and map the file, if it isn't already."""
+        if self._mmap is None:
+            self._file = open(self.filename, 'rb')
+            try:
+                self._mmap = mmap.mmap(
+                    self._file.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ,
+                )
+            except BaseException:
+                self._file.close()
+                self._file = None
+                raise
+        return self._mmap
+
+    def close(self):
+        """Close the file.
+
+        Any memoryviews returned by get_lump() must be released first.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
     def read_header(self):
         """Read through the BSP header to find the lumps.
 
         This allows locating any data in the BSP.
         """
-        with open(self.filename, mode='br') as file:
-            # BSP files start with 'VBSP', then a version number.
-            magic_name, bsp_version = get_struct(file, '4si')
-            assert magic_name == BSP_MAGIC, 'Not a BSP file!'
+        file = self._get_mmap()
+        file.seek(0)
+        # BSP files start with 'VBSP', then a version number.
+        magic_name, bsp_version = get_struct(file, '4si')
+        assert magic_name == BSP_MAGIC, 'Not a BSP file!'
+
+        assert bsp_version == P2_BSP_VERSION, 'Non-Portal 2 BSP!'
 
-            assert bsp_version == P2_BSP_VERSION, 'Non-Portal 2 BSP!'
+        # Read the index describing each BSP lump.
+        for index in range(LUMP_COUNT):
+            lump = Lump.from_bytes(index, file)
+            self.lumps[lump.type] = lump
 
-            # Read the index describing each BSP lump.
-            for index in range(LUMP_COUNT):
-                lump = Lump.from_bytes(index, file)
-                self.lumps[lump.type] = lump
+        # Remember how big this is, so we can remake it later when needed.
+        self.header_off = file.tell()
+        self.map_revision, = struct.unpack_from('i', file, self.header_off)
 
-            # Remember how big this is, so we can remake it later when needed.
-            self.header_off = file.tell()
+    def get_lump(self, lump) -> memoryview:
+        """Read a lump from the BSP.
 
-    def get_lump(self, lump):
-        """Read a lump from the BSP."""
+        This returns a read-only view into the file, which must be
+        released (or used in a with statement) before the BSP is closed.
+        If new data has been staged for the lump, that is returned instead.
+        """
         if isinstance(lump, BSP_LUMPS):
             lump = self.lumps[lump]
-        with open(self.filename, 'rb') as file:
-            file.seek(lump.offset)
-            return file.read(lump.length)
-
-    def replace_lump(self, new_name, lump, new_data: bytes):
-        """Write out the BSP file, replacing a lump with the given bytes.
-
+        if lump in self._pending:
+            return self._pending[lump]
+        with memoryview(self._get_mmap()) as view:
+            return view[lump.offset:lump.offset + lump.length]
+
+    def set_lump(self, lump, new_data: bytes):
+        """Stage new data for a lump.
+
+        Nothing is written until commit() is called, so any number of
+        lumps can be changed with a single rewrite of the file.
+        Offsets inside GAME_LUMP data should be for the lump's current
+        position - they are adjusted if the lump moves.
         """
         if isinstance(lump, BSP_LUMPS):
             lump = self.lumps[lump]
-        with open(self.filename, 'rb') as file:
-            data = file.read()
+        self._pending[lump] = memoryview(new_data)
 
-        before_lump = data[self.header_off:lump.offset]
-        after_lump = data[lump.offset + lump.length:]
-        del data
+    def discard(self):
+        """Forget all lump changes staged with set_lump()."""
+        self._pending.clear()
 
-        # Adjust the length to match the new data block.
-        lump.length = len(new_data)
+    def commit(self, new_name=None):
+        """Write out the BSP file, with all staged lump changes.
 
-        with open(new_name, 'wb') as file:
+        If new_name is not given, the original file is overwritten.
+        If only the last lump in the file is changed, it is rewritten in
+        place. Otherwise the unchanged parts are copied directly from the
+        original into a new file, which then replaces new_name.
+        """
+        if new_name is None:
+            new_name = self.filename
+        data = self._get_mmap()
+
+        if len(self._pending) == 1 and os.path.exists(new_name):
+            [(lump, new_data)] = self._pending.items()
+            if (
+                lump.length > 0 and
+                lump.offset + lump.length == len(data) and
+                os.path.samefile(new_name, self.filename)
+            ):
+                self._write_last_lump(lump, new_data)
+                return
+
+        # The original lumps, in the order they are in the file.
+        # Lumps which were empty are added to the end.
+        file_lumps = sorted(
+            (lump for lump in self.lumps.values() if lump.length > 0),
+            key=operator.attrgetter('offset'),
+        )
+        new_lumps = [
+            lump for lump in self._pending
+            if lump.length == 0
+        ]
+        new_pos = {}
+
+        temp_name = new_name + '.tmp'
+        with open(temp_name, 'wb') as file, memoryview(data) as view:
+            # Skip the header, it's written once we know the offsets.
+            file.seek(self.header_off)
+            old_pos = self.header_off
+            for lump in file_lumps:
+                # Keep anything between lumps (the revision, padding).
+                if lump.offset > old_pos:
+                    file.write(view[old_pos:lump.offset])
+                old_pos = max(old_pos, lump.offset + lump.length)
+
+                new_pos[lump] = offset = file.tell()
+                try:
+                    lump_data = self._pending[lump]
+                except KeyError:
+                    lump_data = view[lump.offset:lump.offset + lump.length]
+                if lump.type is BSP_LUMPS.GAME_LUMP:
+                    lump_data = move_game_lump(
+                        lump_data,
+                        offset - lump.offset,
+                    )
+                file.write(lump_data)
+                # Views into the file prevent closing it.
+                del lump_data
+            file.write(view[old_pos:])
+
+            for lump in new_lumps:
+                new_pos[lump] = file.tell()
+                file.write(self._pending[lump])
+
+            for lump, offset in new_pos.items():
+                lump.offset = offset
+                if lump in self._pending:
+                    lump.length = len(self._pending[lump])
+            file.seek(0)
             self.write_header(file)
-            file.write(before_lump)
-            file.write(new_data)
-            file.write(after_lump)
+
+        self._pending.clear()
+        # The original needs to be closed before it can be overwritten.
+        self.close()
+        os.replace(temp_name, new_name)
+        self.filename = new_name
+
+    def _write_last_lump(self, lump, new_data: memoryview):
+        """Overwrite the last lump in the file, without copying the rest.
+
+        Only the part of the lump which actually changed is written -
+        when adding files to the PAKFILE, this is just the new files and
+        the zip directory.
+        """
+        # Find the first block which is different.
+        start = 0
+        same_len = min(lump.length, len(new_data))
+        data = self._get_mmap()
+        while start < same_len:
+            end = min(start + COMPARE_SIZE, same_len)
+            old_block = data[lump.offset + start:lump.offset + end]
+            if old_block != new_data[start:end].tobytes():
+                break
+            start = end
+
+        self.close()
+        with open(self.filename, 'r+b') as file:
+            file.seek(lump.offset + start)
+            file.write(new_data[start:])
+            file.truncate()
+            lump.length = len(new_data)
+            file.seek(0)
+            self.write_header(file)
+        self._pending.clear()
+
+    def replace_lump(self, new_name, lump, new_data: bytes):
+        """Write out the BSP file, replacing a lump with the given bytes.
+
+        This is equivalent to set_lump() followed by commit().
+        """
+        self.set_lump(lump, new_data)
+        self.commit(new_name)
 
     def write_header(self, file):
         """Write the BSP file header into the given file."""
@@ -239,7 +422,8 @@ if __name__ == '__main__':
     print('Read header')
 
     zip_data = BytesIO()
-    zip_data.write(test_file.get_lump(BSP_LUMPS.PAKFILE))
+    with test_file.get_lump(BSP_LUMPS.PAKFILE) as pak_lump:
+        zip_data.write(pak_lump)
     zipfile = ZipFile(zip_data, mode='a')
     with zipfile:
         zipfile.testzip()
@@ -433,6 +433,9 @@ def quit_application():
     GEN_OPTS.save_check()
     item_opts.save_check()
     CompilerPane.COMPILE_CFG.save_check()
+    # Stop extracting resources, so the thread doesn't write during exit.
+    extract_packages.cancel()
+    img.THUMBNAILS.save()
     # Destroy the TK windows
     TK_ROOT.destroy()
     exit(0)
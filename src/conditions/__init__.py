@@ -5,11 +5,14 @@ from enum import Enum
 import random
 import math
 import itertools
+import time
 
 from utils import Vec, Vec_tuple
 from property_parser import Property
 from instanceLocs import resolve as resolve_inst
 import vmfLib as VLib
+import profiler
+import templateCache
 import utils
 
 from typing import (
@@ -29,9 +32,15 @@ VMF = None  # type: VLib.VMF
 
 conditions = []
 FLAG_LOOKUP = {}
+FLAG_COMPILE = {}
 RESULT_LOOKUP = {}
 RESULT_SETUP = {}
 
+# Flags and results which don't depend on the instance passed in.
+# For flags, this is either True or a function deciding based on the flag.
+GLOBAL_FLAGS = {}
+GLOBAL_RESULTS = set()
+
 # Used to dump a list of the flags, results, meta-conds
 ALL_FLAGS = []
 ALL_RESULTS = []
@@ -42,8 +51,10 @@ GOO_FACE_LOC = set()  # A set of the locations of all goo top faces
 
 # A VMF containing template brushes, which will be loaded in and retextured
 # The first list is for world brushes, the second are func_detail brushes. The third holds overlays.
-TEMPLATES = {}  # type: Dict[str, Tuple[List[VLib.Solid], List[VLib.Solid], List[VLib.Entity]]]
+TEMPLATES = {}  # type: Dict[str, templateCache.PackedTemplate]
 TEMPLATE_LOCATION = 'bee2/templates.vmf'
+# The compiled form of the templates, reused until the VMF changes.
+TEMPLATE_CACHE_LOCATION = 'bee2/templates.cache'
 
 # A template shaped like embeddedVoxel blocks
 TEMP_EMBEDDED_VOXEL = 'BEE2_EMBEDDED_VOXEL'
@@ -222,7 +233,15 @@ RES_EXHAUSTED = object()
 
 
 class Condition:
-    __slots__ = ['flags', 'results', 'else_results', 'priority']
+    __slots__ = [
+        'flags',
+        'results',
+        'else_results',
+        'priority',
+        'inst_files',
+        'flag_test',
+        'is_global',
+    ]
 
     def __init__(
             self,
@@ -235,6 +254,13 @@ class Condition:
         self.results = results or []
         self.else_results = else_results or []
         self.priority = priority
+        # The instance files this can match, set by setup_inst_files().
+        self.inst_files = None
+        # The compiled version of our flags, made when first needed.
+        self.flag_test = None
+        # If True, nothing here depends on the instance, so this only
+        # needs to run once. Set by setup_global().
+        self.is_global = False
         self.setup()
 
     def __repr__(self):
@@ -293,9 +319,92 @@ class Condition:
             self.setup_result(self.else_results, res)
 
 
+    def setup_inst_files(self):
+        """Work out which instances this condition could apply to.
+
+        If the first flag checks the instance filename, only instances
+        with those files need to be tested. This is either a set of
+        filenames, a string which must be in the filename, or None
+        if all instances need to be checked.
+        If there are else results, these need to run on every instance.
+        """
+        self.inst_files = None
+        if self.else_results or not self.flags:
+            return
+        flag = self.flags[0]
+        if flag.has_children():
+            return
+        if flag.name == 'instance':
+            self.inst_files = frozenset(resolve_inst(flag.value))
+        elif flag.name in ('instflag', 'instpart'):
+            self.inst_files = flag.value
+
+    def setup_global(self):
+        """Check if this condition is independent of the instance.
+
+        This is the case if all our flags and results are global.
+        """
+        self.is_global = all(
+            is_global_flag(flag)
+            for flag in self.flags
+        ) and all(
+            res.name in GLOBAL_RESULTS
+            for res in itertools.chain(self.results, self.else_results)
+        )
+
+    def iter_instances(self):
+        """Yield the instances this condition needs to be tested on.
+
+        Like VMF.by_class, instances added or renamed while this
+        is running will also be produced. Global conditions are only
+        tested once, with None as the instance.
+        """
+        if self.flag_test is flag_false and not self.else_results:
+            # The flags can never pass.
+            return
+        if self.is_global:
+            yield None
+            return
+        all_inst = VMF.by_class['func_instance']
+        if self.inst_files is None:
+            yield from all_inst
+            return
+
+        seen = set()
+        while True:
+            if isinstance(self.inst_files, str):
+                files = [
+                    file for file in list(VMF.by_file)
+                    if file is not None and self.inst_files in file
+                ]
+            else:
+                files = self.inst_files
+            batch = [
+                inst
+                for file in files
+                for inst in VMF.by_file.get(file, ())
+                if inst not in seen and inst in all_inst
+            ]
+            if not batch:
+                return
+            seen.update(batch)
+            yield from batch
+
+    def compile_flags(self):
+        """Convert our flags into a single function testing instances."""
+        self.flag_test = compile_flags(self.flags)
+
     @staticmethod
     def setup_result(res_list, result):
         """Helper method to perform result setup."""
+        if result.name not in RESULT_LOOKUP:
+            # Warn once, instead of every time it would run.
+            LOGGER.warning(
+                '"{name}" is not a valid condition result!',
+                name=result.real_name,
+            )
+            res_list.remove(result)
+            return
         func = RESULT_SETUP.get(result.name)
         if func:
             result.value = func(result)
@@ -315,15 +424,52 @@ class Condition:
                 name=res.real_name,
             )
         else:
-            return func(inst, res)
+            if not profiler.ENABLED:
+                return func(inst, res)
+            start = time.perf_counter()
+            try:
+                return func(inst, res)
+            finally:
+                profiler.record(
+                    profiler.CAT_RESULT,
+                    res.name,
+                    time.perf_counter() - start,
+                )
+
+    def describe(self):
+        """Return a short description of this condition, for the profiler.
+
+        This is the priority and the first flag or result.
+        """
+        if self.flags:
+            prop = self.flags[0]
+        elif self.results:
+            prop = self.results[0]
+        else:
+            return '({}) <empty>'.format(self.priority)
+        if prop.has_children():
+            value = '{...}'
+        else:
+            value = prop.value
+        return '({}) {}: {}'.format(self.priority, prop.real_name, value)
 
     def test(self, inst):
-        """Try to satisfy this condition on the given instance."""
-        success = True
-        for flag in self.flags:
-            if not check_flag(flag, inst):
-                success = False
-                break
+        """Try to satisfy this condition on the given instance.
+
+        This returns whether the flags passed.
+        """
+        success = self.test_flags(inst)
+        self.run_results(inst, success)
+        return success
+
+    def test_flags(self, inst):
+        """Check if the flags pass for this instance."""
+        if self.flag_test is None:
+            self.compile_flags()
+        return self.flag_test(inst)
+
+    def run_results(self, inst, success):
+        """Run the results or else-results, depending on the flags."""
         results = self.results if success else self.else_results
         for res in results[:]:
             should_del = self.test_result(inst, res)
@@ -374,6 +520,9 @@ def add_meta(func, priority, only_once=True):
     # Don't pass the prop_block onto the function,
     # it doesn't contain any useful data.
     RESULT_LOOKUP[name] = lambda inst, val: func(inst)
+    if only_once:
+        # These are only run on the first instance, which they ignore.
+        GLOBAL_RESULTS.add(name)
 
     cond = Condition(
         results=[Property(name, '')],
@@ -396,28 +545,52 @@ def meta_cond(priority=0, only_once=True):
     return x
 
 
-def make_flag(orig_name, *aliases):
-    """Decorator to add flags to the lookup."""
+def make_flag(orig_name, *aliases, is_global=False):
+    """Decorator to add flags to the lookup.
+
+    If is_global is True, the flag ignores the instance it's passed.
+    It can also be a function taking the flag, for flags which are
+    global depending on their value.
+    """
     def x(func):
         ALL_FLAGS.append(
             (orig_name, aliases, func)
         )
-        FLAG_LOOKUP[orig_name.casefold()] = func
-        for name in aliases:
+        for name in (orig_name,) + aliases:
             FLAG_LOOKUP[name.casefold()] = func
+            if is_global:
+                GLOBAL_FLAGS[name.casefold()] = is_global
         return func
     return x
 
 
-def make_result(orig_name, *aliases):
-    """Decorator to add results to the lookup."""
+def make_flag_compiler(*names):
+    """Decorator to convert these flags into functions ahead of time.
+
+    The function is passed the flag, and should parse its value and return
+    a function taking the instance. If the result can never change,
+    flag_true or flag_false can be returned instead.
+    """
+    def x(func):
+        for name in names:
+            FLAG_COMPILE[name.casefold()] = func
+        return func
+    return x
+
+
+def make_result(orig_name, *aliases, is_global=False):
+    """Decorator to add results to the lookup.
+
+    If is_global is True, the result ignores the instance it's passed.
+    """
     def x(func):
         ALL_RESULTS.append(
             (orig_name, aliases, func)
         )
-        RESULT_LOOKUP[orig_name.casefold()] = func
-        for name in aliases:
+        for name in (orig_name,) + aliases:
             RESULT_LOOKUP[name.casefold()] = func
+            if is_global:
+                GLOBAL_RESULTS.add(name.casefold())
         return func
     return x
 
@@ -438,8 +611,12 @@ def add(prop_block):
         conditions.append(con)
 
 
-def init(seed, inst_list, vmf_file):
-    # Get a bunch of values from VBSP
+@profiler.stage
+def init(seed, inst_list, vmf_file, templates=None):
+    """Get a bunch of values from VBSP, and set up the conditions.
+
+    templates is the result of load_template_cache(), if already loaded.
+    """
     import vbsp
     global MAP_RAND_SEED, ALL_INST, VMF, STYLE_VARS, VOICE_ATTR, OPTIONS
     VMF = vmf_file
@@ -452,17 +629,36 @@ def init(seed, inst_list, vmf_file):
     # Sort by priority, where higher = done later
     conditions.sort()
 
+    for cond in conditions:
+        cond.setup_global()
+        cond.setup_inst_files()
+        cond.compile_flags()
+
+    LOGGER.info(
+        '{}/{} conditions are global.',
+        sum(cond.is_global for cond in conditions),
+        len(conditions),
+    )
+
     build_solid_dict()
-    load_templates()
+    load_templates(templates)
 
 
+@profiler.stage
 def check_all():
     """Check all conditions."""
     LOGGER.info('Checking Conditions...')
-    for condition in conditions:
-        for inst in VMF.by_class['func_instance']:
+    for index, condition in enumerate(conditions):
+        calls = matches = 0
+        start = time.perf_counter()
+        for inst in condition.iter_instances():
+            calls += 1
             try:
-                condition.test(inst)
+                success = condition.test_flags(inst)
+                if success:
+                    # Count this before results, which might skip out.
+                    matches += 1
+                condition.run_results(inst, success)
             except NextInstance:
                 # This is raised to immediately stop running
                 # this condition, and skip to the next instance.
@@ -475,6 +671,15 @@ def check_all():
                 LOGGER.info('Exiting empty condition!')
                 break  # Condition has run out of results, quit early
 
+        if profiler.ENABLED:
+            profiler.record(
+                profiler.CAT_CONDITION,
+                '#{} {}'.format(index, condition.describe()),
+                time.perf_counter() - start,
+                calls,
+                matches,
+            )
+
     LOGGER.info('Map has attributes: ', [
         key
         for key, value in
@@ -485,6 +690,99 @@ def check_all():
     LOGGER.info('Global instances: ', GLOBAL_INSTANCES)
 
 
+def is_global_flag(flag: Property):
+    """Check if this flag doesn't depend on the instance."""
+    is_global = GLOBAL_FLAGS.get(flag.name, False)
+    if callable(is_global):
+        return is_global(flag)
+    return is_global
+
+
+def flag_true(inst):
+    """A compiled flag which always passes."""
+    return True
+
+
+def flag_false(inst):
+    """A compiled flag which always fails."""
+    return False
+
+
+def compile_flag(flag: Property):
+    """Convert a flag into a function taking an instance, returning a bool.
+
+    Flags with compilers parse their values once here. Others are just
+    bound to their flag function.
+    """
+    try:
+        compiler = FLAG_COMPILE[flag.name]
+    except KeyError:
+        try:
+            func = FLAG_LOOKUP[flag.name]
+        except KeyError:
+            LOGGER.warning(
+                '"' + flag.name + '" is not a valid condition flag!'
+            )
+            return flag_false
+
+        def test_flag(inst):
+            return func(inst, flag)
+    else:
+        test_flag = compiler(flag)
+
+    if profiler.ENABLED and test_flag not in (flag_true, flag_false):
+        return profiler.wrap_flag(flag.name, test_flag)
+    return test_flag
+
+
+def compile_flags(flags, require_all=True):
+    """Compile a list of flags into a single function.
+
+    If require_all is True, all must pass (AND). Otherwise, any must pass
+    (OR). Flags which always pass or fail are removed.
+    """
+    # The value which decides the result early.
+    stop_flag = flag_false if require_all else flag_true
+    tests = []
+    for flag in flags:
+        test = compile_flag(flag)
+        if test is stop_flag:
+            return stop_flag
+        elif test is not flag_true and test is not flag_false:
+            tests.append(test)
+
+    if not tests:
+        return flag_true if require_all else flag_false
+    elif len(tests) == 1:
+        return tests[0]
+    elif require_all:
+        def test_all(inst):
+            for test in tests:
+                if not test(inst):
+                    return False
+            return True
+        return test_all
+    else:
+        def test_any(inst):
+            for test in tests:
+                if test(inst):
+                    return True
+            return False
+        return test_any
+
+
+def invert_flag(test):
+    """Return a compiled flag with the opposite result."""
+    if test is flag_true:
+        return flag_false
+    elif test is flag_false:
+        return flag_true
+
+    def test_not(inst):
+        return not test(inst)
+    return test_not
+
+
 def check_flag(flag, inst):
     # print('Checking {type} ({val!s} on {inst}'.format(
     #     type=flag.real_name,
@@ -827,30 +1125,20 @@ def set_ent_keys(ent, inst, prop_block, suffix=''):
             ent[prop.real_name] = name + val
 
 
-def load_templates():
-    """Load in the template file, used for import_template()."""
-    with open(TEMPLATE_LOCATION) as file:
-        props = Property.parse(file, TEMPLATE_LOCATION)
-    vmf = VLib.VMF.parse(props)
-    detail_ents = defaultdict(list)
-    world_ents = defaultdict(list)
-    overlay_ents = defaultdict(list)
-    for ent in vmf.by_class['bee2_template_world']:
-        world_ents[ent['template_id'].casefold()].extend(ent.solids)
-
-    for ent in vmf.by_class['bee2_template_detail']:
-        detail_ents[ent['template_id'].casefold()].extend(ent.solids)
-
-    for ent in vmf.by_class['bee2_template_overlay']:
-        overlay_ents[ent['template_id'].casefold()].append(ent)
-
-    for temp_id in set(detail_ents.keys()
-            ).union(world_ents.keys(), overlay_ents.keys()):
-        TEMPLATES[temp_id] = (
-            world_ents[temp_id],
-            detail_ents[temp_id],
-            overlay_ents[temp_id]
-        )
+def load_template_cache():
+    """Read the compiled templates, or compile them from the VMF."""
+    return templateCache.load(TEMPLATE_LOCATION, TEMPLATE_CACHE_LOCATION)
+
+
+def load_templates(templates=None):
+    """Load in the template file, used for import_template().
+
+    If the templates were already loaded, they can be passed in.
+    """
+    if templates is None:
+        templates = load_template_cache()
+    TEMPLATES.clear()
+    TEMPLATES.update(templates)
 
 
 def import_template(
@@ -884,29 +1172,37 @@ def import_template(
         # Overwrite the error's value
         err.args = ('Template not found: "{}"'.format(temp_name),)
         raise err
-    new_world = []
-    new_detail = []
     new_over = []
 
     id_mapping = {}
 
-    for orig_list, new_list in [
-            (orig_world, new_world),
-            (orig_detail, new_detail)
-        ]:
-        for old_brush in orig_list:
-            brush = old_brush.copy(map=VMF, side_mapping=id_mapping)
-            brush.localise(origin, angles)
-            new_list.append(brush)
-
-    for overlay in orig_over:  # type: VLib.Entity
-        new_overlay = overlay.copy(
-            map=VMF,
+    if angles is None:
+        matrix = None
+    else:
+        matrix = utils.rotation_matrix(angles[0], angles[1], angles[2])
+
+    new_world = [
+        brush.instantiate(VMF, origin, matrix, id_mapping)
+        for brush in orig_world
+    ]
+    new_detail = [
+        brush.instantiate(VMF, origin, matrix, id_mapping)
+        for brush in orig_detail
+    ]
+
+    for over_keys, over_editor in orig_over:
+        new_overlay = VLib.Entity(
+            VMF,
+            keys=over_keys,
+            editor=dict(
+                over_editor,
+                visgroup=over_editor['visgroup'][:],
+            ),
         )
         del new_overlay['template_id']  # Remove this, it's not part of overlays
         new_overlay['classname'] = 'info_overlay'
 
-        sides = overlay['sides'].split()
+        sides = over_keys.get('sides', '').split()
         new_overlay['sides'] = ' '.join(
             id_mapping[side]
             for side in sides
@@ -1401,7 +1697,7 @@ def res_break(base_inst, res):
     raise NextInstance
 
 
-@make_result('endCondition')
+@make_result('endCondition', is_global=True)
 def res_end_condition(base_inst, res):
     """Skip to the next condition.
 
@@ -1469,7 +1765,7 @@ def make_static_pist(ent, res):
             ent['file'] = val
 
 
-@make_result('GooDebris')
+@make_result('GooDebris', is_global=True)
 def res_goo_debris(_, res):
     """Add random instances to goo squares.
 
@@ -13,7 +13,7 @@ import vmfLib as VLib
 import vbsp
 
 
-@make_result('addGlobal')
+@make_result('addGlobal', is_global=True)
 def res_add_global_inst(_, res):
     """Add one instance in a location.
 
@@ -91,7 +91,7 @@ def place_catwalk_connections(instances, point_a, point_b):
         loc += (segment_len * direction)
 
 
-@make_result('makeCatwalk')
+@make_result('makeCatwalk', is_global=True)
 def res_make_catwalk(_, res):
     """Speciallised result to generate catwalks from markers.
 
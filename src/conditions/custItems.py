@@ -316,8 +316,7 @@ def res_faith_mods(inst, res):
                     Vec.from_str(trig['origin']) +
                     offset
                 ).join(' ')
-                for solid in trig.solids:
-                    solid.translate(offset)
+                VLib.translate_solids(trig.solids, offset)
 
             # Inspect the outputs to determine the type.
             # We also change them if desired, since that's not possible
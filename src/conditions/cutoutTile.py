@@ -650,8 +650,7 @@ def make_displacement(
 def add_floor_sides(locs):
     """We need to replace nodraw textures around the outside of the holes.
 
-    This requires looping through all faces, since these will have been
-    nodrawed.
+    These will have been nodrawed, so look up the faces at each location.
     """
     added_locations = {
         barrier.wall.as_tuple(): False
@@ -659,11 +658,14 @@ def add_floor_sides(locs):
         locs
     }
 
-    for face in conditions.VMF.iter_wfaces(world=True, detail=False):
-        if face.mat != 'tools/toolsnodraw':
-            continue
-        loc = face.get_origin().as_tuple()
-        if loc in added_locations:
+    for loc in added_locations:
+        for face in conditions.VMF.spatial.iter_wfaces_at(
+                Vec(loc),
+                world=True,
+                detail=False,
+                ):
+            if face.mat != 'tools/toolsnodraw':
+                continue
             random.seed('floor_side_{}_{}_{}'.format(*loc))
             face.mat = random.choice(MATS['squarebeams'])
             added_locations[loc] = True
@@ -2,7 +2,8 @@
 import utils
 
 from conditions import (
-    make_flag, make_result, RES_EXHAUSTED,
+    make_flag, make_flag_compiler, make_result, RES_EXHAUSTED,
+    flag_true, flag_false,
 )
 import vbsp
 
@@ -11,7 +12,7 @@ OPTIONS = vbsp.settings['options']
 VOICE_ATTR = vbsp.settings['has_attr']
 
 
-@make_flag('styleVar')
+@make_flag('styleVar', is_global=True)
 def flag_stylevar(_, flag):
     """Checks if the given Style Var is true.
 
@@ -20,7 +21,7 @@ def flag_stylevar(_, flag):
     return STYLE_VARS[flag.value.casefold()]
 
 
-@make_flag('has')
+@make_flag('has', is_global=True)
 def flag_voice_has(_, flag):
     """Checks if the given Voice Attribute is present.
 
@@ -29,7 +30,7 @@ def flag_voice_has(_, flag):
     return VOICE_ATTR[flag.value.casefold()]
 
 
-@make_flag('has_music')
+@make_flag('has_music', is_global=True)
 def flag_music(_, flag):
     """Checks the selected music ID.
 
@@ -38,7 +39,7 @@ def flag_music(_, flag):
     return OPTIONS['music_id'] == flag.value
 
 
-@make_flag('Game')
+@make_flag('Game', is_global=True)
 def flag_game(_, flag):
     """Checks which game is being modded.
 
@@ -57,7 +58,7 @@ def flag_game(_, flag):
     )
 
 
-@make_flag('has_char')
+@make_flag('has_char', is_global=True)
 def flag_voice_char(_, flag):
     """Checks to see if the given charcter is present in the voice pack.
 
@@ -74,7 +75,7 @@ def flag_voice_char(_, flag):
     return False
 
 
-@make_flag('HasCavePortrait')
+@make_flag('HasCavePortrait', is_global=True)
 def res_cave_portrait(inst, res):
     """Checks to see if the Cave Portrait option is set for the given
 
@@ -84,7 +85,7 @@ def res_cave_portrait(inst, res):
     return vbsp.get_opt('cave_port_skin') != ''
 
 
-@make_flag('ifOption')
+@make_flag('ifOption', is_global=True)
 def flag_option(_, flag):
     bits = flag.value.split(' ', 1)
     key = bits[0].casefold()
@@ -94,7 +95,7 @@ def flag_option(_, flag):
         return False
 
 
-@make_flag('ifMode', 'iscoop', 'gamemode')
+@make_flag('ifMode', 'iscoop', 'gamemode', is_global=True)
 def flag_game_mode(_, flag):
     """Checks if the game mode is "SP" or "COOP".
     """
@@ -102,7 +103,7 @@ def flag_game_mode(_, flag):
     return vbsp.GAME_MODE.casefold() == flag.value.casefold()
 
 
-@make_flag('ifPreview', 'preview')
+@make_flag('ifPreview', 'preview', is_global=True)
 def flag_is_preview(_, flag):
     """Checks if the preview mode status equals the given value.
 
@@ -116,7 +117,64 @@ def flag_is_preview(_, flag):
     return vbsp.IS_PREVIEW == utils.conv_bool(flag.value, False)
 
 
-@make_result('styleVar')
+# Style vars, voice attributes and options can be changed by results, so
+# these are still checked each time.
+
+
+@make_flag_compiler('styleVar')
+def compile_stylevar(flag):
+    var = flag.value.casefold()
+
+    def test_stylevar(_):
+        return STYLE_VARS[var]
+    return test_stylevar
+
+
+@make_flag_compiler('has')
+def compile_voice_has(flag):
+    attr = flag.value.casefold()
+
+    def test_voice_has(_):
+        return VOICE_ATTR[attr]
+    return test_voice_has
+
+
+@make_flag_compiler('Game')
+def compile_game(flag):
+    game_id = utils.STEAM_IDS.get(flag.value.upper(), flag.value)
+
+    def test_game(_):
+        return OPTIONS['game_id'] == game_id
+    return test_game
+
+
+@make_flag_compiler('ifOption')
+def compile_option(flag):
+    bits = flag.value.split(' ', 1)
+    key = bits[0].casefold()
+
+    def test_option(_):
+        if key in OPTIONS:
+            return OPTIONS[key] == bits[1]
+        else:
+            return False
+    return test_option
+
+
+# The game mode and preview state never change once the map is loaded.
+
+
+@make_flag_compiler('ifMode', 'iscoop', 'gamemode')
+def compile_game_mode(flag):
+    return flag_true if flag_game_mode(None, flag) else flag_false
+
+
+@make_flag_compiler('ifPreview', 'preview')
+def compile_is_preview(flag):
+    return flag_true if flag_is_preview(None, flag) else flag_false
+
+
+@make_result('styleVar', is_global=True)
 def res_set_style_var(_, res):
     """Set Style Vars.
 
@@ -130,7 +188,7 @@ def res_set_style_var(_, res):
     return RES_EXHAUSTED
 
 
-@make_result('has')
+@make_result('has', is_global=True)
 def res_set_voice_attr(_, res):
     """Sets a number of Voice Attributes.
 
@@ -145,7 +203,7 @@ def res_set_voice_attr(_, res):
     return RES_EXHAUSTED
 
 
-@make_result('setOption')
+@make_result('setOption', is_global=True)
 def res_set_option(_, res):
     """Set a value in the "options" part of VBSP_config.
 
@@ -4,7 +4,7 @@
 import operator
 
 from conditions import (
-    make_flag, make_result,
+    make_flag, make_flag_compiler, make_result,
     ALL_INST,
 )
 from instanceLocs import resolve as resolve_inst
@@ -23,7 +23,25 @@ def flag_file_cont(inst, flag):
     return flag.value in inst['file'].casefold()
 
 
-@make_flag('hasInst')
+@make_flag_compiler('instance')
+def compile_file_equal(flag):
+    files = frozenset(resolve_inst(flag.value))
+
+    def test_file_equal(inst):
+        return inst['file'].casefold() in files
+    return test_file_equal
+
+
+@make_flag_compiler('instFlag', 'InstPart')
+def compile_file_cont(flag):
+    part = flag.value
+
+    def test_file_cont(inst):
+        return part in inst['file'].casefold()
+    return test_file_cont
+
+
+@make_flag('hasInst', is_global=True)
 def flag_has_inst(_, flag):
     """Checks if the given instance is present anywhere in the map."""
     flags = resolve_inst(flag.value)
@@ -75,6 +93,38 @@ def flag_instvar(inst, flag):
         return inst.fixup[variable] == value
 
 
+@make_flag_compiler('instVar')
+def compile_instvar(flag):
+    values = flag.value.split(' ')
+    if len(values) == 3:
+        variable, op, comp_val = values
+        op = INSTVAR_COMP.get(op, operator.eq)
+        try:
+            comp_float = float(comp_val)
+        except ValueError:
+            comp_float = None
+
+        def test_instvar(inst):
+            value = inst.fixup[variable]
+            if comp_float is not None:
+                # Compare as floats if both can be converted.
+                try:
+                    return op(float(value), comp_float)
+                except ValueError:
+                    pass
+            return op(value, comp_val)
+    elif len(values) == 2:
+        variable, comp_val = values
+
+        def test_instvar(inst):
+            return inst.fixup[variable] == comp_val
+    else:
+        # Invalid, let the flag produce the error.
+        def test_instvar(inst):
+            return flag_instvar(inst, flag)
+    return test_instvar
+
+
 @make_result('rename', 'changeInstance')
 def res_change_instance(inst, res):
     """Set the file to a value."""
@@ -1,42 +1,86 @@
 """Logical flags used to combine others (AND, OR, NOT, etc)."""
 
-from conditions import make_flag, check_flag
+from conditions import (
+    make_flag, make_flag_compiler, check_flag,
+    compile_flags, compile_flag, invert_flag, flag_false,
+    is_global_flag,
+)
 
 
-@make_flag('AND')
+def sub_flags(flag):
+    """Get the flags inside a logical flag."""
+    if flag.has_children():
+        return flag.value
+    return []
+
+
+def sub_flags_global(flag):
+    """Logical flags are global if all their sub-flags are."""
+    return all(is_global_flag(sub_flag) for sub_flag in sub_flags(flag))
+
+
+@make_flag('AND', is_global=sub_flags_global)
 def flag_and(inst, flag):
     """The AND group evaluates True if all sub-flags are True."""
-    for sub_flag in flag:
+    for sub_flag in sub_flags(flag):
         if not check_flag(sub_flag, inst):
             return False
     # If the AND block is empty, return True
-    return len(flag.value) == 0
+    return True
 
 
-@make_flag('OR')
+@make_flag('OR', is_global=sub_flags_global)
 def flag_or(inst, flag):
     """The OR group evaluates True if any sub-flags are True."""
-    for sub_flag in flag:
+    for sub_flag in sub_flags(flag):
         if check_flag(sub_flag, inst):
             return True
     return False
 
 
-@make_flag('NOT')
+@make_flag('NOT', is_global=sub_flags_global)
 def flag_not(inst, flag):
     """The NOT group inverts the value of it's one sub-flag."""
-    if len(flag.value) == 1:
+    if len(sub_flags(flag)) == 1:
         return not check_flag(flag[0], inst)
     return False
 
 
-@make_flag('NOR')
+@make_flag('NOR', is_global=sub_flags_global)
 def flag_nor(inst, flag):
     """The NOR group evaluates True if any sub-flags are False."""
     return not flag_or(inst, flag)
 
 
-@make_flag('NAND')
+@make_flag('NAND', is_global=sub_flags_global)
 def flag_nand(inst, flag):
     """The NAND group evaluates True if all sub-flags are False."""
-    return not flag_and(inst, flag)
\ No newline at end of file
+    return not flag_and(inst, flag)
+
+
+@make_flag_compiler('AND')
+def compile_and(flag):
+    return compile_flags(sub_flags(flag), require_all=True)
+
+
+@make_flag_compiler('OR')
+def compile_or(flag):
+    return compile_flags(sub_flags(flag), require_all=False)
+
+
+@make_flag_compiler('NOT')
+def compile_not(flag):
+    children = sub_flags(flag)
+    if len(children) == 1:
+        return invert_flag(compile_flag(children[0]))
+    return flag_false
+
+
+@make_flag_compiler('NOR')
+def compile_nor(flag):
+    return invert_flag(compile_or(flag))
+
+
+@make_flag_compiler('NAND')
+def compile_nand(flag):
+    return invert_flag(compile_and(flag))
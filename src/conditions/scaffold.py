@@ -87,7 +87,7 @@ def res_unst_scaffold_setup(res):
     return group  # We look up the group name to find the values.
 
 
-@make_result('UnstScaffold')
+@make_result('UnstScaffold', is_global=True)
 def res_unst_scaffold(_, res):
     """The condition to generate Unstationary Scaffolds.
 
@@ -12,7 +12,7 @@ import vbsp
 LOGGER = utils.getLogger(__name__, alias='cond.trackPlat')
 
 
-@make_result('trackPlatform')
+@make_result('trackPlatform', is_global=True)
 def res_track_plat(_, res):
     """Logic specific to Track Platforms.
 
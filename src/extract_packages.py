@@ -1,30 +1,29 @@
 # coding=utf-8
 """
-Handles extracting all the package resources in a background process, so users
+Handles extracting all the package resources in a background thread, so users
 can do other things without waiting.
 """
 import tkinter as tk
+from tkinter import messagebox
 
-import multiprocessing
-import shutil
 import os.path
 
-from zipfile import ZipFile
-
-from FakeZip import zip_names, FakeZip
 from tk_tools import TK_ROOT
+import packageExtract
 import utils
 
 LOGGER = utils.getLogger(__name__)
 
 UPDATE_INTERVAL = 500  # Number of miliseconds between each progress check
 
+# Records the resources extracted into cache/resources/.
+MANIFEST_LOC = '../config/resource_extract.bin'
+
 files_done = False
 res_count = -1
 progress_var = tk.IntVar()
 zip_list = []
-currently_done = multiprocessing.Value('I')  # int value used to show status
-# in main window
+extractor = None  # type: packageExtract.Extractor
 export_btn_text = tk.StringVar()
 
 
@@ -32,51 +31,58 @@ def done_callback():
     pass
 
 
-def do_copy(zip_list, done_files):
-    cache_path = os.path.abspath('../cache/')
-    shutil.rmtree(cache_path, ignore_errors=True)
-
-    img_loc = os.path.join('resources', 'bee2')
-    for zip_path in zip_list:
-        if os.path.isfile(zip_path):
-            zip_file = ZipFile(zip_path)
-        else:
-            zip_file = FakeZip(zip_path)
-        with zip_file:
-            for path in zip_names(zip_file):
-                loc = os.path.normcase(path)
-                if loc.startswith("resources"):
-                    # Don't re-extract images
-                    if not loc.startswith(img_loc):
-                        zip_file.extract(path, path=cache_path)
-                    with done_files.get_lock():
-                        done_files.value += 1
-
-
 def start_copying(zip_list):
-    global copy_process
-    copy_process = multiprocessing.Process(
-        target=do_copy,
-        args=(zip_list, currently_done),
+    """Begin extracting resources in a background thread."""
+    global extractor
+    extractor = packageExtract.Extractor(
+        zip_list,
+        'resources',
+        os.path.abspath('../cache/resources/'),
+        MANIFEST_LOC,
+        # Images are extracted when loading packages.
+        exclude=['bee2'],
     )
-    copy_process.daemon = True
-    LOGGER.info('Starting background process!')
-    copy_process.start()
+    LOGGER.info('Starting background extraction!')
+    extractor.start()
     TK_ROOT.after(UPDATE_INTERVAL, update)
 
+
+def cancel():
+    """Stop extracting resources, if it's in progress."""
+    if extractor is not None:
+        extractor.cancel()
+
+
 def update():
     """Check the progress of the copying until it's done.
     """
-    progress_var.set(
-        1000 * currently_done.value / res_count,
-    )
-    export_btn_text.set(
-        'Extracting Resources ({!s}/{!s})...'.format(
-            currently_done.value,
-            res_count,
+    event = None
+    while not extractor.events.empty():
+        event = extractor.events.get_nowait()
+
+    if event is not None:
+        progress_var.set(
+            1000 * event.files / max(event.total_files, 1),
         )
-    )
-    if not copy_process.is_alive():
+        export_btn_text.set(
+            'Extracting Resources ({!s}/{!s}, {:.1f} MB/s)...'.format(
+                event.files,
+                event.total_files,
+                event.bytes_per_sec / 1024 / 1024,
+            )
+        )
+    if not extractor.is_alive():
+        if extractor.error is not None:
+            # Leave exporting disabled, the cache is incomplete.
+            export_btn_text.set('Extraction Failed!')
+            messagebox.showerror(
+                title='BEE2 - Extraction Failed!',
+                message='Extracting package resources failed:\n{!s}'.format(
+                    extractor.error,
+                ),
+                master=TK_ROOT,
+            )
+            return
         # We've finished copying
         export_btn_text.set(
             'Export...'
@@ -0,0 +1,236 @@
+"""Write files into a game, skipping any which haven't changed.
+
+A manifest records the size and modification time of each source and
+destination file when it was copied, and a CRC of the contents. If both
+stats still match, the file is skipped without reading it. If only the
+source changed (for example when packages are extracted again), the CRC
+decides whether a copy is needed. Generated config files are handled
+the same way with write_output(), using a hash of the new text.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+import hashlib
+import os
+import pickle
+import shutil
+import zlib
+
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# Increment if the format of the manifest changes.
+MANIFEST_VERSION = 1
+
+# The number of bytes read at once when computing CRCs.
+CRC_BLOCK_SIZE = 1024 * 1024
+
+# The number of files copied at once.
+MAX_WORKERS = 4
+
+
+class SyncStats:
+    """The number of files handled by sync_folder()."""
+    __slots__ = ['copied', 'unchanged', 'deleted']
+
+    def __init__(self):
+        self.copied = 0
+        self.unchanged = 0
+        self.deleted = 0
+
+    def __iadd__(self, other: 'SyncStats'):
+        self.copied += other.copied
+        self.unchanged += other.unchanged
+        self.deleted += other.deleted
+        return self
+
+    def __str__(self):
+        return '{} copied, {} unchanged, {} deleted'.format(
+            self.copied,
+            self.unchanged,
+            self.deleted,
+        )
+
+
+def load_manifest(filename):
+    """Read the manifest file.
+
+    This maps destination folders to {relative path: entry} dicts.
+    Each entry is (src size, src mtime, dest size, dest mtime, crc).
+    """
+    try:
+        with open(filename, 'rb') as f:
+            version, manifest = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        LOGGER.warning('Resource manifest is corrupt, ignoring.')
+        return {}
+    if version != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def save_manifest(filename, manifest):
+    """Write the manifest back to disk."""
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp_file = filename + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump(
+                (MANIFEST_VERSION, manifest),
+                f,
+                pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_file, filename)
+    except OSError:
+        LOGGER.warning('Could not save resource manifest!')
+
+
+def file_crc(path):
+    """Compute the CRC32 of a file."""
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CRC_BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _stat(path):
+    """Return (size, mtime), or None if the file doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _walk_files(folder):
+    """Yield the relative paths of all files in a folder."""
+    for dirpath, dirnames, filenames in os.walk(folder):
+        rel_dir = os.path.relpath(dirpath, folder)
+        for filename in filenames:
+            if rel_dir == os.curdir:
+                yield filename
+            else:
+                yield os.path.join(rel_dir, filename)
+
+
+def _copy_file(src, dest):
+    """Copy a file, using a hard link if possible."""
+    with suppress(FileNotFoundError):
+        os.remove(dest)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        # Different filesystems, or links aren't supported.
+        shutil.copy2(src, dest)
+
+
+def _sync_file(src, dest, src_stat, entry):
+    """Copy a file if its contents changed.
+
+    This returns the new manifest entry, and if it was copied.
+    """
+    crc = file_crc(src)
+    dest_stat = _stat(dest)
+    if entry is not None and dest_stat == tuple(entry[2:4]) and crc == entry[4]:
+        # The contents are the same, only the source was touched.
+        return src_stat + dest_stat + (crc,), False
+    _copy_file(src, dest)
+    return src_stat + _stat(dest) + (crc,), True
+
+
+def sync_folder(source, dest, manifest, step_func=None):
+    """Make dest contain the same files as source.
+
+    manifest is the dict for this destination, and will be updated.
+    step_func is called once for each source file, from this thread.
+    It is passed True if the file was unchanged.
+    """
+    stats = SyncStats()
+    old_entries = manifest.copy()
+    manifest.clear()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        jobs = []
+        for rel_path in _walk_files(source):
+            src_path = os.path.join(source, rel_path)
+            dest_path = os.path.join(dest, rel_path)
+            src_stat = _stat(src_path)
+            entry = old_entries.pop(rel_path, None)
+            if (
+                    entry is not None and
+                    src_stat == tuple(entry[0:2]) and
+                    _stat(dest_path) == tuple(entry[2:4])
+                    ):
+                # Neither file has changed, skip reading it.
+                manifest[rel_path] = entry
+                stats.unchanged += 1
+                if step_func is not None:
+                    step_func(True)
+                continue
+            jobs.append((rel_path, executor.submit(
+                _sync_file,
+                src_path,
+                dest_path,
+                src_stat,
+                entry,
+            )))
+
+        for rel_path, job in jobs:
+            manifest[rel_path], copied = job.result()
+            if copied:
+                stats.copied += 1
+            else:
+                stats.unchanged += 1
+            if step_func is not None:
+                step_func(not copied)
+
+    # Remove any files that aren't in the source anymore.
+    if os.path.isdir(dest):
+        for rel_path in list(_walk_files(dest)):
+            if rel_path not in manifest:
+                with suppress(OSError):
+                    os.remove(os.path.join(dest, rel_path))
+                    stats.deleted += 1
+        _remove_empty_dirs(dest)
+    return stats
+
+
+def _remove_empty_dirs(folder):
+    """Remove any empty subfolders left after deleting files."""
+    for dirpath, dirnames, filenames in os.walk(folder, topdown=False):
+        if dirpath != folder and not os.listdir(dirpath):
+            with suppress(OSError):
+                os.rmdir(dirpath)
+
+
+def write_output(path, lines, manifest):
+    """Write the given lines of text to path, if they changed.
+
+    manifest maps paths to (size, mtime, hash) of the last write. If the
+    file still matches that and the text has the same hash, it is left
+    alone. Otherwise it is replaced atomically.
+    Returns True if the file was written.
+    """
+    text = ''.join(lines)
+    digest = hashlib.sha1(text.encode('utf8')).digest()
+    entry = manifest.get(path)
+    if (
+            entry is not None and
+            entry[2] == digest and
+            _stat(path) == tuple(entry[0:2])
+            ):
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w') as f:
+        f.write(text)
+    os.replace(temp_file, path)
+    manifest[path] = _stat(path) + (digest,)
+    return True
@@ -7,6 +7,7 @@ Does stuff related to the actual games.
 """
 import os
 import os.path
+import io
 import shutil
 
 from tkinter import *  # ui library
@@ -22,6 +23,7 @@ import loadScreen
 import packageLoader
 import extract_packages
 import backup
+import fileSync
 
 LOGGER = utils.getLogger(__name__)
 
@@ -60,6 +62,12 @@ _UNLOCK_ITEMS = [
 # The location of all the instances in the game directory
 INST_PATH = 'sdk_content/maps/instances/BEE2'
 
+# Records which resources were copied into each game, so unchanged files
+# can be skipped on the next export.
+RES_MANIFEST_LOC = '../config/resource_manifest.bin'
+# Records the generated config files, so identical ones aren't rewritten.
+OUTPUT_MANIFEST_LOC = '../config/export_manifest.bin'
+
 # The line we inject to add our BEE2 folder into the game search path.
 # We always add ours such that it's the highest priority, other
 # than '|gameinfo_path|.'
@@ -155,8 +163,12 @@ class Game:
     def abs_path(self, path):
         return os.path.normcase(os.path.join(self.root, path))
 
-    def add_editor_sounds(self, sounds):
-        """Add soundscript items so they can be used in the editor."""
+    def add_editor_sounds(self, sounds, manifest):
+        """Add soundscript items so they can be used in the editor.
+
+        manifest is passed to fileSync.write_output(), and this returns
+        True if the file needed to be changed.
+        """
         # PeTI only loads game_sounds_editor, so we must modify that.
         # First find the highest-priority file
         for folder in self.dlc_priority():
@@ -186,13 +198,11 @@ class Game:
                 del file_data[i:]
 
         # Then add our stuff!
-        with open(file, 'w') as f:
-            f.writelines(file_data)
-            f.write(EDITOR_SOUND_LINE + '\n')
-            for sound in sounds:
-                for line in sound.data.export():
-                    f.write(line)
-                f.write('\n')  # Add a little spacing
+        file_data.append(EDITOR_SOUND_LINE + '\n')
+        for sound in sounds:
+            file_data.extend(sound.data.export())
+            file_data.append('\n')  # Add a little spacing
+        return fileSync.write_output(file, file_data, manifest)
 
     def edit_gameinfo(self, add_line=False):
         """Modify all gameinfo.txt files to add or remove our line.
@@ -255,14 +265,13 @@ class Game:
             self.clear_cache()
 
     def refresh_cache(self):
-        """Copy over the resource files into this game."""
+        """Copy over the resource files into this game.
 
+        Only files which changed since the last export are copied.
+        """
+        manifest = fileSync.load_manifest(RES_MANIFEST_LOC)
         screen_func = export_screen.step
-        copy2 = shutil.copy2
-
-        def copy_func(src, dest):
-            screen_func('RES')
-            copy2(src, dest)
+        total = fileSync.SyncStats()
 
         for folder in os.listdir('../cache/resources/'):
             source = os.path.join('../cache/resources/', folder)
@@ -273,12 +282,17 @@ class Game:
             else:
                 dest = self.abs_path(os.path.join('bee2', folder))
             LOGGER.info('Copying to "{}" ...', dest)
-            try:
-                shutil.rmtree(dest)
-            except (IOError, shutil.Error):
-                pass
+            stats = fileSync.sync_folder(
+                source,
+                dest,
+                manifest.setdefault(os.path.normcase(dest), {}),
+                lambda skipped: screen_func('RES', skipped),
+            )
+            LOGGER.info('{}: {}', dest, stats)
+            total += stats
 
-            shutil.copytree(source, dest, copy_function=copy_func)
+        fileSync.save_manifest(RES_MANIFEST_LOC, manifest)
+        LOGGER.info('Resources: {}', total)
 
     def clear_cache(self):
         """Remove all resources from the game."""
@@ -286,6 +300,14 @@ class Game:
         shutil.rmtree(self.abs_path('bee2/'), ignore_errors=True)
         shutil.rmtree(self.abs_path('bin/bee2/'), ignore_errors=True)
 
+        # Forget what was copied, since it's all gone now.
+        manifest = fileSync.load_manifest(RES_MANIFEST_LOC)
+        root = os.path.normcase(self.abs_path(''))
+        for dest in list(manifest):
+            if dest.startswith(root):
+                del manifest[dest]
+        fileSync.save_manifest(RES_MANIFEST_LOC, manifest)
+
     def export(
             self,
             style,
@@ -520,43 +542,67 @@ class Game:
 
         export_screen.step('CONF')
 
+        # Each output is only rewritten if the generated text changed.
+        output_manifest = fileSync.load_manifest(OUTPUT_MANIFEST_LOC)
+        written_count = output_count = 0
+
+        def count_output(written):
+            nonlocal written_count, output_count
+            output_count += 1
+            if written:
+                written_count += 1
+            export_screen.step('CONF', not written)
+
+        def write_output(path, lines):
+            written = fileSync.write_output(
+                self.abs_path(path),
+                lines,
+                output_manifest,
+            )
+            if not written:
+                LOGGER.info('"{}" is unchanged.', path)
+            count_output(written)
+
         LOGGER.info('Writing Editoritems!')
-        os.makedirs(self.abs_path('portal2_dlc2/scripts/'), exist_ok=True)
-        with open(self.abs_path(
-                'portal2_dlc2/scripts/editoritems.txt'), 'w') as editor_file:
-            for line in editoritems.export():
-                editor_file.write(line)
-        export_screen.step('CONF')
+        write_output(
+            'portal2_dlc2/scripts/editoritems.txt',
+            editoritems.export(),
+        )
 
         LOGGER.info('Writing VBSP Config!')
-        os.makedirs(self.abs_path('bin/bee2/'), exist_ok=True)
-        with open(self.abs_path('bin/bee2/vbsp_config.cfg'), 'w') as vbsp_file:
-            for line in vbsp_config.export():
-                vbsp_file.write(line)
-        export_screen.step('CONF')
+        write_output('bin/bee2/vbsp_config.cfg', vbsp_config.export())
 
         LOGGER.info('Writing instance list!')
-        with open(self.abs_path('bin/bee2/instances.cfg'), 'w') as inst_file:
-            for line in self.build_instance_data(editoritems):
-                inst_file.write(line)
-        export_screen.step('CONF')
+        write_output(
+            'bin/bee2/instances.cfg',
+            self.build_instance_data(editoritems),
+        )
 
         LOGGER.info('Writing packing list!')
-        with open(self.abs_path('bin/bee2/pack_list.cfg'), 'w') as pack_file:
-            for line in pack_block.export():
-                pack_file.write(line)
-        export_screen.step('CONF')
+        write_output('bin/bee2/pack_list.cfg', pack_block.export())
 
         LOGGER.info('Editing game_sounds!')
-        self.add_editor_sounds(editor_sounds.values())
-        export_screen.step('CONF')
+        sounds_written = self.add_editor_sounds(
+            editor_sounds.values(),
+            output_manifest,
+        )
+        if not sounds_written:
+            LOGGER.info('game_sounds_editor is unchanged.')
+        count_output(sounds_written)
 
         LOGGER.info('Exporting {} templates!',
             len(packageLoader.data['BrushTemplate'])
         )
-        with open(self.abs_path('bin/bee2/templates.vmf'), 'w') as temp_file:
-            packageLoader.TEMPLATE_FILE.export(temp_file)
-        export_screen.step('CONF')
+        template_buf = io.StringIO()
+        packageLoader.TEMPLATE_FILE.export(template_buf)
+        write_output('bin/bee2/templates.vmf', [template_buf.getvalue()])
+
+        fileSync.save_manifest(OUTPUT_MANIFEST_LOC, output_manifest)
+        LOGGER.info(
+            'Config files: {} regenerated, {} unchanged.',
+            written_count,
+            output_count - written_count,
+        )
 
         if voice is not None:
             for prefix, dest, pretty in VOICE_PATHS:
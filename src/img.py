@@ -7,12 +7,16 @@ it could get deleted, which will make the rendered image vanish.
 from PIL import ImageTk, Image
 import os.path
 
+from thumbCache import ThumbnailCache
 import utils
 
 LOGGER = utils.getLogger('img')
 
 cached_img = {}
 
+# Resized images are loaded from here, to skip decoding and resizing.
+THUMBNAILS = ThumbnailCache('../config/')
+
 def png(path, resize_to=None, error=None, algo=Image.LANCZOS):
     """Loads in an image for use in TKinter.
 
@@ -20,14 +24,14 @@ def png(path, resize_to=None, error=None, algo=Image.LANCZOS):
     - Images will be loaded from both the inbuilt files and the extracted
     zip cache.
     - If resize_to is set, the image will be resized to that size using the algo
-    algorithm.
+    algorithm. Resized images are stored in THUMBNAILS.
     """
     if not path.casefold().endswith(".png"):
         path += ".png"
     orig_path = path
 
-    if (orig_path, resize_to) in cached_img:
-        return cached_img[orig_path, resize_to]
+    if (orig_path, resize_to, algo) in cached_img:
+        return cached_img[orig_path, resize_to, algo]
 
     base_path = os.path.abspath(
         os.path.join(
@@ -53,17 +57,17 @@ def png(path, resize_to=None, error=None, algo=Image.LANCZOS):
         # If not in the main folder, load from the zip-cache
         path = cache_path
 
-    if os.path.isfile(path):
-        image = Image.open(path)
-    else:
+    if not os.path.isfile(path):
         LOGGER.warning('ERROR: "images/{}" does not exist!', orig_path)
         return error or img_error
 
     if resize_to:
-        image = image.resize((resize_to, resize_to), algo)
+        image = THUMBNAILS.get(path, resize_to, algo)
+    else:
+        image = Image.open(path)
 
     img = ImageTk.PhotoImage(image=image)
-    cached_img[path, resize_to] = img
+    cached_img[orig_path, resize_to, algo] = img
     return img
 
 
@@ -12,6 +12,7 @@ class LoadScreen(Toplevel):
         self.labels = {}
         self.bar_var = {}
         self.bar_val = {}
+        self.skipped = {}
         self.maxes = {}
         self.num_images = 0
 
@@ -61,6 +62,7 @@ class LoadScreen(Toplevel):
                         )
             self.bar_var[st_id] = IntVar()
             self.bar_val[st_id] = 0
+            self.skipped[st_id] = 0
             self.maxes[st_id] = 10
 
             self.widgets[st_id] = ttk.Progressbar(
@@ -93,10 +95,16 @@ class LoadScreen(Toplevel):
             self.maxes[stage] = num
             self.set_nums(stage)
 
-    def step(self, stage):
-        """Increment a step by one."""
+    def step(self, stage, skipped=False):
+        """Increment a step by one.
+
+        If skipped is True, the step was unchanged and didn't need any work.
+        This is counted separately on the label.
+        """
         if self.active:
             self.bar_val[stage] += 1
+            if skipped:
+                self.skipped[stage] += 1
             self.set_nums(stage)
             self.widgets[stage].update()
 
@@ -108,6 +116,10 @@ class LoadScreen(Toplevel):
             self.bar_val[stage],
             self.maxes[stage],
         )
+        if self.skipped[stage]:
+            self.labels[stage]['text'] += ' ({!s} unchanged)'.format(
+                self.skipped[stage],
+            )
 
     def skip_stage(self, stage):
         """Skip over this stage of the loading process."""
@@ -122,6 +134,7 @@ class LoadScreen(Toplevel):
         for stage, _ in self.stages:
             self.maxes[stage] = 10
             self.bar_val[stage] = 0
+            self.skipped[stage] = 0
             self.bar_var[stage].set(0)
             self.labels[stage]['text'] = '0/??'
             self.set_nums(stage)
@@ -134,6 +147,7 @@ class LoadScreen(Toplevel):
             del self.maxes
             del self.bar_var
             del self.bar_val
+            del self.skipped
             self.active = False
 
     def __enter__(self):
@@ -0,0 +1,164 @@
+"""Caches the parsed Property trees of files in packages.
+
+Parsing every config file in every package takes a while, so the results
+are saved to disk. Packages are keyed by their path and zip mtime/size,
+and each file by its CRC32 (or mtime for folder packages). This way
+changed packages are invalidated individually.
+"""
+from zipfile import ZipFile
+import os
+import pickle
+
+from property_parser import Property
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# Increment if the format of the cache file changes.
+CACHE_VERSION = 1
+
+
+def prop_to_tuple(prop: Property):
+    """Convert a Property tree into compact (name, value) tuples."""
+    if prop.has_children():
+        return prop.real_name, [prop_to_tuple(child) for child in prop.value]
+    else:
+        return prop.real_name, prop.value
+
+
+def tuple_to_prop(tup) -> Property:
+    """Convert the tuples from prop_to_tuple() back into a Property tree."""
+    name, value = tup
+    if isinstance(value, list):
+        return Property(name, [tuple_to_prop(child) for child in value])
+    else:
+        return Property(name, value)
+
+
+def _package_path(zip_file):
+    """Get the normalised path to a package."""
+    if isinstance(zip_file, ZipFile):
+        return os.path.normcase(os.path.abspath(zip_file.filename))
+    else:
+        return os.path.normcase(os.path.abspath(zip_file.folder))
+
+
+def _package_stamp(path):
+    """Get a (mtime, size) stamp for a package.
+
+    Folders don't have a stamp, since changing files inside doesn't
+    alter the folder.
+    """
+    if os.path.isdir(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def _file_key(zip_file, path):
+    """Get a value which changes if the given file changes.
+
+    For zips this is the CRC and size, for folders the mtime and size.
+    This raises KeyError if the file doesn't exist, like ZipFile.open().
+    """
+    if isinstance(zip_file, ZipFile):
+        info = zip_file.getinfo(path)
+        return info.CRC, info.file_size
+    else:
+        try:
+            stat = os.stat(os.path.join(zip_file.folder, path))
+        except FileNotFoundError as err:
+            raise KeyError(path) from err
+        return stat.st_mtime, stat.st_size
+
+
+class PackageCache:
+    """Stores parsed Property trees for files in packages.
+
+    Call load() before parsing files, and save() when done. Only packages
+    used since the last load() are saved.
+    """
+    def __init__(self, filename, root='../config'):
+        self.filename = os.path.join(root, filename)
+        # Package path -> (package stamp, {file path: (file stamp, tree)})
+        self._old = {}
+        # The same, for packages we've used this time.
+        self._new = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Read the cache file."""
+        self._old = {}
+        self._new = {}
+        self.hits = self.misses = 0
+        try:
+            with open(self.filename, 'rb') as f:
+                version, cache = pickle.load(f)
+        except FileNotFoundError:
+            LOGGER.info('No package cache, parsing all files.')
+            return
+        except Exception:
+            LOGGER.warning('Package cache is corrupt, ignoring.')
+            return
+        if version == CACHE_VERSION:
+            self._old = cache
+        else:
+            LOGGER.info('Package cache is outdated, ignoring.')
+
+    def save(self):
+        """Write the trees for the packages we used back to disk."""
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_file = self.filename + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                pickle.dump(
+                    (CACHE_VERSION, self._new),
+                    f,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(temp_file, self.filename)
+        except OSError:
+            LOGGER.warning('Could not save package cache!')
+
+    def _pack_files(self, zip_file):
+        """Get the file dict for a package, discarding it if changed."""
+        pak_path = _package_path(zip_file)
+        try:
+            return self._new[pak_path][1]
+        except KeyError:
+            pass
+        pak_stamp = _package_stamp(pak_path)
+        old_stamp, files = self._old.pop(pak_path, (None, None))
+        if files is None or old_stamp != pak_stamp:
+            files = {}
+        self._new[pak_path] = pak_stamp, files
+        return files
+
+    def parse(self, zip_file, path, filename=''):
+        """Parse the given file in the package, or fetch it from the cache.
+
+        filename is used for error messages, like in Property.parse().
+        This raises KeyError if the file is not present.
+        """
+        files = self._pack_files(zip_file)
+        file_stamp = _file_key(zip_file, path)
+        try:
+            old_stamp, tree = files[path]
+        except KeyError:
+            pass
+        else:
+            if old_stamp == file_stamp:
+                self.hits += 1
+                return tuple_to_prop(tree)
+
+        self.misses += 1
+        with zip_file.open(path) as f:
+            prop = Property.parse(f, filename)
+        files[path] = file_stamp, prop_to_tuple(prop)
+        return prop
+
+
+PARSE_CACHE = PackageCache('package_cache.bin')
@@ -0,0 +1,402 @@
+"""Extract files from packages into a folder, skipping unchanged ones.
+
+A manifest records where each file came from - the CRC and size of the
+zip member, or the size and modification time for folder packages - as
+well as the size and modification time of the extracted file. If both
+match on the next launch the file is left alone. Files overridden by
+later packages are only written once. Each package is extracted by a
+separate worker thread, and members are streamed directly to their final
+location.
+
+This doesn't use Tk, so it can also be run from the command line:
+    packageExtract.py <dest> <package or folder>...
+which extracts the resources from each package into dest/resources/.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from zipfile import ZipFile
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+from FakeZip import FakeZip, zip_names, zip_open_bin
+import fileSync
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# The number of packages extracted at once.
+MAX_WORKERS = 4
+
+# The minimum number of seconds between each progress event.
+EVENT_INTERVAL = 0.1
+
+
+class Progress(namedtuple('Progress', [
+        'files', 'total_files',
+        'bytes', 'total_bytes',
+        'elapsed', 'done',
+        ])):
+    """An event sent to Extractor.events as files are extracted.
+
+    files and bytes count the members which were checked or extracted.
+    Once the extraction finishes or is cancelled, an event with done set
+    is sent.
+    """
+    __slots__ = ()
+
+    @property
+    def files_per_sec(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+
+def _member_key(zip_file, name):
+    """Get the size and a value which changes when this member does."""
+    if isinstance(zip_file, FakeZip):
+        stat = os.stat(os.path.join(zip_file.folder, name))
+        return 'file', stat.st_size, stat.st_mtime_ns
+    else:
+        info = zip_file.getinfo(name)
+        return 'zip', info.file_size, info.CRC
+
+
+def _stat(path):
+    """Return (size, mtime), or None if the file doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def open_package(path):
+    """Open a package zip or folder."""
+    if os.path.isfile(path):
+        return ZipFile(path)
+    else:
+        return FakeZip(path)
+
+
+def find_packages(folder):
+    """Yield the paths of all packages in a folder, recursing if necessary.
+
+    This matches the search done by packageLoader.
+    """
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            if os.path.isfile(os.path.join(path, 'info.txt')):
+                yield path
+            else:
+                yield from find_packages(path)
+        elif name.endswith('.zip'):
+            yield path
+
+
+class Extractor:
+    """Extracts a folder from each package into a destination folder.
+
+    zips is a list of package paths, or opened ZipFiles and FakeZips, in
+    the order packages are loaded - later ones override earlier files with
+    the same name. Members inside prefix are extracted, with prefix
+    stripped from the names. Any paths (relative to prefix) in exclude are
+    skipped. Files in dest which aren't in any package are removed.
+
+    Progress tuples are put into the events queue as work progresses.
+    If start() is used and extraction fails, the exception is stored in
+    error.
+    """
+    def __init__(
+            self,
+            zips,
+            prefix,
+            dest,
+            manifest_loc,
+            exclude=(),
+            ):
+        self.zips = list(zips)
+        self.prefix = os.path.normcase(prefix).casefold()
+        self.exclude = tuple(
+            os.path.normcase(path).casefold()
+            for path in exclude
+        )
+        self.dest = dest
+        self.manifest_loc = manifest_loc
+
+        self.events = queue.Queue()
+        self.extracted = 0
+        self.error = None
+        self.thread = None
+        self._cancel = threading.Event()
+
+        self._lock = threading.Lock()
+        self._start_time = 0
+        self._last_event = 0
+        self._files = self._total_files = 0
+        self._bytes = self._total_bytes = 0
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Stop extracting files.
+
+        Members already written are kept, and will be skipped next time.
+        """
+        self._cancel.set()
+
+    def start(self):
+        """Run the extraction in a background thread."""
+        self.thread = threading.Thread(
+            target=self._run_background,
+            name='packageExtract',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def is_alive(self):
+        """Check if the background thread is still running."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def _progress(self, files, size, done=False):
+        """Record that some files were handled, and send an event."""
+        with self._lock:
+            self._files += files
+            self._bytes += size
+            now = time.perf_counter()
+            if not done and now - self._last_event < EVENT_INTERVAL:
+                return
+            self._last_event = now
+            self.events.put(Progress(
+                self._files,
+                self._total_files,
+                self._bytes,
+                self._total_bytes,
+                now - self._start_time,
+                done,
+            ))
+
+    def _extract_members(self, zip_file, members):
+        """Extract the given (name, rel_path, key) members from a package.
+
+        This returns the new manifest entries.
+        """
+        entries = {}
+        for name, rel_path, key in members:
+            if self._cancel.is_set():
+                break
+            path = os.path.join(self.dest, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + '.tmp'
+            with zip_open_bin(zip_file, name) as src:
+                with open(temp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.replace(temp_path, path)
+            entries[rel_path] = (key, _stat(path))
+            self._progress(1, key[1])
+        return entries
+
+    def run(self, step_func=None):
+        """Extract all the files, blocking until complete.
+
+        step_func is called once for each member, from this thread.
+        It is passed True if the file was unchanged.
+        Returns the number of files extracted.
+        """
+        self._start_time = self._last_event = time.perf_counter()
+        opened = []
+        zips = []
+        try:
+            for zip_file in self.zips:
+                if isinstance(zip_file, str):
+                    zip_file = open_package(zip_file)
+                    opened.append(zip_file)
+                zips.append(zip_file)
+            return self._run(zips, step_func)
+        finally:
+            for zip_file in opened:
+                zip_file.close()
+            self._progress(0, 0, done=True)
+
+    def _run_background(self):
+        """The target for the background thread."""
+        try:
+            self.run()
+        except Exception as exc:
+            LOGGER.exception('Extracting to "{}" failed!', self.dest)
+            self.error = exc
+
+    def _run(self, zips, step_func):
+        """Implements run(), once the packages are opened."""
+        old_manifest = fileSync.load_manifest(self.manifest_loc)
+        manifest = {}
+
+        # Find the package each file comes from, and the total number.
+        sources = {}
+        member_count = 0
+        for zip_file in zips:
+            for name in zip_names(zip_file):
+                loc = os.path.normcase(name)
+                if not loc.casefold().startswith(self.prefix):
+                    continue
+                rel_path = loc[len(self.prefix):].lstrip(os.sep)
+                if rel_path.casefold().startswith(self.exclude):
+                    continue
+                member_count += 1
+                if not rel_path or name.endswith('/'):
+                    # Directory entries, which zip -r and others add.
+                    continue
+                sources[rel_path] = (zip_file, name)
+
+        if step_func is not None:
+            # Overridden files and directories are never extracted.
+            for _ in range(member_count - len(sources)):
+                step_func(True)
+
+        to_extract = {}
+        unchanged = 0
+        for rel_path, (zip_file, name) in sources.items():
+            key = _member_key(zip_file, name)
+            self._total_bytes += key[1]
+            entry = old_manifest.get(rel_path)
+            if (
+                    entry is not None and
+                    entry[0] == key and
+                    entry[1] == _stat(os.path.join(self.dest, rel_path))
+                    ):
+                manifest[rel_path] = entry
+                unchanged += 1
+                if step_func is not None:
+                    step_func(True)
+            else:
+                to_extract.setdefault(zip_file, []).append(
+                    (name, rel_path, key)
+                )
+        self._total_files = len(sources)
+        self._progress(unchanged, 0)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            jobs = [
+                executor.submit(self._extract_members, zip_file, members)
+                for zip_file, members in
+                to_extract.items()
+            ]
+            for job in jobs:
+                entries = job.result()
+                manifest.update(entries)
+                self.extracted += len(entries)
+                if step_func is not None:
+                    for _ in entries:
+                        step_func(False)
+
+        if self._cancel.is_set():
+            # Keep what we finished, but don't delete anything.
+            fileSync.save_manifest(self.manifest_loc, manifest)
+            LOGGER.info(
+                'Extraction to "{}" cancelled after {} files.',
+                self.dest,
+                self.extracted,
+            )
+            return self.extracted
+
+        # Remove files from packages which no longer exist.
+        if os.path.isdir(self.dest):
+            for dirpath, dirnames, filenames in os.walk(
+                    self.dest,
+                    topdown=False,
+                    ):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    rel_path = os.path.normcase(
+                        os.path.relpath(path, self.dest)
+                    )
+                    if rel_path not in manifest:
+                        with suppress(OSError):
+                            os.remove(path)
+                if dirpath != self.dest and not os.listdir(dirpath):
+                    with suppress(OSError):
+                        os.rmdir(dirpath)
+
+        fileSync.save_manifest(self.manifest_loc, manifest)
+        LOGGER.info(
+            'Extracted {} files to "{}", {} unchanged.',
+            self.extracted,
+            self.dest,
+            len(manifest) - self.extracted,
+        )
+        return self.extracted
+
+
+def extract_folder(
+        zips,
+        prefix,
+        dest,
+        manifest_loc,
+        step_func=None,
+        exclude=(),
+        ):
+    """Extract a folder from each package, blocking until complete.
+
+    See Extractor for the details.
+    Returns the number of files extracted.
+    """
+    return Extractor(zips, prefix, dest, manifest_loc, exclude).run(step_func)
+
+
+def main(argv):
+    """Extract the resources from packages, for use outside the app."""
+    if len(argv) < 3:
+        print(
+            'Usage: packageExtract.py <dest> <package or folder>...',
+            file=sys.stderr,
+        )
+        return 1
+    dest = os.path.abspath(argv[1])
+
+    packages = []
+    for path in argv[2:]:
+        if os.path.isdir(path) and not os.path.isfile(
+                os.path.join(path, 'info.txt')):
+            packages.extend(find_packages(path))
+        else:
+            packages.append(path)
+
+    extractor = Extractor(
+        packages,
+        'resources',
+        os.path.join(dest, 'resources'),
+        os.path.join(dest, 'extract_manifest.bin'),
+    )
+    extractor.start()
+    try:
+        while True:
+            event = extractor.events.get()
+            LOGGER.info(
+                '{}/{} files, {:.1f} MB/s, {:.0f} files/s',
+                event.files,
+                event.total_files,
+                event.bytes_per_sec / 1024 / 1024,
+                event.files_per_sec,
+            )
+            if event.done:
+                break
+    except KeyboardInterrupt:
+        extractor.cancel()
+        extractor.thread.join()
+        return 1
+    extractor.thread.join()
+    return 0 if extractor.error is None else 1
+
+
+if __name__ == '__main__':
+    utils.init_logging()
+    sys.exit(main(sys.argv))
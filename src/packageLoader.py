@@ -3,18 +3,22 @@ Handles scanning through the zip packages to find all items, styles, etc.
 """
 from zipfile import ZipFile
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import os
 import os.path
-import shutil
+import time
 
 from property_parser import Property, NoKeyError
 from FakeZip import FakeZip, zip_names
 from selectorWin import SelitemData
 from loadScreen import main_loader as loader
 from packageMan import PACK_CONFIG
+from packageCache import PARSE_CACHE
 import vmfLib as VLib
 import extract_packages
+import img
+import packageExtract
 import utils
 
 from typing import (
@@ -35,9 +39,12 @@ res_count = -1
 
 TEMPLATE_FILE = VLib.VMF()
 
+# Records the images extracted into images/cache/.
+IMG_MANIFEST_LOC = '../config/image_manifest.bin'
+
 ObjData = namedtuple('ObjData', 'zip_file, info_block, pak_id, disp_name')
 ParseData = namedtuple('ParseData', 'zip_file, id, info, pak_id')
-ObjType = namedtuple('ObjType', 'cls, allow_mult, has_img')
+ObjType = namedtuple('ObjType', 'cls, allow_mult, has_img, allow_parallel')
 
 # This package contains necessary components, and must be available.
 CLEAN_PACKAGE = 'BEE2_CLEAN_STYLE'
@@ -46,7 +53,7 @@ CLEAN_PACKAGE = 'BEE2_CLEAN_STYLE'
 CHECK_PACKFILE_CORRECTNESS = False
 
 
-def pak_object(name, allow_mult=False, has_img=True):
+def pak_object(name, allow_mult=False, has_img=True, allow_parallel=True):
     """Decorator to add a class to the list of objects.
 
     Each object class needs two methods:
@@ -58,9 +65,12 @@ def pak_object(name, allow_mult=False, has_img=True):
 
     If allow_mult is true, duplicate items will be treated as overrides,
     with one randomly chosen to be the 'parent'.
+
+    If allow_parallel is false, parse() modifies global state and must
+    always be run on the main thread, in order.
     """
     def x(cls):
-        OBJ_TYPES[name] = ObjType(cls, allow_mult, has_img)
+        OBJ_TYPES[name] = ObjType(cls, allow_mult, has_img, allow_parallel)
         return cls
     return x
 
@@ -115,11 +125,7 @@ def get_config(
         # Add extension
         path += extension
     try:
-        with zip_file.open(path) as f:
-            return Property.parse(
-                f,
-                pak_id + ':' + path,
-            )
+        return PARSE_CACHE.parse(zip_file, path, pak_id + ':' + path)
     except KeyError:
         LOGGER.warning('"{id}:{path}" not in zip!', id=pak_id, path=path)
         return Property(None, [])
@@ -146,8 +152,7 @@ def find_packages(pak_dir, zips, zip_name_lst):
             zips.append(zip_file)
             zip_name_lst.append(os.path.abspath(name))
             LOGGER.debug('Reading package "' + name + '"')
-            with zip_file.open('info.txt') as info_file:
-                info = Property.parse(info_file, name + ':info.txt')
+            info = PARSE_CACHE.parse(zip_file, 'info.txt', name + ':info.txt')
             pak_id = info['ID']
             packages[pak_id] = Package(
                 pak_id,
@@ -174,8 +179,12 @@ def load_packages(
         log_missing_styles=False,
         log_missing_ent_count=False,
         log_incorrect_packfile=False,
+        parallel=True,
         ):
-    """Scan and read in all packages in the specified directory."""
+    """Scan and read in all packages in the specified directory.
+
+    If parallel is true, objects will be parsed using a thread pool.
+    """
     global LOG_ENT_COUNT, CHECK_PACKFILE_CORRECTNESS
     pak_dir = os.path.abspath(os.path.join(os.getcwd(), '..', pak_dir))
 
@@ -199,6 +208,8 @@ def load_packages(
     CHECK_PACKFILE_CORRECTNESS = log_incorrect_packfile
     zips = []
     data['zips'] = []
+    parse_start = time.perf_counter()
+    PARSE_CACHE.load()
     try:
         find_packages(pak_dir, zips, data['zips'])
 
@@ -245,47 +256,26 @@ def load_packages(
             )
         )
 
-        for obj_type, objs in all_obj.items():
-            for obj_id, obj_data in objs.items():
-                LOGGER.debug('Loading {type} "{id}"!', type=obj_type, id=obj_id)
-                # parse through the object and return the resultant class
-                try:
-                    object_ = OBJ_TYPES[obj_type].cls.parse(
-                        ParseData(
-                            obj_data.zip_file,
-                            obj_id,
-                            obj_data.info_block,
-                            obj_data.pak_id,
-                        )
-                    )
-                except (NoKeyError, IndexError) as e:
-                    reraise_keyerror(e, obj_id)
-
-                object_.pak_id = obj_data.pak_id
-                object_.pak_name = obj_data.disp_name
-                for override_data in obj_override[obj_type].get(obj_id, []):
-                    override = OBJ_TYPES[obj_type].cls.parse(
-                        override_data
-                    )
-                    object_.add_over(override)
-                data[obj_type].append(object_)
-                loader.step("OBJ")
-
-        cache_folder = os.path.abspath('../cache/')
+        parse_objects(parallel)
 
-        shutil.rmtree(cache_folder, ignore_errors=True)
-        img_loc = os.path.join('resources', 'bee2')
-        for zip_file in zips:
-            for path in zip_names(zip_file):
-                loc = os.path.normcase(path).casefold()
-                if loc.startswith(img_loc):
-                    loader.step("IMG_EX")
-                    zip_file.extract(path, path=cache_folder)
+        PARSE_CACHE.save()
+        LOGGER.info(
+            'Parsed packages in {:.2f}s ({} files cached, {} parsed)',
+            time.perf_counter() - parse_start,
+            PARSE_CACHE.hits,
+            PARSE_CACHE.misses,
+        )
 
-        shutil.rmtree('../images/cache', ignore_errors=True)
-        if os.path.isdir("../cache/resources/bee2"):
-            shutil.move("../cache/resources/bee2", "../images/cache")
-        shutil.rmtree('../cache/', ignore_errors=True)
+        packageExtract.extract_folder(
+            zips,
+            os.path.join('resources', 'bee2'),
+            os.path.abspath('../images/cache/'),
+            IMG_MANIFEST_LOC,
+            lambda skipped: loader.step("IMG_EX", skipped),
+        )
+        # Update resized icons for any images which changed, and render
+        # any new ones.
+        img.THUMBNAILS.start_refresh(os.path.abspath('../images/cache/'))
 
     finally:
         # close them all, we've already read the contents.
@@ -302,6 +292,95 @@ def load_packages(
     return data
 
 
+def parse_object(obj_type, obj_id, parse_data: ParseData, override_ind=None):
+    """Parse a single object or override."""
+    if override_ind is None:
+        LOGGER.debug('Loading {type} "{id}"!', type=obj_type, id=obj_id)
+    # parse through the object and return the resultant class
+    try:
+        return OBJ_TYPES[obj_type].cls.parse(parse_data)
+    except (NoKeyError, IndexError) as e:
+        reraise_keyerror(e, obj_id)
+
+
+def parse_object_group(jobs):
+    """Parse a list of objects, yielding their keys and the objects.
+
+    In parallel mode this is run in a worker thread, with all the objects
+    sharing the same zip file so it's never read from two threads at once.
+    """
+    for obj_type, obj_id, ind, parse_data in jobs:
+        yield (
+            (obj_type, obj_id, ind),
+            parse_object(obj_type, obj_id, parse_data, ind),
+        )
+
+
+def parse_objects(parallel=True):
+    """Parse all the objects in all_obj, and merge their overrides.
+
+    Each job is keyed by (type, id, ind), where ind is None for the
+    original object, or the position in the override list.
+    If parallel is true, these are split up by zip file and parsed in a
+    thread pool, so each zip is only read by one thread at a time. Types
+    which don't allow that are parsed in order afterward, once the pool is
+    finished. The overrides are always merged in the original order.
+    """
+    serial_jobs = []
+    zip_jobs = defaultdict(list)
+    for obj_type, objs in all_obj.items():
+        in_parallel = parallel and OBJ_TYPES[obj_type].allow_parallel
+        for obj_id, obj_data in objs.items():
+            jobs = [(obj_type, obj_id, None, ParseData(
+                obj_data.zip_file,
+                obj_id,
+                obj_data.info_block,
+                obj_data.pak_id,
+            ))]
+            jobs.extend(
+                (obj_type, obj_id, ind, override_data)
+                for ind, override_data in
+                enumerate(obj_override[obj_type].get(obj_id, ()))
+            )
+            for job in jobs:
+                if in_parallel:
+                    zip_jobs[id(job[3].zip_file)].append(job)
+                else:
+                    serial_jobs.append(job)
+
+    results = {}
+
+    def add_results(group_results):
+        """Store results, and update the loading screen.
+
+        This needs to be done on the main thread.
+        """
+        for key, object_ in group_results:
+            results[key] = object_
+            if key[2] is None:
+                loader.step("OBJ")
+
+    with ThreadPoolExecutor() as pool:
+        futures = [
+            pool.submit(list, parse_object_group(jobs))
+            for jobs in zip_jobs.values()
+        ]
+        for future in as_completed(futures):
+            add_results(future.result())
+    # Parse the objects which need to be in order once the workers are
+    # done, since they read from the same zips.
+    add_results(parse_object_group(serial_jobs))
+
+    for obj_type, objs in all_obj.items():
+        for obj_id, obj_data in objs.items():
+            object_ = results[obj_type, obj_id, None]
+            object_.pak_id = obj_data.pak_id
+            object_.pak_name = obj_data.disp_name
+            for ind in range(len(obj_override[obj_type].get(obj_id, ()))):
+                object_.add_over(results[obj_type, obj_id, ind])
+            data[obj_type].append(object_)
+
+
 def parse_package(pack: 'Package'):
     """Parse through the given package to find all the components."""
     for pre in Property.find_key(pack.info, 'Prerequisites', []):
@@ -431,14 +510,12 @@ def parse_item_folder(folders, zip_file, pak_id):
         editor_path = 'items/' + fold + '/editoritems.txt'
         config_path = 'items/' + fold + '/vbsp_config.cfg'
         try:
-            with zip_file.open(prop_path, 'r') as prop_file:
-                props = Property.parse(
-                    prop_file, pak_id + ':' + prop_path,
-                ).find_key('Properties')
-            with zip_file.open(editor_path, 'r') as editor_file:
-                editor = Property.parse(
-                    editor_file, pak_id + ':' + editor_path
-                )
+            props = PARSE_CACHE.parse(
+                zip_file, prop_path, pak_id + ':' + prop_path,
+            ).find_key('Properties')
+            editor = PARSE_CACHE.parse(
+                zip_file, editor_path, pak_id + ':' + editor_path
+            )
         except KeyError as err:
             # Opening the files failed!
             raise IOError(
@@ -485,11 +562,11 @@ def parse_item_folder(folders, zip_file, pak_id):
                 path=prop_path,
             )
         try:
-            with zip_file.open(config_path, 'r') as vbsp_config:
-                folders[fold]['vbsp'] = Property.parse(
-                    vbsp_config,
-                    pak_id + ':' + config_path,
-                )
+            folders[fold]['vbsp'] = PARSE_CACHE.parse(
+                zip_file,
+                config_path,
+                pak_id + ':' + config_path,
+            )
         except KeyError:
             folders[fold]['vbsp'] = Property(None, [])
 
@@ -591,18 +668,18 @@ class Style:
             base = None
         folder = 'styles/' + info['folder']
         config = folder + '/vbsp_config.cfg'
-        with data.zip_file.open(folder + '/items.txt', 'r') as item_data:
-            items = Property.parse(
-                item_data,
-                data.pak_id+':'+folder+'/items.txt'
-            )
+        items = PARSE_CACHE.parse(
+            data.zip_file,
+            folder + '/items.txt',
+            data.pak_id+':'+folder+'/items.txt'
+        )
 
         try:
-            with data.zip_file.open(config, 'r') as vbsp_config:
-                vbsp = Property.parse(
-                    vbsp_config,
-                    data.pak_id+':'+config,
-                )
+            vbsp = PARSE_CACHE.parse(
+                data.zip_file,
+                config,
+                data.pak_id+':'+config,
+            )
         except KeyError:
             vbsp = None
         return cls(
@@ -1126,7 +1203,7 @@ class EditorSound:
         )
 
 
-@pak_object('BrushTemplate', has_img=False)
+@pak_object('BrushTemplate', has_img=False, allow_parallel=False)
 class BrushTemplate:
     """A template brush which will be copied into the map, then retextured.
 
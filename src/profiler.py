@@ -0,0 +1,140 @@
+"""Optional timing of VBSP stages, conditions, flags and results.
+
+This is enabled with the -bee2_profile argument to VBSP. Each category
+records the calls, matches and total time for each name, which is then
+written to the log and to a JSON file so compiles can be compared.
+"""
+from collections import defaultdict
+import functools
+import json
+import time
+
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# If False, nothing is recorded.
+ENABLED = False
+
+# Where the JSON report is saved.
+REPORT_LOC = 'bee2/vbsp_profile.json'
+
+# Category -> name -> [calls, matches, total time]
+STATS = defaultdict(lambda: defaultdict(lambda: [0, 0, 0.0]))
+
+# Categories, in the order they're shown in the report.
+CAT_STAGE = 'stage'
+CAT_CONDITION = 'condition'
+CAT_FLAG = 'flag'
+CAT_RESULT = 'result'
+CATEGORIES = [CAT_STAGE, CAT_CONDITION, CAT_FLAG, CAT_RESULT]
+
+# The number of rows to write to the log for each category.
+LOG_ROWS = 25
+
+
+def enable():
+    """Start recording timings."""
+    global ENABLED
+    ENABLED = True
+    STATS.clear()
+
+
+def record(category, name, duration, calls=1, matches=0):
+    """Add a timing to the statistics."""
+    stat = STATS[category][name]
+    stat[0] += calls
+    stat[1] += matches
+    stat[2] += duration
+
+
+def stage(func):
+    """Decorator which records the time taken for a VBSP stage."""
+    @functools.wraps(func)
+    def timed_stage(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(CAT_STAGE, func.__name__, time.perf_counter() - start)
+    return timed_stage
+
+
+def wrap_flag(name, test):
+    """Wrap a compiled flag to record its time and number of matches."""
+    stat = STATS[CAT_FLAG][name]
+
+    @functools.wraps(test)
+    def timed_flag(inst):
+        start = time.perf_counter()
+        result = test(inst)
+        stat[2] += time.perf_counter() - start
+        stat[0] += 1
+        if result:
+            stat[1] += 1
+        return result
+    return timed_flag
+
+
+def report():
+    """Write the recorded statistics to the log and to REPORT_LOC."""
+    if not ENABLED:
+        return
+
+    for category in CATEGORIES:
+        stats = STATS.get(category)
+        if not stats:
+            continue
+        rows = sorted(
+            stats.items(),
+            key=lambda item: item[1][2],
+            reverse=True,
+        )
+        width = min(60, max(len(name) for name in stats))
+        lines = [
+            '{:<{width}} {:>8} {:>8} {:>10} {:>10}'.format(
+                category.title(),
+                'Calls',
+                'Matches',
+                'Total ms',
+                'Mean us',
+                width=width,
+            )
+        ]
+        for name, (calls, matches, duration) in rows[:LOG_ROWS]:
+            lines.append(
+                '{:<{width}} {:>8} {:>8} {:>10.2f} {:>10.1f}'.format(
+                    name[:width],
+                    calls,
+                    matches,
+                    duration * 1000,
+                    duration * 1000000 / calls if calls else 0,
+                    width=width,
+                )
+            )
+        if len(rows) > LOG_ROWS:
+            lines.append('... {} more'.format(len(rows) - LOG_ROWS))
+        LOGGER.info('Profile:\n{}', '\n'.join(lines))
+
+    data = {
+        category: {
+            name: {
+                'calls': calls,
+                'matches': matches,
+                'time': round(duration, 6),
+            }
+            for name, (calls, matches, duration) in
+            STATS[category].items()
+        }
+        for category in CATEGORIES
+        if category in STATS
+    }
+    try:
+        with open(REPORT_LOC, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    except OSError:
+        LOGGER.warning('Could not write profile to "{}"!', REPORT_LOC)
+    else:
+        LOGGER.info('Profile written to "{}".', REPORT_LOC)
@@ -1,3 +1,5 @@
+import re
+
 import utils
 
 from typing import (
@@ -18,6 +20,9 @@ REPLACE_CHARS = {
 # Sentinel value to indicate that no default was given to find_key()
 _NO_KEY_FOUND = object()
 
+# Blocks with at least this many children get an index of their names.
+INDEX_MIN_SIZE = 16
+
 _Prop_Value = Union[List['Property'], str]
 _as_dict_return = Dict[str, Union[str, 'as_dict_return']]
 
@@ -102,6 +107,253 @@ def read_multiline_value(file, line_num, filename):
         )
 
 
+def replace_escapes(value):
+    """Replace the escape sequences in REPLACE_CHARS."""
+    if '\\' in value:
+        for orig, new in REPLACE_CHARS.items():
+            value = value.replace(orig, new)
+    return value
+
+
+# Each match skips whitespace, then matches one token. The groups are:
+# - name, value, newline, '"' for a "name" "value" pair. Like the line
+#   parser, any further quoted text on the line is ignored. If the value
+#   has no closing quote on the first line, newline is set and it runs to
+#   the first line ending with a quote.
+# - '"', name for a quoted name by itself. Like the line parser, the rest
+#   of the line is ignored if it has no more quotes, and the closing quote
+#   is optional.
+# - '{' or '}'. The rest of the line is ignored, like the line parser.
+# - A bare name, without quotes (running to the end of the line). This
+#   is invalid if it contains any of '{}"'.
+# - Any other character, which is invalid.
+# Comments match with all groups empty.
+_TOKEN_RE = re.compile(
+    r"""
+    \s*
+    (?:
+        "([^"\n]*)"[ \t]*"([^"\n]*(?:(\n)[^\n]*?)*?)(")
+        (?(3)
+            (?=[ \t\r]*(?:\n|$))
+            | (?:[ \t]*"[^\n]*)?(?=[ \t\r]*(?:\n|//|$))
+        )
+        | (")([^"\n]*)(?:"(?:[^"\n]*(?=\n|$)|(?=[ \t]*//))|(?=[ \t\r]*(?:\n|$)))
+        | ([{}])[^\n]*
+        | //[^\n]*
+        | ([^\s{}"][^\n]*)
+        | (\S)
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+def _tokenize(buffer):
+    """Split a buffer into tokens, in a single pass.
+
+    This returns a list of the _TOKEN_RE groups for each token.
+    Use _token_start() to get the position of a token.
+    """
+    return _TOKEN_RE.findall(buffer)
+
+
+def _token_start(buffer, index):
+    """Find the position the token at the given index starts at.
+
+    This rescans the buffer, so it should only be used for errors.
+    """
+    for tok_ind, match in enumerate(_TOKEN_RE.finditer(buffer)):
+        if tok_ind == index:
+            # Skip the whitespace before the token.
+            return match.end() - len(match.group().lstrip())
+    return len(buffer)
+
+
+def _line_num(buffer, pos):
+    """Get the line number for a position in the buffer."""
+    return buffer.count('\n', 0, pos) + 1
+
+
+def _invalid_token(buffer, pos, filename):
+    """Produce the KeyValError for an invalid token at this position.
+
+    This examines the line the same way the line parser does, so the
+    messages match.
+    """
+    line_start = buffer.rfind('\n', 0, pos) + 1
+    line_end = buffer.find('\n', pos)
+    if line_end == -1:
+        line_end = len(buffer)
+    freshline = buffer[line_start:line_end].strip()
+    line_num = _line_num(buffer, pos)
+
+    if freshline.startswith('"'):
+        line_contents = freshline.split('"')
+        if len(line_contents) >= 5:
+            return KeyValError(
+                'Extra text after '
+                'line: "{}"'.format(line_contents[4]),
+                filename,
+                line_num,
+            )
+        # The line parser reads to the end of the file looking for the
+        # quote, so it reports the last line.
+        return KeyValError(
+            "Reached EOF without ending quote!",
+            filename,
+            buffer.count('\n') + (not buffer.endswith('\n')),
+        )
+    return KeyValError(
+        "Unexpected beginning character '"
+        + freshline[0]
+        + '"!',
+        filename,
+        line_num,
+    )
+
+
+# Token types produced by iter_tokens().
+TOK_PAIR = 0  # A "name" "value" pair.
+TOK_NAME = 1  # A name by itself, which can be followed by a block.
+TOK_BRACE_OPEN = 2
+TOK_BRACE_CLOSE = 3
+
+
+def iter_tokens(buffer, filename=''):
+    """Lazily split a str or bytes buffer into tokens.
+
+    This yields (tok_type, name, value) tuples. This allows reading a file
+    without building the whole Property tree. Values are processed
+    the same way as Property.parse() does.
+    """
+    if isinstance(buffer, bytes):
+        # Decode bytes using utf-8
+        buffer = buffer.decode('utf-8')
+
+    for match in _TOKEN_RE.finditer(buffer):
+        group = match.lastindex
+        if group == 4:
+            name, value = match.group(1, 2)
+            if match.group(3):
+                # It's a multiline value.
+                value = _join_multiline(value)
+            if '\\' in value:
+                value = replace_escapes(value)
+            yield TOK_PAIR, name, value
+        elif group == 6:
+            yield TOK_NAME, match.group(6), None
+        elif group == 7:
+            if match.group(7) == '{':
+                yield TOK_BRACE_OPEN, None, None
+            else:
+                yield TOK_BRACE_CLOSE, None, None
+        elif group == 8:
+            bare = match.group(8)
+            if not utils.is_identifier(bare):
+                raise _invalid_token(buffer, match.start(8), filename)
+            yield TOK_NAME, bare.rstrip(), None
+        elif group == 9:
+            raise _invalid_token(buffer, match.start(9), filename)
+        # Otherwise it's a comment.
+
+
+def _join_multiline(value):
+    """Strip the lines in a multi-line value, like the line parser does."""
+    lines = value.split('\n')
+    lines[0] = lines[0].rstrip()
+    lines[1:-1] = [line.strip() for line in lines[1:-1]]
+    lines[-1] = lines[-1].lstrip()
+    return '\n'.join(lines)
+
+
+def _build_tree(buffer, filename=''):
+    """Build a Property tree from a buffer, using _tokenize().
+
+    The tokenizer only allows values on the same line as the name, so each
+    string token is either a complete name-value pair or a name.
+    """
+    if isinstance(buffer, bytes):
+        # Decode bytes using utf-8
+        buffer = buffer.decode('utf-8')
+    tokens = _tokenize(buffer)
+
+    # The special name 'None' marks it as the root property, which
+    # just outputs its children when exported.
+    cur_block = Property(None, [])
+    # A queue of the properties we are currently in (outside to inside).
+    open_properties = [cur_block]
+    children = cur_block.value
+
+    for tok_ind, (
+        name, value, multiline, is_pair,
+        is_string, string,
+        brace,
+        bare,
+        invalid,
+    ) in enumerate(tokens):
+        if is_pair:
+            if multiline:
+                # It's a multiline value.
+                value = _join_multiline(value)
+            if '\\' in value:
+                value = replace_escapes(value)
+            children.append(Property(name, value))
+        elif is_string:
+            children.append(Property(string, None))
+        elif bare:
+            if not utils.is_identifier(bare):
+                raise _invalid_token(
+                    buffer,
+                    _token_start(buffer, tok_ind),
+                    filename,
+                )
+            children.append(Property(bare.rstrip(), None))
+        elif brace == '{':
+            # Open a new block, using the last property in this one.
+            # If we're expecting a block, the value will be None.
+            if not children:
+                raise KeyValError(
+                    'Sub-section has no name!',
+                    filename,
+                    _line_num(buffer, _token_start(buffer, tok_ind)),
+                )
+            last_prop = children[-1]
+            if last_prop.value is not None:
+                raise KeyValError(
+                    'Property cannot have sub-section if it already '
+                    'has an in-line value.',
+                    filename,
+                    _line_num(buffer, _token_start(buffer, tok_ind)),
+                )
+            children = last_prop.value = []
+            open_properties.append(last_prop)
+        elif brace:
+            # Move back a block
+            if len(open_properties) == 1:
+                raise KeyValError(
+                    'Too many closing brackets.',
+                    filename,
+                    _line_num(buffer, _token_start(buffer, tok_ind)),
+                )
+            open_properties.pop()
+            children = open_properties[-1].value
+        elif invalid:
+            raise _invalid_token(
+                buffer,
+                _token_start(buffer, tok_ind),
+                filename,
+            )
+        # Otherwise it's a comment.
+
+    if len(open_properties) > 1:
+        raise KeyValError(
+            'End of text reached with remaining open sections.',
+            filename,
+            line=None,
+        )
+    return open_properties[0]
+
+
 class Property:
     """Represents Property found in property files, like those used by Valve.
 
@@ -112,7 +364,7 @@ class Property:
         This is produced from Property.parse() calls.
     """
     # Helps decrease memory footprint with lots of Property values.
-    __slots__ = ('_folded_name', 'real_name', 'value')
+    __slots__ = ('_folded_name', 'real_name', 'value', '_index', '_parent')
 
     def __init__(
             self: 'Property',
@@ -128,6 +380,9 @@ class Property:
             None if name is None
             else name.casefold()
         )  # type: Optional[str]
+        self._index = None
+        # The block whose index includes this, so renames can discard it.
+        self._parent = None  # type: Optional[Property]
 
     @property
     def name(self) -> Optional[str]:
@@ -140,6 +395,8 @@ class Property:
 
     @name.setter
     def name(self, new_name):
+        if self._parent is not None:
+            self._parent._index = None
         self.real_name = new_name
         if new_name is None:
             self._folded_name = None
@@ -149,6 +406,8 @@ class Property:
     def edit(self, name=None, value=None):
         """Simultaneously modify the name and value."""
         if name is not None:
+            if self._parent is not None:
+                self._parent._index = None
             self.real_name = name
             self._folded_name = name.casefold()
         if value is not None:
@@ -159,7 +418,23 @@ class Property:
         """Returns a Property tree parsed from given text.
 
         filename, if set should be the source of the text for debug purposes.
-        file_contents should be an iterable of strings
+        file_contents can be a str or bytes buffer, a file object, or an
+        iterable of strings. Buffers and files are read in one go and run
+        through the single-pass tokenizer, other iterables use the slower
+        line-based parser.
+        """
+        if hasattr(file_contents, 'read'):
+            file_contents = file_contents.read()
+        if isinstance(file_contents, (str, bytes)):
+            return _build_tree(file_contents, filename)
+        return Property._parse_lines(file_contents, filename)
+
+    @staticmethod
+    def _parse_lines(file_contents, filename='') -> "Property":
+        """Parse a Property tree from an iterable of lines.
+
+        This is the original line-based parser, kept as a fallback for
+        iterables which aren't files.
         """
         from utils import is_identifier
 
@@ -206,9 +481,8 @@ class Property:
                                 line_num,
                                 filename,
                             )
-                        if value and '\\' in value:
-                            for orig, new in REPLACE_CHARS.items():
-                                value = value.replace(orig, new)
+                        if value:
+                            value = replace_escapes(value)
                 # Line_contents[4] is the start of the comment, ensure that it's
                 # blank or starts with a comment.
                 if len(line_contents) >= 5:
@@ -228,7 +502,7 @@ class Property:
                 # If we're expecting a block, the value will be None.
                 if cur_block[-1].value is not None:
                     raise KeyValError(
-                        'Property cannot have sub-section if it already'
+                        'Property cannot have sub-section if it already '
                         'has an in-line value.',
                         filename,
                         line_num,
@@ -239,7 +513,8 @@ class Property:
             elif freshline.startswith('}'):
                 # Move back a block
                 open_properties.pop()
-                cur_block = open_properties[-1].value
+                if open_properties:
+                    cur_block = open_properties[-1].value
 
             # handle name bare on one line, will need a brace on
             # the next line
@@ -277,6 +552,20 @@ class Property:
             raise ValueError("Cannot find_all without commands!")
 
         targ_key = keys[0].casefold()
+        index = self._get_index()
+        if index is not None:
+            value = self.value
+            for pos in index.get(targ_key, ()):
+                prop = value[pos]
+                if prop._folded_name != targ_key:
+                    continue  # The list was changed while we were iterating.
+                if depth > 1:
+                    if prop.has_children():
+                        yield from Property.find_all(prop, *keys[1:])
+                else:
+                    yield prop
+            return
+
         for prop in self:
             if not isinstance(prop, Property):
                 raise ValueError(
@@ -297,9 +586,22 @@ class Property:
         - This prefers keys located closer to the end of the value list.
         """
         key = key.casefold()
-        for prop in reversed(self.value):  # type: Property
-            if prop._folded_name == key:
-                return prop
+        index = self._get_index()
+        if index is not None:
+            try:
+                prop = self.value[index[key][-1]]
+            except KeyError:
+                pass
+            else:
+                if prop._folded_name == key:
+                    return prop
+                # The list was modified in-place, rebuild.
+                self._index = None
+                return self.find_key(key, def_)
+        else:
+            for prop in reversed(self.value):  # type: Property
+                if prop._folded_name == key:
+                    return prop
         if def_ is _NO_KEY_FOUND:
             raise NoKeyError(key)
         else:
@@ -337,6 +639,7 @@ class Property:
             current_prop.find_key(path).value = value
         except NoKeyError:
             current_prop.value.append(Property(path, value))
+            current_prop._index = None
 
     def copy(self):
         """Deep copy this Property tree and return it."""
@@ -436,6 +739,9 @@ class Property:
         """
         key = key.casefold()
         if self.has_children():
+            index = self._get_index()
+            if index is not None:
+                return key in index
             for prop in self.value:  # type: Property
                 if prop._folded_name == key:
                     return True
@@ -492,6 +798,7 @@ class Property:
         - [0] sets the .value if the Property has no children.
         """
         if self.has_children():
+            self._index = None
             if isinstance(index, int) or isinstance(index, slice):
                 self.value[index] = value
             else:
@@ -511,6 +818,7 @@ class Property:
         - If the Property has no children, it will blank the value instead.
         """
         if self.has_children():
+            self._index = None
             if isinstance(index, int):
                 del self.value[index]
             else:
@@ -548,6 +856,7 @@ class Property:
         This is the += op, where it does not copy the object.
         """
         if self.has_children():
+            self._index = None
             if isinstance(other, Property):
                 if other._folded_name is None:
                     self.value.extend(other.value)
@@ -587,6 +896,7 @@ class Property:
                 new_list.append(prop)
 
         self.value = new_list
+        self._index = None
 
     def ensure_exists(self, key):
         """Ensure a Property group exists with this name."""
@@ -597,6 +907,45 @@ class Property:
         """Does this have child properties?"""
         return isinstance(self.value, list)
 
+    def _get_index(self):
+        """Return a dict mapping folded names to child positions.
+
+        This is built when first needed, and only for large blocks (otherwise
+        None is returned). It's discarded if the value list is replaced or
+        changes length, or a child is renamed. append/+=, __setitem__ and
+        __delitem__ discard it too - use those instead of editing .value
+        directly.
+        """
+        value = self.value
+        if not isinstance(value, list):
+            return None
+        index = self._index
+        if index is not None and index[0] is value and index[1] == len(value):
+            return index[2]
+        self._index = None
+        if len(value) < INDEX_MIN_SIZE:
+            return None
+
+        positions = {}
+        try:
+            for pos, prop in enumerate(value):
+                parent = prop._parent
+                if parent is not self:
+                    if parent is not None:
+                        # Only one block can be told about renames, so
+                        # the other one needs to rebuild.
+                        parent._index = None
+                    prop._parent = self
+                try:
+                    positions[prop._folded_name].append(pos)
+                except KeyError:
+                    positions[prop._folded_name] = [pos]
+        except AttributeError:
+            # Not a Property, let the regular code produce the error.
+            return None
+        self._index = (value, len(value), positions)
+        return positions
+
     def __repr__(self):
         return 'Property(' + repr(self.real_name) + ', ' + repr(self.value) + ')'
 
@@ -627,3 +976,66 @@ class Property:
                 yield '\t}\n'
         else:
             yield '"' + self.real_name + '" "' + str(self.value) + '"\n'
+
+
+if __name__ == '__main__':
+    # Compare the speed of the tokenizer and the line-based parser.
+    # Pass a VMF (or any other keyvalues file) to parse, otherwise a
+    # ~20 MB VMF is generated.
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            test_data = f.read()
+    else:
+        test_solid = '''\
+\tsolid
+\t{{
+\t\t"id" "{id}"
+{sides}\t}}
+'''
+        test_side = '''\
+\t\tside
+\t\t{{
+\t\t\t"id" "{id}"
+\t\t\t"plane" "(0 0 {id}) (0 64 {id}) (64 64 {id})"
+\t\t\t"material" "TOOLS/TOOLSNODRAW"
+\t\t\t"uaxis" "[1 0 0 0] 0.25"
+\t\t\t"vaxis" "[0 -1 0 0] 0.25"
+\t\t\t"rotation" "0"
+\t\t\t"lightmapscale" "16"
+\t\t\t"smoothing_groups" "0"
+\t\t}}
+'''
+        solids = []
+        size = 0
+        solid_id = 0
+        while size < 20 * 1024 * 1024:
+            solid_id += 1
+            solid = test_solid.format(
+                id=solid_id,
+                sides=''.join(
+                    test_side.format(id=solid_id * 6 + side)
+                    for side in range(6)
+                ),
+            )
+            size += len(solid)
+            solids.append(solid)
+        test_data = 'world\n{\n' + ''.join(solids) + '}\n'
+        del solids
+
+    print('Parsing {:.1f} MB...'.format(len(test_data) / 1024 / 1024))
+
+    start = time.perf_counter()
+    tok_tree = Property.parse(test_data)
+    print('Tokenizer: {:.2f}s'.format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    line_tree = Property._parse_lines(test_data.splitlines())
+    print('Line parser: {:.2f}s'.format(time.perf_counter() - start))
+
+    if ''.join(tok_tree.export()) == ''.join(line_tree.export()):
+        print('Trees match.')
+    else:
+        print('Trees differ!')
@@ -0,0 +1,208 @@
+"""Precompiled storage for the brush templates used by import_template().
+
+Parsing templates.vmf and copying every Solid and Side is slow. Instead
+each template brush is stored as a flat array of its plane points and
+texture axes, which can be transformed in one pass and turned directly
+into new sides. The compiled templates are pickled, and reused until
+the size or modification time of the VMF changes.
+"""
+from array import array
+from collections import defaultdict, namedtuple
+import os
+import pickle
+
+import vmfLib as VLib
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# Increment if the format of the cache file changes.
+CACHE_VERSION = 1
+
+# The parts of each template - lists of PackedSolids for world and
+# detail brushes, and (keys, editor) pairs for overlays.
+PackedTemplate = namedtuple('PackedTemplate', ['world', 'detail', 'overlay'])
+
+
+class PackedSolid:
+    """A template brush, stored compactly.
+
+    coords holds the floats from VLib.pack_sides(), and sides holds the
+    remaining (id, material, rotation, lightmap, smoothing, disp_data)
+    values.
+    """
+    __slots__ = ['coords', 'sides', 'editor', 'hidden']
+
+    def __init__(
+            self,
+            coords: array,
+            sides: list,
+            editor: dict,
+            hidden=False,
+            ):
+        self.coords = coords
+        self.sides = sides
+        self.editor = editor
+        self.hidden = hidden
+
+    @classmethod
+    def from_solid(cls, solid: VLib.Solid):
+        """Pack the data for a Solid."""
+        coords = array('d', VLib.pack_sides(solid.sides))
+        sides = []
+        for side in solid.sides:
+            if side.is_disp:
+                disp_data = side.disp_data.copy()
+                disp_data['power'] = side.disp_power
+                disp_data['pos'] = side.disp_pos.join(' ')
+                disp_data['flags'] = side.disp_flags
+                disp_data['elevation'] = side.disp_elev
+                disp_data['subdiv'] = side.disp_is_subdiv
+                disp_data['allowed_verts'] = side.disp_allowed_verts
+            else:
+                disp_data = None
+            sides.append((
+                side.id,
+                side.mat,
+                side.ham_rot,
+                side.lightmap,
+                side.smooth,
+                disp_data,
+            ))
+        editor = {
+            key: solid.editor[key]
+            for key in ('color', 'groupid', 'visgroupshown', 'visgroupautoshown')
+            if key in solid.editor
+        }
+        if 'visgroup' in solid.editor:
+            editor['visgroup'] = solid.editor['visgroup'][:]
+        return cls(coords, sides, editor, solid.hidden)
+
+    def instantiate(
+            self,
+            vmf: VLib.VMF,
+            origin: utils.Vec,
+            matrix=None,
+            side_mapping=utils.EmptyMapping,
+            ) -> VLib.Solid:
+        """Create a Solid in the map from this template brush.
+
+        This matches copying the original and calling localise().
+        matrix is the result of utils.rotation_matrix() for the angles,
+        or None if the brush shouldn't be rotated.
+        If passed, side_mapping will be updated with old -> new side IDs.
+        """
+        coords = VLib.transform_coords(self.coords, origin, matrix)
+        sides = []
+        for (side_id, mat, rot, lightmap, smooth, disp_data), start in zip(
+                self.sides,
+                range(0, len(coords), VLib.SIDE_COORDS),
+                ):
+            (
+                p1x, p1y, p1z, p2x, p2y, p2z, p3x, p3y, p3z,
+                ux, uy, uz, u_off, u_scale,
+                vx, vy, vz, v_off, v_scale,
+            ) = coords[start:start + VLib.SIDE_COORDS]
+            side = VLib.Side(
+                vmf,
+                planes=[(p1x, p1y, p1z), (p2x, p2y, p2z), (p3x, p3y, p3z)],
+                des_id=side_id,
+                mat=mat,
+                rotation=rot,
+                uaxis=VLib.UVAxis(ux, uy, uz, u_off, u_scale),
+                vaxis=VLib.UVAxis(vx, vy, vz, v_off, v_scale),
+                smoothing=smooth,
+                lightmap=lightmap,
+                disp_data=None if disp_data is None else disp_data.copy(),
+            )
+            side_mapping[str(side_id)] = str(side.id)
+            sides.append(side)
+
+        editor = self.editor.copy()
+        if 'visgroup' in editor:
+            editor['visgroup'] = editor['visgroup'][:]
+        return VLib.Solid(
+            vmf,
+            sides=sides,
+            editor=editor,
+            hidden=self.hidden,
+        )
+
+
+def compile_templates(vmf: VLib.VMF):
+    """Pack all the templates in a parsed VMF.
+
+    This returns a dict of template IDs to PackedTemplates.
+    """
+    world_ents = defaultdict(list)
+    detail_ents = defaultdict(list)
+    overlay_ents = defaultdict(list)
+    for ent in vmf.by_class['bee2_template_world']:
+        world_ents[ent['template_id'].casefold()].extend(
+            PackedSolid.from_solid(solid)
+            for solid in ent.solids
+        )
+
+    for ent in vmf.by_class['bee2_template_detail']:
+        detail_ents[ent['template_id'].casefold()].extend(
+            PackedSolid.from_solid(solid)
+            for solid in ent.solids
+        )
+
+    for ent in vmf.by_class['bee2_template_overlay']:
+        editor = ent.editor.copy()
+        editor['visgroup'] = editor.get('visgroup', [])[:]
+        overlay_ents[ent['template_id'].casefold()].append(
+            (ent.keys.copy(), editor)
+        )
+
+    return {
+        temp_id: PackedTemplate(
+            world_ents[temp_id],
+            detail_ents[temp_id],
+            overlay_ents[temp_id],
+        )
+        for temp_id in
+        set(world_ents).union(detail_ents, overlay_ents)
+    }
+
+
+def _vmf_stamp(vmf_loc):
+    """Get a value which changes when the template VMF does."""
+    stat = os.stat(vmf_loc)
+    return stat.st_mtime, stat.st_size
+
+
+def load(vmf_loc, cache_loc):
+    """Load the templates, from the cache if the VMF hasn't changed.
+
+    Otherwise the VMF is parsed and compiled, and the cache rewritten.
+    """
+    stamp = _vmf_stamp(vmf_loc)
+    try:
+        with open(cache_loc, 'rb') as f:
+            version, cache_stamp, templates = pickle.load(f)
+    except FileNotFoundError:
+        LOGGER.info('No template cache, parsing templates.')
+    except Exception:
+        LOGGER.warning('Template cache is corrupt, ignoring.')
+    else:
+        if version == CACHE_VERSION and cache_stamp == stamp:
+            LOGGER.info('Loaded {} templates from cache.', len(templates))
+            return templates
+        LOGGER.info('Template cache is outdated, parsing templates.')
+
+    templates = compile_templates(VLib.VMF.parse(vmf_loc))
+
+    temp_file = cache_loc + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump(
+                (CACHE_VERSION, stamp, templates),
+                f,
+                pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_file, cache_loc)
+    except OSError:
+        LOGGER.warning('Could not save template cache!')
+    return templates
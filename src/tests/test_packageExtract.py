@@ -0,0 +1,88 @@
+"""Tests for extracting files from packages."""
+import os
+import zipfile
+
+import packageExtract
+
+
+def make_zip(path, files):
+    """Write a zip like "zip -r" does, with entries for each directory."""
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        dirs = set()
+        for name in files:
+            parts = name.split('/')[:-1]
+            for i in range(1, len(parts) + 1):
+                dirs.add('/'.join(parts[:i]) + '/')
+        for folder in sorted(dirs):
+            zip_file.writestr(folder, b'')
+        for name, data in files.items():
+            zip_file.writestr(name, data)
+
+
+def test_directory_entries(tmp_path):
+    """Directory entries in zips are skipped, not written as files."""
+    pack = str(tmp_path / 'pack.zip')
+    make_zip(pack, {
+        'info.txt': b'',
+        'resources/bee2/items/icon.png': b'icon',
+        'resources/bee2/other.png': b'other',
+    })
+    dest = str(tmp_path / 'dest')
+    steps = []
+    with zipfile.ZipFile(pack) as zip_file:
+        extracted = packageExtract.extract_folder(
+            [zip_file],
+            os.path.join('resources', 'bee2'),
+            dest,
+            str(tmp_path / 'manifest.bin'),
+            steps.append,
+        )
+    assert extracted == 2
+    with open(os.path.join(dest, 'items', 'icon.png'), 'rb') as f:
+        assert f.read() == b'icon'
+    # The resources/bee2/ and resources/bee2/items/ entries are still
+    # counted, so progress bars fill.
+    assert len(steps) == 4
+    assert steps.count(False) == 2
+
+
+def test_unchanged_and_overridden(tmp_path):
+    """Later packages override earlier ones, and unchanged files are skipped."""
+    first = str(tmp_path / 'first.zip')
+    second = str(tmp_path / 'second.zip')
+    make_zip(first, {
+        'resources/materials/a.vmt': b'first',
+        'resources/materials/b.vmt': b'only first',
+    })
+    make_zip(second, {'resources/materials/a.vmt': b'second'})
+    dest = str(tmp_path / 'dest')
+    manifest = str(tmp_path / 'manifest.bin')
+
+    extractor = packageExtract.Extractor([first, second], 'resources', dest, manifest)
+    assert extractor.run() == 2
+    with open(os.path.join(dest, 'materials', 'a.vmt'), 'rb') as f:
+        assert f.read() == b'second'
+
+    extractor = packageExtract.Extractor([first, second], 'resources', dest, manifest)
+    assert extractor.run() == 0
+
+    # Removing a package deletes its files.
+    extractor = packageExtract.Extractor([second], 'resources', dest, manifest)
+    extractor.run()
+    assert not os.path.exists(os.path.join(dest, 'materials', 'b.vmt'))
+
+
+def test_background_error(tmp_path):
+    """Failures in the background thread are stored, and finish the events."""
+    pack = tmp_path / 'broken.zip'
+    pack.write_bytes(b'not a zip file')
+    extractor = packageExtract.Extractor(
+        [str(pack)],
+        'resources',
+        str(tmp_path / 'dest'),
+        str(tmp_path / 'manifest.bin'),
+    )
+    extractor.start()
+    extractor.thread.join()
+    assert isinstance(extractor.error, zipfile.BadZipFile)
+    assert extractor.events.get_nowait().done
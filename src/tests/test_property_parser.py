@@ -0,0 +1,168 @@
+"""Tests for the keyvalues parser and Property trees."""
+import pytest
+
+from property_parser import Property, KeyValError, NoKeyError
+
+
+def make_block(count=20):
+    """Make a block large enough to use the name index."""
+    return Property('block', [
+        Property('key{}'.format(i), 'value')
+        for i in range(count)
+    ])
+
+
+def test_index_replaced_child():
+    """Replacing a child in-place updates name lookups."""
+    block = make_block()
+    assert 'key3' in block
+    # Same value, so Property.__eq__ considers them equal.
+    block[3] = Property('new', 'value')
+    assert 'new' in block
+    assert 'key3' not in block
+    assert block.find_key('new', None).real_name == 'new'
+    assert len(list(block.find_all('new'))) == 1
+    with pytest.raises(NoKeyError):
+        block.find_key('key3')
+
+
+def test_index_renamed_child():
+    """Renaming a child updates name lookups."""
+    block = make_block()
+    assert 'key5' in block
+    block.value[5].name = 'renamed'
+    assert 'renamed' in block
+    assert 'key5' not in block
+
+
+def test_index_renamed_shared_child():
+    """Renaming a child in two indexed blocks updates both."""
+    first = make_block()
+    second = make_block()
+    second.value[7] = first.value[7]
+    assert 'key7' in first
+    assert 'key7' in second
+    first.value[7].name = 'shared'
+    assert 'shared' in first
+    assert 'shared' in second
+    assert 'key7' not in first
+    assert 'key7' not in second
+
+
+def test_index_mutators():
+    """Appending and deleting children updates name lookups."""
+    block = make_block()
+    assert 'extra' not in block
+    block += Property('extra', 'a')
+    assert block['extra'] == 'a'
+    block.append(Property('extra', 'b'))
+    assert block['extra'] == 'b'
+    del block['extra']
+    assert block['extra'] == 'a'
+    del block[0]
+    assert 'key0' not in block
+    assert block.find_key('key1').real_name == 'key1'
+
+
+def test_index_reordered_children():
+    """find_key() returns the last match after the children are reordered."""
+    block = make_block()
+    block.value.append(Property('key1', 'second'))
+    assert block['key1'] == 'second'
+    block.value.reverse()
+    assert block['key1'] == 'value'
+
+
+def parse_both(text):
+    """Parse with both the tokenizer and the line parser."""
+    return [
+        Property.parse(text),
+        Property._parse_lines(text.splitlines(True)),
+    ]
+
+
+@pytest.mark.parametrize('text, result', [
+    ('"a" "b" "c"\n', [Property('a', 'b')]),
+    ('"a" "b" "c" junk\n', [Property('a', 'b')]),
+    ('"a" "b" // comment\n', [Property('a', 'b')]),
+    ('"a" "b" "c', [Property('a', 'b')]),
+])
+def test_extra_strings_ignored(text, result):
+    """Extra quoted text after a value is ignored, as it always has been."""
+    for tree in parse_both(text):
+        assert [
+            (prop.real_name, prop.value) for prop in tree
+        ] == [
+            (prop.real_name, prop.value) for prop in result
+        ]
+
+
+@pytest.mark.parametrize('text, message, line', [
+    ('"a" "b" junk\n', 'Extra text after line: " junk"', 1),
+    ('blk\n{\n\t"a" "b" junk\n}\n', 'Extra text after line: " junk"', 3),
+    ('"a" "b\nmore\n', 'Reached EOF without ending quote!', 2),
+    ('blk\n{\n  ab"c" "d"\n}\n', "Unexpected beginning character 'a\"!", 3),
+    ('"a" "b"\n{\n}\n', 'Property cannot have sub-section if it '
+                        'already has an in-line value.', 2),
+    ('blk\n{\n"a" "b"\n}\n}\n', 'Too many closing brackets.', 5),
+    ('blk\n{\n"a" "b"\n', 'End of text reached with remaining '
+                          'open sections.', None),
+])
+def test_errors(text, message, line):
+    """Malformed text produces the same error from both parsers."""
+    for parse in [
+        Property.parse,
+        lambda text: Property._parse_lines(text.splitlines(True)),
+    ]:
+        with pytest.raises(KeyValError) as exc_info:
+            parse(text)
+        assert exc_info.value.mess == message
+        assert exc_info.value.line_num == line
+
+
+def parse_result(parse, text):
+    """Parse text, returning the tree or the error details."""
+    try:
+        return repr(parse(text))
+    except KeyValError as exc:
+        return exc.mess, exc.line_num
+
+
+@pytest.mark.parametrize('text', [
+    # The rest of the line after a bracket is ignored.
+    'a\n{{\n"k" "v"\n}\n',
+    'a\n{\n}x\n',
+    'a\n{\nb\n{\n}}\n}\n',
+    'a\n{ "k" "v"\n}\n',
+    # Bare names run to the end of the line.
+    'a {\n}\n',
+    'a "x"\n',
+    'a // c\n{\n}\n',
+    # Quoted names ignore the rest of the line.
+    '"a" {\n"k" "v"\n}\n',
+    '"a" junk\n{\n}\n',
+    '"a" // x "y"\n{\n}\n',
+    '"a\n{\n}\n',
+    # A block after a closed block.
+    'a\n{\n}\n{\n}\n',
+    # Multi-line values end on the first line ending with a quote.
+    '"a" "multi\nline" "extra"\n',
+    '"a" "x\n  mid " quote\n  end  "\n"b" "c"\n',
+    '"a" "b\n"k" "v"\n"z" "q"\n',
+])
+def test_parser_parity(text):
+    """The tokenizer gives the same result as the line parser."""
+    assert parse_result(Property.parse, text) == parse_result(
+        lambda text: Property._parse_lines(text.splitlines(True)),
+        text,
+    )
+
+
+def test_block_without_name():
+    """A block with nothing before it is a KeyValError.
+
+    The line parser raised IndexError instead.
+    """
+    with pytest.raises(KeyValError) as exc_info:
+        Property.parse('{\n}\n')
+    assert exc_info.value.mess == 'Sub-section has no name!'
@@ -0,0 +1,50 @@
+"""Tests for the resized image cache."""
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+import thumbCache
+
+
+def make_png(folder, name, colour):
+    path = os.path.join(str(folder), name)
+    Image.new('RGB', (128, 128), colour).save(path)
+    return path
+
+
+def test_prerender_new_images(tmpdir, monkeypatch):
+    """Images without an entry are rendered in the background."""
+    images = tmpdir.mkdir('images')
+    path = make_png(images.mkdir('items'), 'item.png', (255, 0, 0))
+    cache = thumbCache.ThumbnailCache(str(tmpdir.join('config')))
+    cache.start_refresh(str(images))
+    cache.thread.join()
+
+    def fail(*args):
+        raise AssertionError('Image was resized on demand!')
+    monkeypatch.setattr(thumbCache, 'resize', fail)
+    for size in thumbCache.SIZES:
+        image = cache.get(path, size, thumbCache.PRERENDER_ALGO)
+        assert image.size == (size, size)
+        assert image.getpixel((0, 0)) == (255, 0, 0)
+
+    # The rendered images were saved.
+    reloaded = thumbCache.ThumbnailCache(str(tmpdir.join('config')))
+    assert reloaded.get(path, 64, thumbCache.PRERENDER_ALGO).size == (64, 64)
+
+
+def test_refresh_changed_image(tmpdir):
+    """Changing the source image re-renders its entries."""
+    images = tmpdir.mkdir('images')
+    path = make_png(images, 'item.png', (255, 0, 0))
+    cache = thumbCache.ThumbnailCache(str(tmpdir.join('config')))
+    cache.get(path, 32, Image.NEAREST)
+
+    make_png(images, 'item.png', (0, 0, 255))
+    os.utime(path, ns=(0, 0))
+    cache.start_refresh(str(images))
+    cache.thread.join()
+    image = cache.get(path, 32, Image.NEAREST)
+    assert image.getpixel((0, 0)) == (0, 0, 255)
@@ -0,0 +1,50 @@
+"""Tests for reading and writing VMF files."""
+import io
+import os
+
+from vmfLib import VMF
+
+VMF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vmf')
+
+
+def read_file(name):
+    with open(os.path.join(VMF_DIR, name)) as f:
+        return f.read()
+
+
+def parse_map():
+    """Parse the export test map.
+
+    This has displacements, hidden objects, connections, cameras and
+    cordons.
+    """
+    return VMF.parse(os.path.join(VMF_DIR, 'export.vmf'))
+
+
+def test_export_golden():
+    """The exported map matches the stored output."""
+    vmf = parse_map()
+    assert vmf.export(inc_version=False) == read_file('export_golden.vmf')
+
+
+def test_export_minimal_golden():
+    """Minimal exports match the stored output."""
+    vmf = parse_map()
+    assert vmf.export(
+        inc_version=False,
+        minimal=True,
+    ) == read_file('export_minimal_golden.vmf')
+
+
+def test_export_file():
+    """Writing to a file gives the same text as returning a string."""
+    vmf = parse_map()
+    buf = io.StringIO()
+    vmf.export(buf, inc_version=False)
+    assert buf.getvalue() == read_file('export_golden.vmf')
+
+
+def test_export_round_trip():
+    """Parsing an exported map and exporting it again changes nothing."""
+    vmf = VMF.parse(os.path.join(VMF_DIR, 'export_golden.vmf'))
+    assert vmf.export(inc_version=False) == read_file('export_golden.vmf')
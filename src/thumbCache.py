@@ -0,0 +1,247 @@
+"""Stores resized copies of images, so they don't need decoding each launch.
+
+For each of the standard icon sizes, a cache file holds the raw pixel
+data of every resized image, along with the size and modification time
+of the source PNG. Building an image from this needs no decoding or
+resampling. After packages load, a background thread refreshes entries
+whose source file changed, and renders the standard sizes of any new
+package images. Other images are rendered when first requested.
+"""
+import os
+import pickle
+import threading
+
+from PIL import Image
+
+import utils
+
+LOGGER = utils.getLogger(__name__)
+
+# Increment if the format of the cache files changes.
+CACHE_VERSION = 1
+
+# The sizes which are stored. Other sizes are always resized directly.
+SIZES = (32, 64, 96)
+
+# Image modes which are stored directly, others are converted to RGBA.
+RAW_MODES = ('RGB', 'RGBA', 'L', 'LA')
+
+# The resampling filter used for images rendered in advance. This is the
+# default for img.png().
+PRERENDER_ALGO = Image.LANCZOS
+
+
+def _stamp(path):
+    """Get a value which changes when the file does."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def resize(path, size, algo):
+    """Decode and resize an image file."""
+    return _resize(Image.open(path), size, algo)
+
+
+def _resize(image, size, algo):
+    """Resize a decoded image."""
+    image = image.resize((size, size), algo)
+    if image.mode not in RAW_MODES:
+        image = image.convert('RGBA')
+    return image
+
+
+class ThumbnailCache:
+    """The cached thumbnails, with one file per size."""
+    def __init__(self, folder):
+        self.folder = folder
+        # size -> {(path, algo): (stamp, mode, dimensions, data)}
+        self.thumbs = {size: {} for size in SIZES}
+        self.thread = None
+        self._loaded = False
+        self._dirty = set()
+        self._lock = threading.Lock()
+        # Held while writing files, so the refresh thread and the main
+        # thread don't write the same temporary file at once.
+        self._save_lock = threading.Lock()
+
+    def _filename(self, size):
+        return os.path.join(self.folder, 'thumbs_{}.bin'.format(size))
+
+    def _load(self):
+        """Read the cache files, if this hasn't been done yet.
+
+        This must be called with the lock held.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        for size in SIZES:
+            try:
+                with open(self._filename(size), 'rb') as f:
+                    version, thumbs = pickle.load(f)
+            except FileNotFoundError:
+                continue
+            except Exception:
+                LOGGER.warning('Thumbnail cache for {}px is corrupt!', size)
+                continue
+            if version == CACHE_VERSION:
+                self.thumbs[size] = thumbs
+
+    def save(self):
+        """Write out any sizes which have changed."""
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        """Implements save(), with the save lock held."""
+        with self._lock:
+            to_save = [
+                (size, self.thumbs[size].copy())
+                for size in self._dirty
+            ]
+            self._dirty.clear()
+
+        os.makedirs(self.folder, exist_ok=True)
+        for size, thumbs in to_save:
+            filename = self._filename(size)
+            temp_file = filename + '.tmp'
+            try:
+                with open(temp_file, 'wb') as f:
+                    pickle.dump(
+                        (CACHE_VERSION, thumbs),
+                        f,
+                        pickle.HIGHEST_PROTOCOL,
+                    )
+                os.replace(temp_file, filename)
+            except OSError:
+                LOGGER.warning('Could not save {}px thumbnails!', size)
+
+    def get(self, path, size, algo):
+        """Get a resized copy of the image at path.
+
+        This uses the cache if the file hasn't changed, or otherwise
+        decodes the image and stores it for next time.
+        """
+        if size not in SIZES:
+            return resize(path, size, algo)
+        # Match the paths found by _prerender().
+        key = os.path.normcase(path), int(algo)
+        stamp = _stamp(path)
+        with self._lock:
+            self._load()
+            entry = self.thumbs[size].get(key)
+        if entry is not None and entry[0] == stamp:
+            stamp, mode, dimensions, data = entry
+            return Image.frombytes(mode, dimensions, data)
+        return self._render(key, size, stamp)
+
+    def _render(self, key, size, stamp):
+        """Resize an image and store it in the cache."""
+        path, algo = key
+        image = resize(path, size, algo)
+        self._store(key, size, stamp, image)
+        return image
+
+    def _store(self, key, size, stamp, image):
+        """Store a resized image in the cache."""
+        with self._lock:
+            self.thumbs[size][key] = (
+                stamp,
+                image.mode,
+                image.size,
+                image.tobytes(),
+            )
+            self._dirty.add(size)
+
+    def _refresh(self, folder):
+        """Update any entries whose source file changed, then save.
+
+        Images in folder without an entry are rendered at each size.
+        """
+        with self._lock:
+            self._load()
+            entries = [
+                (size, key, entry[0])
+                for size, thumbs in self.thumbs.items()
+                for key, entry in thumbs.items()
+            ]
+        refreshed = 0
+        for size, key, old_stamp in entries:
+            try:
+                stamp = _stamp(key[0])
+            except FileNotFoundError:
+                # The image was removed, forget it.
+                with self._lock:
+                    self.thumbs[size].pop(key, None)
+                    self._dirty.add(size)
+                continue
+            if stamp != old_stamp:
+                try:
+                    self._render(key, size, stamp)
+                except OSError:
+                    LOGGER.warning('Could not read "{}"!', key[0])
+                    continue
+                refreshed += 1
+        rendered = self._prerender(folder)
+        LOGGER.info(
+            'Refreshed {} thumbnails, rendered {} new.',
+            refreshed,
+            rendered,
+        )
+        self.save()
+
+    def _prerender(self, folder):
+        """Render the standard sizes of images which aren't cached yet.
+
+        This returns the number of images rendered.
+        """
+        rendered = 0
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                if not filename.casefold().endswith('.png'):
+                    continue
+                # img.png() uses absolute paths.
+                key = (
+                    os.path.normcase(os.path.abspath(
+                        os.path.join(dirpath, filename)
+                    )),
+                    int(PRERENDER_ALGO),
+                )
+                with self._lock:
+                    missing = [
+                        size for size in SIZES
+                        if key not in self.thumbs[size]
+                    ]
+                if not missing:
+                    continue
+                try:
+                    stamp = _stamp(key[0])
+                    image = Image.open(key[0])
+                    image.load()
+                except OSError:
+                    LOGGER.warning('Could not read "{}"!', key[0])
+                    continue
+                # Decode once for all the sizes.
+                for size in missing:
+                    self._store(
+                        key,
+                        size,
+                        stamp,
+                        _resize(image, size, PRERENDER_ALGO),
+                    )
+                rendered += 1
+        return rendered
+
+    def start_refresh(self, folder):
+        """Refresh changed thumbnails in a background thread.
+
+        Images in folder are also rendered in advance, so they don't need
+        resizing when first shown.
+        """
+        self.thread = threading.Thread(
+            target=self._refresh,
+            args=(folder,),
+            name='thumbCache',
+            daemon=True,
+        )
+        self.thread.start()
@@ -1,4 +1,5 @@
 # coding=utf-8
+import functools
 import logging
 import math
 import string
@@ -833,6 +834,59 @@ class EmptyMapping(abc.MutableMapping):
 EmptyMapping = EmptyMapping()  # We only need the one instance
 
 
+# Exact (sin, cos) values for axis-aligned angles. These are used instead
+# of math.sin() and math.cos(), which give tiny errors at these angles.
+# They're floats, since multiplying floats by ints is slower.
+_AXIS_SIN_COS = {
+    0: (0.0, 1.0),
+    90: (1.0, 0.0),
+    180: (0.0, -1.0),
+    270: (-1.0, 0.0),
+}
+
+
+def _sin_cos(angle):
+    """Return the sine and cosine of an angle in degrees."""
+    try:
+        return _AXIS_SIN_COS[angle % 360]
+    except KeyError:
+        rad = math.radians(angle)
+        return math.sin(rad), math.cos(rad)
+
+
+@functools.lru_cache(maxsize=512)
+def rotation_matrix(pitch=0.0, yaw=0.0, roll=0.0):
+    """Compute the matrix Vec.rotate() applies for these angles.
+
+    The roll, pitch and yaw matrices are combined into one, returned
+    as a tuple of 3 rows. This is used to rotate many points at once.
+    Results are cached, since maps only use a few different angles.
+    For multiples of 90 degrees the matrix contains exact whole numbers.
+    """
+    sin_p, cos_p = _sin_cos(pitch)
+    sin_y, cos_y = _sin_cos(yaw)
+    sin_r, cos_r = _sin_cos(roll)
+
+    # Yaw * Pitch * Roll, multiplied out.
+    return (
+        (
+            cos_y * cos_p,
+            cos_y * sin_p * sin_r - sin_y * cos_r,
+            cos_y * sin_p * cos_r + sin_y * sin_r,
+        ),
+        (
+            sin_y * cos_p,
+            sin_y * sin_p * sin_r + cos_y * cos_r,
+            sin_y * sin_p * cos_r - cos_y * sin_r,
+        ),
+        (
+            -sin_p,
+            cos_p * sin_r,
+            cos_p * cos_r,
+        ),
+    )
+
+
 Vec_tuple = collections.namedtuple('Vec_tuple', ['x', 'y', 'z'])
 
 
@@ -914,44 +968,18 @@ class Vec:
         # pitch is in the y axis
         # yaw is the z axis
         # roll is the x axis
-
-        rad_pitch = math.radians(pitch)
-        rad_yaw = math.radians(yaw)
-        rad_roll = math.radians(roll)
-        cos_p = math.cos(rad_pitch)
-        cos_y = math.cos(rad_yaw)
-        cos_r = math.cos(rad_roll)
-
-        sin_p = math.sin(rad_pitch)
-        sin_y = math.sin(rad_yaw)
-        sin_r = math.sin(rad_roll)
-
-        mat_roll = (  # X
-            (1, 0, 0),
-            (0, cos_r, -sin_r),
-            (0, sin_r, cos_r),
-        )
-        mat_yaw = (  # Z
-            (cos_y, -sin_y, 0),
-            (sin_y, cos_y, 0),
-            (0, 0, 1),
-        )
-
-        mat_pitch = (  # Y
-            (cos_p, 0, sin_p),
-            (0, 1, 0),
-            (-sin_p, 0, cos_p),
-        )
-
-        # Need to do transformations in roll, pitch, yaw order
-        self.mat_mul(mat_roll)
-        self.mat_mul(mat_pitch)
-        self.mat_mul(mat_yaw)
+        # The matrix does these in roll, pitch, yaw order.
+        (a, b, c), (d, e, f), (g, h, i) = rotation_matrix(pitch, yaw, roll)
+        x, y, z = self.x, self.y, self.z
 
         if round_vals:
-            self.x = round(self.x, 3)
-            self.y = round(self.y, 3)
-            self.z = round(self.z, 3)
+            self.x = round((x * a) + (y * b) + (z * c), 3)
+            self.y = round((x * d) + (y * e) + (z * f), 3)
+            self.z = round((x * g) + (y * h) + (z * i), 3)
+        else:
+            self.x = (x * a) + (y * b) + (z * c)
+            self.y = (x * d) + (y * e) + (z * f)
+            self.z = (x * g) + (y * h) + (z * i)
 
         return self
 
@@ -1543,3 +1571,35 @@ class Vec:
 
 abc.Mapping.register(Vec)
 abc.MutableMapping.register(Vec)
+
+if __name__ == '__main__':
+    # Benchmark Vec.rotate(), with and without the rotation matrix cache.
+    import sys
+    import time
+    import tracemalloc
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cached_matrix = rotation_matrix
+
+    for mode, matrix_func in [
+            ('Uncached', cached_matrix.__wrapped__),
+            ('Cached', cached_matrix),
+            ]:
+        rotation_matrix = matrix_func
+        for angles in [(0, 90, 0), (90, 180, 270), (12.5, 37, 5)]:
+            start = time.perf_counter()
+            for _ in range(count):
+                Vec(64, 128, -32).rotate(*angles)
+            duration = time.perf_counter() - start
+
+            tracemalloc.start()
+            vecs = [Vec(64, 128, -32).rotate(*angles) for _ in range(count)]
+            peak_mem = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del vecs
+            print('{} {}: {:.2f}s, peak {:.1f} MB'.format(
+                mode,
+                angles,
+                duration,
+                peak_mem / 1024 / 1024,
+            ))
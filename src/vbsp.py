@@ -9,6 +9,8 @@ import subprocess
 import shutil
 import random
 import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from collections import defaultdict, namedtuple
 from decimal import Decimal
@@ -20,6 +22,7 @@ import vmfLib as VLib
 import voiceLine
 import instanceLocs
 import conditions
+import profiler
 
 from typing import (
     Dict, Tuple,
@@ -403,16 +406,57 @@ def get_tile_type(mat, orient):
 ##################
 
 
-def load_settings():
-    """Load in all our settings from vbsp_config."""
-    global BEE2_config
+def parse_config(filename, required=True):
+    """Parse one of the BEE2 config files.
+
+    If required is False and the file is missing, an empty Property is
+    returned instead.
+    """
     try:
-        with open("bee2/vbsp_config.cfg") as config:
-            conf = Property.parse(config, 'bee2/vbsp_config.cfg')
+        with open(filename) as f:
+            return Property.parse(f, filename)
     except FileNotFoundError:
-        LOGGER.warning('Error: No vbsp_config file!')
-        conf = Property(None, [])
-        # All the find_all commands will fail, and we will use the defaults.
+        if required:
+            raise
+        LOGGER.warning('Error: No "{}" file!', filename)
+        return Property(None, [])
+
+
+def preload(map_path):
+    """Start parsing the files VBSP needs in the background.
+
+    None of these depend on each other, so they can all be read at once.
+    This returns a dict of futures, which should be passed to the
+    functions which use each file.
+    """
+    executor = ThreadPoolExecutor(max_workers=5)
+    futures = {
+        # If vbsp_config is missing, all the find_all commands will fail,
+        # and we will use the defaults.
+        'config': executor.submit(
+            parse_config, 'bee2/vbsp_config.cfg', required=False,
+        ),
+        'instances': executor.submit(parse_config, 'bee2/instances.cfg'),
+        'map': executor.submit(VLib.VMF.parse, map_path),
+        'templates': executor.submit(conditions.load_template_cache),
+        'pack_list': executor.submit(parse_config, 'bee2/pack_list.cfg'),
+    }
+    # Let the threads finish on their own, we wait on each future
+    # when it's needed.
+    executor.shutdown(wait=False)
+    return futures
+
+
+@profiler.stage
+def load_settings(conf=None, instance_file=None):
+    """Load in all our settings from vbsp_config.
+
+    conf and instance_file are the parsed vbsp_config and instances.cfg
+    files. If not passed, they will be read now.
+    """
+    global BEE2_config
+    if conf is None:
+        conf = parse_config('bee2/vbsp_config.cfg', required=False)
 
     tex_defaults = list(TEX_VALVE.items()) + TEX_DEFAULTS
 
@@ -464,10 +508,8 @@ def load_settings():
 
     # Load in the config file holding item data.
     # This is used to lookup item's instances, or their connection commands.
-    with open('bee2/instances.cfg') as f:
-        instance_file = Property.parse(
-            f, 'bee2/instances.cfg'
-        )
+    if instance_file is None:
+        instance_file = parse_config('bee2/instances.cfg')
     # Parse that data in the relevant modules.
     instanceLocs.load_conf(instance_file)
     conditions.build_connections_dict(instance_file)
@@ -546,14 +588,17 @@ def load_settings():
     LOGGER.info("Settings Loaded!")
 
 
-def load_map(map_path):
-    """Load in the VMF file."""
+@profiler.stage
+def load_map(map_path, vmf=None):
+    """Load in the VMF file.
+
+    If vmf is passed, that is the already parsed map.
+    """
     global VMF
-    with open(map_path) as file:
+    if vmf is None:
         LOGGER.info("Parsing Map...")
-        props = Property.parse(file, map_path)
-    LOGGER.info('Reading Map...')
-    VMF = VLib.VMF.parse(props)
+        vmf = VLib.VMF.parse(map_path)
+    VMF = vmf
     LOGGER.info("Loading complete!")
 
 
@@ -1183,6 +1228,7 @@ def ap_tag_modifications(_):
             )
 
 
+@profiler.stage
 def get_map_info():
     """Determine various attributes about the map.
 
@@ -1612,6 +1658,7 @@ def fit_goo_mist(
                 needs_mist.remove((pos.x+x, pos.y+y, pos.z))
 
 
+@profiler.stage
 def change_goo_sides():
     """Replace the textures on the sides of goo with specific ones.
 
@@ -1619,13 +1666,6 @@ def change_goo_sides():
     if settings['textures']['special.goo_wall'] == ['']:
         return
     LOGGER.info("Changing goo sides...")
-    face_dict = {}
-    for solid in VMF.iter_wbrushes(world=True, detail=False):
-        for face in solid:
-            if face.mat.casefold() != 'tools/toolsnodraw':
-                # Don't record the goo textured brushes
-                x, y, z = face.get_origin()
-                face_dict[x, y, z] = face
 
     dirs = [
         # x, y, z
@@ -1635,6 +1675,15 @@ def change_goo_sides():
         (-64, 0, 0),  # West
         (0, 0, -64),  # Down
     ]
+
+    # If several faces are centered on a point, only the last one in
+    # VMF.iter_wbrushes() order is changed.
+    brush_order = {solid: i for i, solid in enumerate(VMF.brushes)}
+
+    def face_order(face):
+        solid = VMF.spatial.face_solid(face)
+        return brush_order[solid], solid.sides.index(face)
+
     for trig in VMF.by_class['trigger_multiple']:
         if trig['wait'] != '0.1':
             continue
@@ -1643,19 +1692,25 @@ def change_goo_sides():
         for x in range(int(bbox_min.x)+64, int(bbox_max.x), 128):
             for y in range(int(bbox_min.y)+64, int(bbox_max.y), 128):
                 for xoff, yoff, zoff in dirs:
-                    try:
-                        face = face_dict[x+xoff, y+yoff, z+zoff]
-                    except KeyError:
+                    faces = [
+                        face for face in
+                        VMF.spatial.iter_wfaces_at(
+                            Vec(x+xoff, y+yoff, z+zoff),
+                            world=True,
+                            detail=False,
+                        )
+                        # Don't use the goo textured brushes
+                        if face.mat.casefold() != 'tools/toolsnodraw'
+                    ]
+                    if not faces:
                         continue
-
-                    if (
-                            face.mat.casefold() in BLACK_PAN or
-                            face.mat.casefold() == 'tools/toolsnodraw'
-                            ):
+                    face = max(faces, key=face_order)
+                    if face.mat.casefold() in BLACK_PAN:
                         face.mat = get_tex('special.goo_wall')
     LOGGER.info("Done!")
 
 
+@profiler.stage
 def collapse_goo_trig():
     """Collapse the goo triggers to only use 2 entities for all pits."""
     LOGGER.info('Collapsing goo triggers...')
@@ -1691,6 +1746,7 @@ def collapse_goo_trig():
     LOGGER.info('Done!')
 
 
+@profiler.stage
 def remove_static_ind_toggles():
     """Remove indicator_toggle instances that don't have assigned overlays.
 
@@ -1709,6 +1765,7 @@ def remove_static_ind_toggles():
     LOGGER.info('Done!')
 
 
+@profiler.stage
 def remove_barrier_ents():
     """If glass_clip or grating_clip is defined, we should remove the glass instances.
 
@@ -1745,6 +1802,7 @@ def fix_squarebeams(face, rotate, reset_offset: bool, scale: float):
     targ.scale = scale
 
 
+@profiler.stage
 def change_brush():
     """Alter all world/detail brush textures to use the configured ones."""
     LOGGER.info("Editing Brushes...")
@@ -2296,6 +2354,7 @@ def set_antline_mat(
         del over['targetname']
 
 
+@profiler.stage
 def change_overlays():
     """Alter the overlays."""
     LOGGER.info("Editing Overlays...")
@@ -2396,6 +2455,7 @@ def change_overlays():
             )
 
 
+@profiler.stage
 def change_trig():
     """Check the triggers and fizzlers."""
     LOGGER.info("Editing Triggers...")
@@ -2420,6 +2480,7 @@ def change_trig():
             trig['targetname'] = target[:-6] + '-br_hurt'
 
 
+@profiler.stage
 def add_extra_ents(mode):
     """Add the various extra instances to the map."""
     LOGGER.info("Adding Music...")
@@ -2493,6 +2554,7 @@ def add_extra_ents(mode):
         )
 
 
+@profiler.stage
 def change_func_brush():
     """Edit func_brushes."""
     LOGGER.info("Editing Brush Entities...")
@@ -2652,6 +2714,7 @@ def change_func_brush():
         TO_PACK.add(get_opt('grating_pack').casefold())
 
 
+@profiler.stage
 def alter_flip_panel():
     flip_panel_start = get_opt('flip_sound_start')
     flip_panel_stop = get_opt('flip_sound_stop')
@@ -2779,6 +2842,7 @@ def make_static_pan(ent, pan_type, is_bullseye=False):
     return True
 
 
+@profiler.stage
 def change_ents():
     """Edit misc entities."""
     LOGGER.info("Editing Other Entities...")
@@ -2795,6 +2859,7 @@ def change_ents():
                 VMF.remove_ent(auto)
 
 
+@profiler.stage
 def fix_inst():
     for inst in VMF.by_class['func_instance']:
         # TODO: remake this in a condition
@@ -2850,6 +2915,7 @@ def fix_inst():
                     ))
 
 
+@profiler.stage
 def fix_worldspawn():
     """Adjust some properties on WorldSpawn."""
     LOGGER.info("Editing WorldSpawn")
@@ -2864,22 +2930,26 @@ def fix_worldspawn():
     VMF.spawn['skyname'] = get_tex("special.sky")
 
 
-@conditions.make_result('Pack')
+@conditions.make_result('Pack', is_global=True)
 def packlist_cond(_, res):
     """Add the files in the given packlist to the map."""
     TO_PACK.add(res.value.casefold())
 
     return conditions.RES_EXHAUSTED
 
-@conditions.make_result('PackRename')
+@conditions.make_result('PackRename', is_global=True)
 def packlist_cond_rename(_, res):
     """Add a file to the packlist, saved under a new name."""
     PACK_RENAME[res['dest']] = res['file']
     return conditions.RES_EXHAUSTED
 
 
-def make_packlist(map_path):
-    """Write the list of files that VRAD should pack."""
+@profiler.stage
+def make_packlist(map_path, pack_list=None):
+    """Write the list of files that VRAD should pack.
+
+    pack_list is the parsed pack_list.cfg, if already read.
+    """
 
     # Scan map materials for marked materials
     # This way world-brush materials can be packed.
@@ -2916,11 +2986,9 @@ def make_packlist(map_path):
 
     LOGGER.info('Making Pack list...')
 
-    with open('bee2/pack_list.cfg') as f:
-        props = Property.parse(
-            f,
-            'bee2/pack_list.cfg'
-        ).find_key('PackList', [])
+    if pack_list is None:
+        pack_list = parse_config('bee2/pack_list.cfg')
+    props = pack_list.find_key('PackList', [])
 
     for pack_id in TO_PACK:
         PACK_FILES.update(
@@ -2941,6 +3009,7 @@ def make_packlist(map_path):
     LOGGER.info('Packlist written!')
 
 
+@profiler.stage
 def make_vrad_config():
     """Generate a config file for VRAD from our configs.
 
@@ -2971,6 +3040,7 @@ def make_vrad_config():
             f.write(line)
 
 
+@profiler.stage
 def save(path):
     """Save the modified map back to the correct location.
     """
@@ -3041,6 +3111,7 @@ def main():
 
     """
     global MAP_SEED, IS_PREVIEW, GAME_MODE
+    start_time = time.perf_counter()
     LOGGER.info("BEE{} VBSP hook initiallised.", utils.BEE_VERSION)
 
     args = " ".join(sys.argv)
@@ -3058,6 +3129,8 @@ def main():
             '-dump_conditions: Print a list of all condition flags,\n'
             '  results, and metaconditions.\n'
             '-bee2_verbose: Print debug messages to the console.\n'
+            '-bee2_profile: Time each stage and condition, and write\n'
+            '  the results to ' + profiler.REPORT_LOC + '.\n'
             '-verbose: A default VBSP command, has the same effect as above.\n'
             '-force_peti: Force enabling map conversion. \n'
             "-force_hammer: Don't convert the map at all.\n"
@@ -3072,6 +3145,10 @@ def main():
         utils.stdout_loghandler.setLevel('DEBUG')
         LOGGER.info('Switched to verbose logging.')
 
+    if '-bee2_profile' in folded_args:
+        profiler.enable()
+        LOGGER.info('Profiling enabled.')
+
     conditions.import_conditions()  # Import all the conditions and
     # register them.
 
@@ -3096,6 +3173,9 @@ def main():
         if a == '-force_peti' or a == '-force_hammer':
             new_args[i] = ''
             old_args[i] = ''
+        if a.casefold() == '-bee2_profile':
+            new_args[i] = ''
+            old_args[i] = ''
         # Strip the entity limit, and the following number
         if a == '-entity_limit':
             new_args[i] = ''
@@ -3130,10 +3210,15 @@ def main():
     else:
         LOGGER.info("PeTI map detected!")
 
+        preloaded = preload(path)
+
         LOGGER.info("Loading settings...")
-        load_settings()
+        load_settings(
+            preloaded['config'].result(),
+            preloaded['instances'].result(),
+        )
 
-        load_map(path)
+        load_map(path, preloaded['map'].result())
 
         MAP_SEED = calc_rand_seed()
 
@@ -3143,10 +3228,17 @@ def main():
             seed=MAP_SEED,
             inst_list=all_inst,
             vmf_file=VMF,
+            templates=preloaded['templates'].result(),
             )
 
         fix_inst()
         alter_flip_panel()  # Must be done before conditions!
+
+        startup_time = time.perf_counter() - start_time
+        LOGGER.info('Time to first condition: {:.2f}s', startup_time)
+        if profiler.ENABLED:
+            profiler.record(profiler.CAT_STAGE, '<startup>', startup_time)
+
         conditions.check_all()
         add_extra_ents(mode=GAME_MODE)
 
@@ -3161,10 +3253,11 @@ def main():
         remove_barrier_ents()
         fix_worldspawn()
 
-        make_packlist(path)
+        make_packlist(path, preloaded['pack_list'].result())
         make_vrad_config()
 
         save(new_path)
+        profiler.report()
         run_vbsp(
             vbsp_args=new_args,
             do_swap=True,
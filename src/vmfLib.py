@@ -4,11 +4,16 @@ specifics of VMF files.
 """
 import io
 import operator
-from collections import defaultdict, namedtuple
+from collections import abc, defaultdict, namedtuple
 from contextlib import suppress
+from functools import lru_cache
 import itertools
+import math
 
-from property_parser import Property
+from property_parser import (
+    Property, KeyValError, iter_tokens,
+    TOK_PAIR, TOK_NAME, TOK_BRACE_OPEN,
+)
 from utils import Vec
 import utils
 
@@ -34,6 +39,47 @@ _DISP_ROWS = (
     'triangle_tags',
 )
 
+# Template for the fixed part of brush sides, so each can be generated
+# with one format() call. This must match Vec.join() and UVAxis.__str__().
+_SIDE_FMT = (
+    'side\n'
+    '{{\n'
+    '\t"id" "{}"\n'
+    '\t"plane" "({:g} {:g} {:g}) ({:g} {:g} {:g}) ({:g} {:g} {:g})"\n'
+    '\t"material" "{}"\n'
+    '\t"uaxis" "[{:g} {:g} {:g} {:g}] {:g}"\n'
+    '\t"vaxis" "[{:g} {:g} {:g} {:g}] {:g}"\n'
+    '\t"rotation" "{}"\n'
+    '\t"lightmapscale" "{}"\n'
+    '\t"smoothing_groups" "{}"\n'
+)
+_DISP_FMT = (
+    '{ind}\tdispinfo\n'
+    '{ind}\t{{\n'
+    '{ind}\t\t"power" "{power}"\n'
+    '{ind}\t\t"startposition" "[{pos}]"\n'
+    '{ind}\t\t"flags" "{flags}"\n'
+    '{ind}\t\t"elevation" "{elev}"\n'
+    '{ind}\t\t"subdiv" "{subdiv}"\n'
+)
+
+
+@lru_cache(maxsize=None)
+def _side_template(ind: str):
+    """Get the side template, with each line indented."""
+    return ''.join(ind + line for line in _SIDE_FMT.splitlines(True))
+
+# The number of strings buffered before being written to the file
+# when exporting.
+CHUNK_SIZE = 4096
+
+# The size of cells used by SpatialIndex - the PeTI grid.
+GRID_SIZE = 128
+# Objects covering more cells than this are checked in every search.
+MAX_INDEX_CELLS = 512
+# Allowed error when comparing positions in the index.
+INDEX_EPSILON = 0.01
+
 # Return value for VMF.make_prism()
 PrismFace = namedtuple(
     "PrismFace",
@@ -44,26 +90,44 @@ PrismFace = namedtuple(
 OUTPUT_SEP = chr(27)
 
 class IDMan(set):
-    """Allocate and manage a set of unique IDs."""
-    __slots__ = ()
+    """Allocate and manage a set of unique IDs.
+
+    This remembers the lowest ID which might be free, so allocating
+    doesn't need to check every used ID.
+    """
+    __slots__ = ('_next_free',)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._next_free = 1
 
     def get_id(self, desired=-1):
         """Get a valid ID."""
 
-        if desired == -1:
-            # Start with the lowest ID, and look upwards
-            desired = 1
-
-        if desired not in self:
+        if desired != -1 and desired not in self:
             # The desired ID is avalible!
             self.add(desired)
             return desired
 
-        # Check every ID in order to find a valid one
-        for poss_id in itertools.count(start=1):
-            if poss_id not in self:
-                self.add(poss_id)
-                return poss_id
+        # Start with the lowest ID, and look upwards.
+        # Every ID below _next_free is used.
+        poss_id = self._next_free
+        while poss_id in self:
+            poss_id += 1
+        self._next_free = poss_id + 1
+        self.add(poss_id)
+        return poss_id
+
+    def remove(self, elem):
+        """Release an ID, so it can be reused."""
+        super().remove(elem)
+        if elem < self._next_free:
+            self._next_free = elem
+
+    def discard(self, elem):
+        """Release an ID if it's used, so it can be reused."""
+        if elem in self:
+            self.remove(elem)
 
 
 def find_empty_id(used_id, desired=-1):
@@ -174,6 +238,176 @@ def localise_overlay(over, origin, angles=None):
         over[key] = ang.join(' ')
 
 
+# The floats used for each face by pack_sides() - 3 plane points, then
+# the x, y, z, offset and scale of the u and v axes.
+SIDE_COORDS = 19
+
+
+def pack_sides(sides: Iterable['Side']) -> List[float]:
+    """Get the plane points and texture axes of faces as a flat list.
+
+    This has SIDE_COORDS values for each face.
+    """
+    coords = []
+    add = coords.extend
+    for side in sides:
+        for point in side.planes:
+            add((point.x, point.y, point.z))
+        for axis in (side.uaxis, side.vaxis):
+            add((axis.x, axis.y, axis.z, axis.offset, axis.scale))
+    return coords
+
+
+def unpack_sides(sides: Iterable['Side'], coords):
+    """Store values from pack_sides() back into the faces."""
+    for side, start in zip(sides, itertools.count(0, SIDE_COORDS)):
+        (
+            p1x, p1y, p1z, p2x, p2y, p2z, p3x, p3y, p3z,
+            ux, uy, uz, u_off, u_scale,
+            vx, vy, vz, v_off, v_scale,
+        ) = coords[start:start + SIDE_COORDS]
+        point1, point2, point3 = side.planes
+        point1.x, point1.y, point1.z = p1x, p1y, p1z
+        point2.x, point2.y, point2.z = p2x, p2y, p2z
+        point3.x, point3.y, point3.z = p3x, p3y, p3z
+        uaxis = side.uaxis
+        uaxis.x, uaxis.y, uaxis.z, uaxis.offset = ux, uy, uz, u_off
+        vaxis = side.vaxis
+        vaxis.x, vaxis.y, vaxis.z, vaxis.offset = vx, vy, vz, v_off
+
+
+def transform_coords(coords, origin, matrix=None, wrap_offsets=True):
+    """Rotate then shift faces packed by pack_sides().
+
+    matrix is the result of utils.rotation_matrix() for the angles, or
+    None to only shift them. Rotated values are rounded to 3 decimal
+    places, like Vec.rotate(). Texture offsets are changed to keep the
+    texture in place, and kept between -1024 and 1024 if wrap_offsets
+    is set. This returns a new list.
+    """
+    ox, oy, oz = origin
+    if matrix is not None:
+        (a, b, c), (d, e, f), (g, h, i) = matrix
+    result = []
+    add = result.extend
+    for start in range(0, len(coords), SIDE_COORDS):
+        (
+            p1x, p1y, p1z, p2x, p2y, p2z, p3x, p3y, p3z,
+            ux, uy, uz, u_off, u_scale,
+            vx, vy, vz, v_off, v_scale,
+        ) = coords[start:start + SIDE_COORDS]
+        if matrix is not None:
+            p1x, p1y, p1z = (
+                round(a * p1x + b * p1y + c * p1z, 3),
+                round(d * p1x + e * p1y + f * p1z, 3),
+                round(g * p1x + h * p1y + i * p1z, 3),
+            )
+            p2x, p2y, p2z = (
+                round(a * p2x + b * p2y + c * p2z, 3),
+                round(d * p2x + e * p2y + f * p2z, 3),
+                round(g * p2x + h * p2y + i * p2z, 3),
+            )
+            p3x, p3y, p3z = (
+                round(a * p3x + b * p3y + c * p3z, 3),
+                round(d * p3x + e * p3y + f * p3z, 3),
+                round(g * p3x + h * p3y + i * p3z, 3),
+            )
+            ux, uy, uz = (
+                round(a * ux + b * uy + c * uz, 3),
+                round(d * ux + e * uy + f * uz, 3),
+                round(g * ux + h * uy + i * uz, 3),
+            )
+            vx, vy, vz = (
+                round(a * vx + b * vy + c * vz, 3),
+                round(d * vx + e * vy + f * vz, 3),
+                round(g * vx + h * vy + i * vz, 3),
+            )
+        # Fix offset - see source-sdk: utils/vbsp/map.cpp line 2237
+        u_off -= (ox * ux + oy * uy + oz * uz) / u_scale
+        v_off -= (ox * vx + oy * vy + oz * vz) / v_scale
+        if wrap_offsets:
+            # Keep the values low. The highest texture size in P2 is 1024,
+            # so do the next power just to be safe.
+            # Add and subtract 1024 so the value is between -1024, 1024
+            # not 0, 2048 (This just looks nicer)
+            u_off = (u_off + 1024) % 2048 - 1024
+            v_off = (v_off + 1024) % 2048 - 1024
+        add((
+            p1x + ox, p1y + oy, p1z + oz,
+            p2x + ox, p2y + oy, p2z + oz,
+            p3x + ox, p3y + oy, p3z + oz,
+            ux, uy, uz, u_off, u_scale,
+            vx, vy, vz, v_off, v_scale,
+        ))
+    return result
+
+
+def localise_sides(sides: Iterable['Side'], origin, angles=None):
+    """Rotate and then shift many brush faces at once.
+
+    This does the same as Side.localise() on each face, but the rotation
+    matrix is only computed once.
+    """
+    sides = list(sides)
+    if angles is not None:
+        matrix = utils.rotation_matrix(angles[0], angles[1], angles[2])
+    else:
+        matrix = None
+    unpack_sides(sides, transform_coords(pack_sides(sides), origin, matrix))
+
+
+def translate_sides(sides: Iterable['Side'], diff):
+    """Move many brush faces by the specified vector.
+
+    This does the same as Side.translate() on each face.
+    A tuple can be passed in instead of a Vec if desired.
+    """
+    sides = list(sides)
+    unpack_sides(sides, transform_coords(
+        pack_sides(sides),
+        diff,
+        wrap_offsets=False,
+    ))
+
+
+def localise_solids(solids: Iterable['Solid'], origin, angles=None):
+    """Shift many brushes by the given origin/angles.
+
+    This does the same as Solid.localise() on each brush.
+    """
+    solids = list(solids)
+    localise_sides(
+        [side for solid in solids for side in solid.sides],
+        origin,
+        angles,
+    )
+    for solid in solids:
+        if solid.map._spatial is not None:
+            solid.map._spatial.update_solid(solid)
+
+
+def translate_solids(solids: Iterable['Solid'], diff):
+    """Move many brushes by the specified vector.
+
+    This does the same as Solid.translate() on each brush.
+    """
+    solids = list(solids)
+    translate_sides(
+        [side for solid in solids for side in solid.sides],
+        diff,
+    )
+    for solid in solids:
+        if solid.map._spatial is not None:
+            solid.map._spatial.update_solid(solid)
+
+
+def _fold_file(filename: Optional[str]) -> Optional[str]:
+    """Casefold an instance filename for VMF.by_file."""
+    if filename is None:
+        return None
+    return filename.casefold()
+
+
 class CopySet(set):
     """Modified version of a Set which allows modification during iteration.
 
@@ -188,14 +422,388 @@ class CopySet(set):
         yield from (self - cur_items)
 
 
+class KeyValues(abc.MutableMapping):
+    """The keyvalues of an entity.
+
+    Keys are looked up case-insensitively. The first spelling used for
+    each key is kept, for exporting.
+    """
+    __slots__ = ['_data']  # Folded key -> (key, value)
+
+    def __init__(self, values=()):
+        self._data = {}
+        self.update(values)
+
+    def __getitem__(self, key: str) -> str:
+        return self._data[key.casefold()][1]
+
+    def get(self, key: str, default=None):
+        try:
+            return self._data[key.casefold()][1]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: str):
+        folded = key.casefold()
+        try:
+            key = self._data[folded][0]
+        except KeyError:
+            pass
+        self._data[folded] = (key, value)
+
+    def __delitem__(self, key: str):
+        del self._data[key.casefold()]
+
+    def __contains__(self, key: str):
+        return key.casefold() in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        for key, value in self._data.values():
+            yield key
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """Return a view of the (key, value) pairs, with original spelling."""
+        return self._data.values()
+
+    def clear(self):
+        self._data.clear()
+
+    def copy(self) -> Dict[str, str]:
+        """Return the keyvalues as a regular dict."""
+        return dict(self._data.values())
+
+
+class SpatialIndex:
+    """Finds objects by location, using a grid of cells.
+
+    Each object is stored with a bounding box, and is recorded in every
+    grid cell the box touches. Objects which cover too many cells are
+    kept in a separate list and always checked.
+    Results are returned in the order objects were added, so they are
+    consistent between compiles.
+    """
+    def __init__(self, grid_size=GRID_SIZE, max_cells=MAX_INDEX_CELLS):
+        self.grid_size = grid_size
+        self.max_cells = max_cells
+        # Cell -> objects touching it.
+        self._cells = defaultdict(list)
+        # Objects too large to store in cells.
+        self._large = []
+        # Object -> (order, bbox_min, bbox_max, cells)
+        self._bounds = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __contains__(self, obj):
+        return obj in self._bounds
+
+    def __iter__(self):
+        return iter(self._sorted(self._bounds))
+
+    def _cell_range(self, bbox_min, bbox_max):
+        """Return the range of cells covered by a box."""
+        size = self.grid_size
+        return (
+            range(
+                int(math.floor(bbox_min[0] / size)),
+                int(math.floor(bbox_max[0] / size)) + 1,
+            ),
+            range(
+                int(math.floor(bbox_min[1] / size)),
+                int(math.floor(bbox_max[1] / size)) + 1,
+            ),
+            range(
+                int(math.floor(bbox_min[2] / size)),
+                int(math.floor(bbox_max[2] / size)) + 1,
+            ),
+        )
+
+    def add(self, obj, bbox_min: Vec, bbox_max: Vec):
+        """Add an object to the index, covering the given area."""
+        if obj in self._bounds:
+            self.remove(obj)
+        bbox_min = bbox_min.as_tuple()
+        bbox_max = bbox_max.as_tuple()
+        x_range, y_range, z_range = self._cell_range(bbox_min, bbox_max)
+        if len(x_range) * len(y_range) * len(z_range) > self.max_cells:
+            cells = None
+            self._large.append(obj)
+        else:
+            cells = tuple(itertools.product(x_range, y_range, z_range))
+            for cell in cells:
+                self._cells[cell].append(obj)
+        self._bounds[obj] = next(self._counter), bbox_min, bbox_max, cells
+
+    def remove(self, obj):
+        """Remove an object from the index.
+
+        This does nothing if the object isn't present.
+        """
+        try:
+            order, bbox_min, bbox_max, cells = self._bounds.pop(obj)
+        except KeyError:
+            return
+        if cells is None:
+            self._large.remove(obj)
+        else:
+            for cell in cells:
+                cell_list = self._cells[cell]
+                cell_list.remove(obj)
+                if not cell_list:
+                    del self._cells[cell]
+
+    def get_bbox(self, obj) -> Tuple[Vec, Vec]:
+        """Return the bounding box an object was stored with."""
+        order, bbox_min, bbox_max, cells = self._bounds[obj]
+        return Vec(bbox_min), Vec(bbox_max)
+
+    def _sorted(self, objects):
+        """Sort objects into the order they were added."""
+        bounds = self._bounds
+        return sorted(objects, key=lambda obj: bounds[obj][0])
+
+    def find_box(self, bbox_min: Vec, bbox_max: Vec) -> List:
+        """Return all objects whose boxes overlap the given box.
+
+        Touching boxes count as overlapping.
+        """
+        min_x, min_y, min_z = bbox_min
+        max_x, max_y, max_z = bbox_max
+        min_x -= INDEX_EPSILON
+        min_y -= INDEX_EPSILON
+        min_z -= INDEX_EPSILON
+        max_x += INDEX_EPSILON
+        max_y += INDEX_EPSILON
+        max_z += INDEX_EPSILON
+
+        x_range, y_range, z_range = self._cell_range(
+            (min_x, min_y, min_z),
+            (max_x, max_y, max_z),
+        )
+        if len(x_range) * len(y_range) * len(z_range) > len(self._cells):
+            # It's quicker to just check everything.
+            candidates = self._bounds.keys()
+        else:
+            candidates = set(self._large)
+            cells = self._cells
+            for cell in itertools.product(x_range, y_range, z_range):
+                if cell in cells:
+                    candidates.update(cells[cell])
+
+        bounds = self._bounds
+        found = []
+        for obj in candidates:
+            order, (x1, y1, z1), (x2, y2, z2), cells = bounds[obj]
+            if (
+                x1 <= max_x and min_x <= x2 and
+                y1 <= max_y and min_y <= y2 and
+                z1 <= max_z and min_z <= z2
+            ):
+                found.append(obj)
+        return self._sorted(found)
+
+    def find_point(self, point: Vec) -> List:
+        """Return all objects whose boxes contain the point."""
+        return self.find_box(point, point)
+
+    def find_ray(self, start: Vec, direction: Vec, max_dist=65536.0):
+        """Return objects whose boxes are hit by the given ray.
+
+        This produces (distance, object) tuples, sorted by distance.
+        Objects containing the start point have a distance of 0.
+        """
+        direction = direction.norm()
+        end = start + direction * max_dist
+        bbox_min, bbox_max = Vec.bbox([start, end])
+
+        hits = []
+        for obj in self.find_box(bbox_min, bbox_max):
+            order, box_min, box_max, cells = self._bounds[obj]
+            # Slab test - find where the ray enters and leaves each axis.
+            near = 0.0
+            far = max_dist
+            for axis in range(3):
+                pos = start[axis]
+                off = direction[axis]
+                low = box_min[axis] - INDEX_EPSILON
+                high = box_max[axis] + INDEX_EPSILON
+                if off == 0:
+                    if not low <= pos <= high:
+                        break
+                    continue
+                dist_low = (low - pos) / off
+                dist_high = (high - pos) / off
+                if dist_low > dist_high:
+                    dist_low, dist_high = dist_high, dist_low
+                near = max(near, dist_low)
+                far = min(far, dist_high)
+                if near > far:
+                    break
+            else:
+                hits.append((near, obj))
+        # Stable, so equal distances stay in the added order.
+        hits.sort(key=operator.itemgetter(0))
+        return hits
+
+
+class MapIndex:
+    """Spatial indexes for the solids, faces and entities in a map.
+
+    Use VMF.spatial to get this, which builds it when first needed.
+    Afterward the VMF keeps it updated when brushes or entities are
+    added or removed with add_brush(), add_ent() and so on, moved with
+    translate() or localise(), or when an entity's origin is set.
+
+    Other changes aren't detected - appending to ent.solids, or editing
+    the planes of faces directly. After those, call add_solid() or
+    update_solid() on the changed brushes.
+    """
+    def __init__(self, vmf: 'VMF'):
+        self.solids = SpatialIndex()
+        self.faces = SpatialIndex()
+        self.entities = SpatialIndex()
+        # The entity owning each solid, or None for world brushes.
+        self._solid_owner = {}  # type: Dict[Solid, Optional[Entity]]
+        # The solid each face is part of.
+        self._face_solid = {}  # type: Dict[Side, Solid]
+        # Every entity added, including ones without a location.
+        self._ents = set()  # type: Set[Entity]
+
+        for solid in vmf.brushes:
+            self.add_solid(solid)
+        for ent in vmf.entities:
+            self.add_ent(ent)
+
+    def add_solid(self, solid: 'Solid', owner: 'Entity'=None):
+        """Add a solid and its faces to the index."""
+        solid_min = solid_max = None
+        for face in solid.sides:
+            bbox_min, bbox_max = face.get_bbox()
+            self.faces.add(face, bbox_min, bbox_max)
+            self._face_solid[face] = solid
+            # Reuse the face boxes to get the solid's box.
+            if solid_min is None:
+                solid_min, solid_max = bbox_min.copy(), bbox_max.copy()
+            else:
+                solid_min.min(bbox_min)
+                solid_max.max(bbox_max)
+        if solid_min is not None:
+            self.solids.add(solid, solid_min, solid_max)
+        self._solid_owner[solid] = owner
+
+    def remove_solid(self, solid: 'Solid'):
+        """Remove a solid and its faces from the index."""
+        self.solids.remove(solid)
+        self._solid_owner.pop(solid, None)
+        for face in solid.sides:
+            self.faces.remove(face)
+            self._face_solid.pop(face, None)
+
+    def update_solid(self, solid: 'Solid'):
+        """Update the location of a solid after it was moved.
+
+        If it's part of a brush entity, the entity is updated too.
+        """
+        if solid not in self._solid_owner:
+            return
+        owner = self._solid_owner[solid]
+        self.add_solid(solid, owner)
+        if owner is not None and owner in self._ents:
+            self._add_ent_bbox(owner)
+
+    def add_ent(self, ent: 'Entity'):
+        """Add an entity and any brushes it has to the index."""
+        self._ents.add(ent)
+        for solid in ent.solids:
+            self.add_solid(solid, ent)
+        self._add_ent_bbox(ent)
+
+    def _add_ent_bbox(self, ent: 'Entity'):
+        """Store the location of an entity, if it has one."""
+        try:
+            if ent.is_brush():
+                bbox_min, bbox_max = ent.get_bbox()
+            else:
+                bbox_min = bbox_max = Vec.from_str(ent['origin'])
+        except (IndexError, ValueError):
+            self.entities.remove(ent)
+            return
+        self.entities.add(ent, bbox_min, bbox_max)
+
+    def remove_ent(self, ent: 'Entity'):
+        """Remove an entity and its brushes from the index."""
+        self._ents.discard(ent)
+        self.entities.remove(ent)
+        for solid in ent.solids:
+            self.remove_solid(solid)
+
+    def update_ent(self, ent: 'Entity'):
+        """Update the location of a point entity after it was moved."""
+        if ent in self._ents and not ent.is_brush():
+            self._add_ent_bbox(ent)
+
+    def solid_owner(self, solid: 'Solid') -> Optional['Entity']:
+        """Return the entity containing this solid, or None for world."""
+        return self._solid_owner[solid]
+
+    def face_solid(self, face: 'Side') -> 'Solid':
+        """Return the solid containing this face."""
+        return self._face_solid[face]
+
+    def _check_solid(self, solid, world, detail):
+        """Check a solid matches the world/detail filter."""
+        owner = self._solid_owner[solid]
+        if owner is None:
+            return world
+        return detail and owner['classname'] == 'func_detail'
+
+    def iter_wbrushes_at(
+            self,
+            bbox_min: Vec,
+            bbox_max: Vec=None,
+            world=True,
+            detail=True,
+            ) -> Iterator['Solid']:
+        """Yield the world and detail solids overlapping a point or box.
+
+        This matches VMF.iter_wbrushes().
+        """
+        for solid in self.solids.find_box(bbox_min, bbox_max or bbox_min):
+            if self._check_solid(solid, world, detail):
+                yield solid
+
+    def iter_wfaces_at(
+            self,
+            pos: Vec,
+            world=True,
+            detail=True,
+            ) -> Iterator['Side']:
+        """Yield the world and detail faces whose center is at pos.
+
+        This matches checking face.get_origin() for VMF.iter_wfaces().
+        """
+        for face in self.faces.find_point(pos):
+            if (
+                face.get_origin() == pos and
+                self._check_solid(self._face_solid[face], world, detail)
+            ):
+                yield face
+
+
 class VMF:
     """Represents a VMF file, and holds counters for various IDs used.
 
     Has functions for searching for specific entities or brushes, and
     converts to/from a property_parser tree.
 
-    The dictionaries by_target and by_class allow quickly getting a set
-    of entities with the given class or targetname.
+    The dictionaries by_target, by_class and by_file allow quickly getting
+    a set of entities with the given targetname, class or instance file.
+    by_file uses casefolded filenames.
     """
     def __init__(
             self,
@@ -206,6 +814,9 @@ class VMF:
             cameras=None,
             cordons=None,
             visgroups=None):
+        # The spatial index, built when first used.
+        self._spatial = None  # type: Optional[MapIndex]
+
         self.solid_id = IDMan()  # All occupied solid ids
         self.face_id = IDMan()  # Ditto for faces
         self.ent_id = IDMan()  # Same for entities
@@ -215,6 +826,7 @@ class VMF:
         # the whole map
         self.by_target = defaultdict(CopySet)  # type: Dict[str, Set[Entity]]
         self.by_class = defaultdict(CopySet)  # type: Dict[str, Set[Entity]]
+        self.by_file = defaultdict(CopySet)  # type: Dict[str, Set[Entity]]
 
         self.entities = []  # type: List[Entity]
         self.add_ents(entities or [])  # We need to set the by_ dicts too.
@@ -229,13 +841,18 @@ class VMF:
         self.spawn.solids = self.brushes
         self.spawn.hidden_brushes = self.brushes
 
-        self.is_prefab = utils.conv_bool(map_info.get('prefab'), False)
-        self.cordon_enabled = utils.conv_bool(map_info.get('cordons_on'), False)
-        self.map_ver = utils.conv_int(map_info.get('mapversion'))
         if 'mapversion' in self.spawn:
             # This is saved only in the main VMF object, delete the copy.
             del self.spawn['mapversion']
 
+        self.load_map_info(map_info)
+
+    def load_map_info(self, map_info):
+        """Set the map version and Hammer settings from a dictionary."""
+        self.is_prefab = utils.conv_bool(map_info.get('prefab'), False)
+        self.cordon_enabled = utils.conv_bool(map_info.get('cordons_on'), False)
+        self.map_ver = utils.conv_int(map_info.get('mapversion'))
+
         # These three are mostly useless for us, but we'll preserve them anyway
         self.format_ver = utils.conv_int(
             map_info.get('formatversion'), 100)
@@ -260,13 +877,29 @@ class VMF:
         self.quickhide_count = utils.conv_int(
             map_info.get('quickhide'), -1)
 
+    @property
+    def spatial(self) -> MapIndex:
+        """An index for finding brushes, faces and entities by location.
+
+        This is built the first time it is used. See MapIndex for the
+        changes it tracks - brushes added to ent.solids directly or faces
+        edited in place must be passed to add_solid() or update_solid().
+        """
+        if self._spatial is None:
+            self._spatial = MapIndex(self)
+        return self._spatial
+
     def add_brush(self, item):
         """Add a world brush to this map."""
         self.brushes.append(item)
+        if self._spatial is not None:
+            self._spatial.add_solid(item)
 
     def remove_brush(self, item):
         """Remove a world brush from this map."""
         self.brushes.remove(item)
+        if self._spatial is not None:
+            self._spatial.remove_solid(item)
 
     def add_ent(self, item):
         """Add an entity to the map.
@@ -276,6 +909,9 @@ class VMF:
         self.entities.append(item)
         self.by_class[item['classname', None]].add(item)
         self.by_target[item['targetname', None]].add(item)
+        self.by_file[_fold_file(item['file', None])].add(item)
+        if self._spatial is not None:
+            self._spatial.add_ent(item)
 
     def remove_ent(self, item):
         """Remove an entity from the map.
@@ -286,6 +922,9 @@ class VMF:
         self.entities.remove(item)
         self.by_class[item['classname', None]].remove(item)
         self.by_target[item['targetname', None]].remove(item)
+        self.by_file[_fold_file(item['file', None])].remove(item)
+        if self._spatial is not None:
+            self._spatial.remove_ent(item)
 
         if item.id in self.ent_id:
             self.ent_id.remove(item.id)
@@ -311,12 +950,99 @@ class VMF:
     @staticmethod
     def parse(tree: Union[Property, str]):
         """Convert a property_parser tree into VMF classes.
+
+        If a filename is passed instead, the file is read directly into
+        VMF classes without building the whole Property tree.
         """
         if not isinstance(tree, Property):
             # if not a tree, try to read the file
             with open(tree) as file:
-                tree = Property.parse(file)
+                return VMF.parse_stream(file.read(), tree)
+
+        map_info = VMF.parse_map_info(tree)
+        map_obj = VMF(map_info=map_info)
+
+        VMF._parse_cameras_cordons(map_obj, tree)
+
+        for ent in tree.find_all('Entity'):
+            map_obj.add_ent(
+                Entity.parse(map_obj, ent, hidden=False)
+            )
+
+        # find hidden entities
+        for hidden_ent in tree.find_all('hidden'):
+            for ent in hidden_ent:
+                map_obj.add_ent(
+                    Entity.parse(map_obj, ent, hidden=True)
+                )
+
+        map_spawn = tree.find_key('world', [])
+        if map_spawn is None:
+            # Generate a fake default to parse through
+            map_spawn = Property("world", [])
+        map_obj.spawn = Entity.parse(map_obj, map_spawn)
+
+        if map_obj.spawn.solids is not None:
+            map_obj.brushes = map_obj.spawn.solids
+
+        return map_obj
+
+    @staticmethod
+    def parse_stream(buffer, filename=''):
+        """Read VMF text directly into VMF classes.
 
+        Brushes and their faces are built straight from the parser's tokens,
+        so the Property tree for the whole map never exists. Only the small
+        blocks (keyvalues, outputs, versioninfo, etc) use Property objects.
+        """
+        tokens = iter_tokens(buffer, filename)
+        map_obj = VMF()
+        hidden_ents = []
+        map_spawn = [None]
+
+        def read_world(tokens):
+            map_spawn[0] = _stream_entity(map_obj, tokens, filename)
+
+        def read_ent(tokens):
+            map_obj.add_ent(_stream_entity(map_obj, tokens, filename))
+
+        def read_hidden(tokens):
+            _stream_block(tokens, filename, {
+                'entity': lambda tokens: hidden_ents.append(
+                    _stream_entity(map_obj, tokens, filename, hidden=True)
+                ),
+            })
+
+        tree = Property(None, _stream_block(
+            tokens,
+            filename,
+            {
+                'world': read_world,
+                'entity': read_ent,
+                'hidden': read_hidden,
+            },
+            is_root=True,
+        ))
+
+        map_obj.load_map_info(VMF.parse_map_info(tree))
+        VMF._parse_cameras_cordons(map_obj, tree)
+
+        for ent in hidden_ents:
+            map_obj.add_ent(ent)
+
+        if map_spawn[0] is None:
+            # Generate a fake default to parse through
+            map_spawn[0] = Entity.parse(map_obj, Property("world", []))
+        map_obj.spawn = map_spawn[0]
+
+        if map_obj.spawn.solids is not None:
+            map_obj.brushes = map_obj.spawn.solids
+
+        return map_obj
+
+    @staticmethod
+    def parse_map_info(tree: Property):
+        """Read the map version and Hammer settings from the tree."""
         map_info = {}
         ver_info = tree.find_key('versioninfo', [])
         for key in ('editorversion',
@@ -351,40 +1077,18 @@ class VMF:
         map_info['active_cam'] = utils.conv_int(
             (cam_props['activecamera', '']), -1)
         map_info['quickhide'] = tree.find_key('quickhide', [])['count', '']
+        return map_info
 
-        map_obj = VMF(map_info=map_info)
-
-        for c in cam_props:
+    @staticmethod
+    def _parse_cameras_cordons(map_obj, tree: Property):
+        """Add the cameras and cordons in the tree to the map."""
+        for c in tree.find_key('cameras', []):
             if c.name != 'activecamera':
                 Camera.parse(map_obj, c)
 
-        for ent in cordons.find_all('cordon'):
+        for ent in tree.find_key('cordons', []).find_all('cordon'):
             Cordon.parse(map_obj, ent)
 
-        for ent in tree.find_all('Entity'):
-            map_obj.add_ent(
-                Entity.parse(map_obj, ent, hidden=False)
-            )
-
-        # find hidden entities
-        for hidden_ent in tree.find_all('hidden'):
-            for ent in hidden_ent:
-                map_obj.add_ent(
-                    Entity.parse(map_obj, ent, hidden=True)
-                )
-
-        map_spawn = tree.find_key('world', [])
-        if map_spawn is None:
-            # Generate a fake default to parse through
-            map_spawn = Property("world", [])
-        map_obj.spawn = Entity.parse(map_obj, map_spawn)
-
-        if map_obj.spawn.solids is not None:
-            map_obj.brushes = map_obj.spawn.solids
-
-        return map_obj
-    pass
-
     def export(self, dest_file=None, inc_version=True, minimal=False):
         """Serialises the object's contents into a VMF file.
 
@@ -395,14 +1099,19 @@ class VMF:
           (Viewsettings, cameras, cordons and visgroups)
         """
         if dest_file is None:
-            dest_file = io.StringIO()
+            string_buf = io.StringIO()
             # acts like a file object but is actually a string. We're
             # using this to prevent having Python duplicate the entire
             # string every time we append
             ret_string = True
         else:
+            string_buf = dest_file
             ret_string = False
 
+        # Collect the many small strings, and only write large blocks to
+        # the real file.
+        dest_file = _ChunkBuffer(string_buf)
+
         if inc_version:
             # Increment this to indicate the map was modified
             self.map_ver += 1
@@ -462,9 +1171,11 @@ class VMF:
             dest_file.write('\t"count" "' + str(self.quickhide_count) + '"\n')
             dest_file.write('}\n')
 
+        dest_file.flush()
+
         if ret_string:
-            string = dest_file.getvalue()
-            dest_file.close()
+            string = string_buf.getvalue()
+            string_buf.close()
             return string
 
     def iter_wbrushes(self, world=True, detail=True) -> Iterator['Solid']:
@@ -641,6 +1352,153 @@ class VMF:
         )
 
 
+def _stream_block(tokens, filename, handlers=utils.EmptyMapping, is_root=False):
+    """Read tokens from iter_tokens() into a list of Properties.
+
+    This stops after the closing brace of the current block.
+    handlers maps casefolded block names to functions. When a block
+    with that name is opened the function is called with the tokens, and
+    must read up to and including the closing brace. These blocks are
+    left out of the result.
+    """
+    props = []
+    last_prop = None
+    for tok_type, name, value in tokens:
+        if tok_type is TOK_PAIR:
+            last_prop = Property(name, value)
+            props.append(last_prop)
+        elif tok_type is TOK_NAME:
+            last_prop = Property(name, None)
+            props.append(last_prop)
+        elif tok_type is TOK_BRACE_OPEN:
+            if last_prop is None or last_prop.value is not None:
+                raise KeyValError(
+                    'Sub-section has no name!',
+                    filename,
+                    None,
+                )
+            try:
+                handler = handlers[last_prop.name]
+            except KeyError:
+                last_prop.value = _stream_block(tokens, filename)
+            else:
+                props.pop()
+                handler(tokens)
+            last_prop = None
+        elif is_root:  # Closing brace
+            raise KeyValError(
+                'Too many closing brackets.',
+                filename,
+                None,
+            )
+        else:
+            return props
+    if not is_root:
+        raise KeyValError(
+            'End of text reached with remaining open sections.',
+            filename,
+            None,
+        )
+    return props
+
+
+def _stream_side(vmf_file, tokens, filename):
+    """Read a side block from iter_tokens() into a Side.
+
+    The keyvalues are put straight into a dict for Side.parse_values().
+    """
+    values = {}
+    disp_tree = None
+    block_name = None
+    for tok_type, name, value in tokens:
+        if tok_type is TOK_PAIR:
+            values[name.casefold()] = value
+            block_name = None
+        elif tok_type is TOK_NAME:
+            block_name = name
+        elif tok_type is TOK_BRACE_OPEN:
+            if block_name is None:
+                raise KeyValError(
+                    'Sub-section has no name!',
+                    filename,
+                    None,
+                )
+            block = Property(block_name, _stream_block(tokens, filename))
+            if block.name == 'dispinfo':
+                disp_tree = block
+            block_name = None
+        else:  # Closing brace
+            return Side.parse_values(vmf_file, values, disp_tree)
+    raise KeyValError(
+        'End of text reached with remaining open sections.',
+        filename,
+        None,
+    )
+
+
+def _stream_solid(vmf_file, tokens, filename, hidden=False):
+    """Read a solid block from iter_tokens() into a Solid."""
+    sides = []
+    tree = Property('solid', _stream_block(tokens, filename, {
+        'side': lambda tokens: sides.append(
+            _stream_side(vmf_file, tokens, filename)
+        ),
+    }))
+    return Solid.parse(vmf_file, tree, hidden, sides=sides)
+
+
+def _stream_entity(vmf_file, tokens, filename, hidden=False):
+    """Read an entity or world block from iter_tokens() into an Entity.
+
+    Brushes are read directly, the other blocks use Property trees.
+    """
+    solids = []
+
+    def read_solid(tokens):
+        solids.append(_stream_solid(vmf_file, tokens, filename))
+
+    def read_hidden(tokens):
+        _stream_block(tokens, filename, {
+            'solid': lambda tokens: solids.append(
+                _stream_solid(vmf_file, tokens, filename, hidden=True)
+            ),
+        })
+
+    tree = Property('entity', _stream_block(tokens, filename, {
+        'solid': read_solid,
+        'hidden': read_hidden,
+    }))
+    return Entity.parse(vmf_file, tree, hidden, solids=solids)
+
+
+class _ChunkBuffer:
+    """Collects strings, and writes them to a file in large blocks.
+
+    Writing each line of a VMF to a text file individually is slow, so
+    this joins them up first. flush() must be called when done.
+    """
+    __slots__ = ['file', 'chunks', 'size']
+
+    def __init__(self, file, size=CHUNK_SIZE):
+        self.file = file
+        self.chunks = []
+        self.size = size
+
+    def write(self, text: str):
+        """Add text to the buffer, writing it out if it's gotten large."""
+        chunks = self.chunks
+        chunks.append(text)
+        if len(chunks) >= self.size:
+            self.file.write(''.join(chunks))
+            chunks.clear()
+
+    def flush(self):
+        """Write everything remaining to the file."""
+        if self.chunks:
+            self.file.write(''.join(self.chunks))
+            self.chunks.clear()
+
+
 class Camera:
     def __init__(self, vmf_file, pos, targ):
         self.pos = pos
@@ -751,6 +1609,14 @@ class Cordon:
 
 class Solid:
     """A single brush, serving as both world brushes and brush entities."""
+    __slots__ = [
+        'map',
+        'sides',
+        'id',
+        'editor',
+        'hidden',
+    ]
+
     def __init__(
             self,
             vmf_file: VMF,
@@ -787,12 +1653,18 @@ class Solid:
         )
 
     @staticmethod
-    def parse(vmf_file, tree, hidden=False):
-        """Parse a Property tree into a Solid object."""
+    def parse(vmf_file, tree, hidden=False, sides=None):
+        """Parse a Property tree into a Solid object.
+
+        If sides is passed, it is used instead of the side blocks in the tree.
+        """
         solid_id = utils.conv_int(tree["id", '-1'], -1)
-        sides = []
-        for side in tree.find_all("side"):
-            sides.append(Side.parse(vmf_file, side))
+        if sides is None:
+            sides = [
+                Side.parse(vmf_file, side)
+                for side in
+                tree.find_all("side")
+            ]
 
         editor = {}
         for v in tree.find_key("editor", []):
@@ -817,39 +1689,42 @@ class Solid:
         )
 
     def export(self, buffer, ind=''):
-        """Generate the strings needed to define this brush."""
+        """Generate the strings needed to define this brush.
+
+        The whole brush is built up first, then written in one call.
+        """
+        parts = []
         if self.hidden:
-            buffer.write(ind + 'hidden\n' + ind + '{\n')
+            parts.append(ind + 'hidden\n' + ind + '{\n')
             ind += '\t'
-        buffer.write(ind + 'solid\n')
-        buffer.write(ind + '{\n')
-        buffer.write(ind + '\t"id" "' + str(self.id) + '"\n')
+        parts.append(
+            ind + 'solid\n' +
+            ind + '{\n' +
+            ind + '\t"id" "' + str(self.id) + '"\n'
+        )
+        side_ind = ind + '\t'
         for s in self.sides:
-            s.export(buffer, ind + '\t')
-
-        buffer.write(ind + '\teditor\n')
-        buffer.write(ind + '\t{\n')
-        if 'color' in self.editor:
-            buffer.write(
-                ind + '\t\t"color" "' +
-                self.editor['color'] + '"\n')
-        if 'groupid' in self.editor:
-            buffer.write(ind + '\t\t"groupid" "' +
-                         self.editor['groupid'] + '"\n')
-        for vis_id in self.editor.get('visgroup', []):
-            buffer.write(ind + '\t\t"groupid" "' + str(vis_id) + '"\n')
+            parts.append(s.export_str(side_ind))
+
+        parts.append(ind + '\teditor\n' + ind + '\t{\n')
+        editor = self.editor
+        if 'color' in editor:
+            parts.append(ind + '\t\t"color" "' + editor['color'] + '"\n')
+        if 'groupid' in editor:
+            parts.append(ind + '\t\t"groupid" "' + editor['groupid'] + '"\n')
+        for vis_id in editor.get('visgroup', []):
+            parts.append(ind + '\t\t"groupid" "' + str(vis_id) + '"\n')
         for key in ('visgroupshown', 'visgroupautoshown', 'cordonsolid'):
-            if key in self.editor:
-                buffer.write(
+            if key in editor:
+                parts.append(
                     ind + '\t\t"' + key + '" "' +
-                    utils.bool_as_int(self.editor[key]) +
+                    utils.bool_as_int(editor[key]) +
                     '"\n'
                     )
-        buffer.write(ind + '\t}\n')
-
-        buffer.write(ind + '}\n')
+        parts.append(ind + '\t}\n' + ind + '}\n')
         if self.hidden:
-            buffer.write(ind[:-1] + '}\n')
+            parts.append(ind[:-1] + '}\n')
+        buffer.write(''.join(parts))
 
     def __str__(self):
         """Return a user-friendly description of our data."""
@@ -863,11 +1738,6 @@ class Solid:
         for s in self.sides:
             yield s
 
-    def __del__(self):
-        """Forget this solid's ID when the object is destroyed."""
-        if self.id in self.map.solid_id:
-            self.map.solid_id.remove(self.id)
-
     def get_bbox(self) -> Tuple[Vec, Vec]:
         """Get two vectors representing the space this brush takes up."""
         bbox_min, bbox_max = self.sides[0].get_bbox()
@@ -885,13 +1755,11 @@ class Solid:
 
     def translate(self, diff: Vec):
         """Move this solid by the specified vector."""
-        for s in self.sides:
-            s.translate(diff)
+        translate_solids([self], diff)
 
     def localise(self, origin: Vec, angles: Vec=None):
         """Shift this brush by the given origin/angles."""
-        for s in self.sides:
-            s.localise(origin, angles)
+        localise_solids([self], origin, angles)
 
 
 class UVAxis:
@@ -1018,25 +1886,42 @@ class Side:
     @staticmethod
     def parse(vmf_file, tree):
         """Parse the property tree into a Side object."""
+        return Side.parse_values(
+            vmf_file,
+            {
+                prop.name: prop.value
+                for prop in tree
+                if not prop.has_children()
+            },
+            tree.find_key('dispinfo', []),
+        )
+
+    @staticmethod
+    def parse_values(vmf_file, values, disp_tree: Property=None):
+        """Create a Side object from a dict of its keyvalues.
+
+        The keys should be casefolded. disp_tree is the dispinfo block,
+        if present.
+        """
         # planes = "(x1 y1 z1) (x2 y2 z2) (x3 y3 z3)"
-        verts = tree["plane", "(0 0 0) (0 0 0) (0 0 0)"][1:-1].split(") (")
-        side_id = utils.conv_int(tree["id", '-1'])
+        plane = values.get("plane", "(0 0 0) (0 0 0) (0 0 0)")
+        verts = plane[1:-1].split(") (")
+        side_id = utils.conv_int(values.get("id", '-1'))
         planes = [0, 0, 0]
         for i, v in enumerate(verts):
             if i > 3:
                 raise ValueError('Wrong number of solid planes in "' +
-                                 tree['plane', ''] +
+                                 plane +
                                  '"')
             verts = v.split(" ")
             if len(verts) == 3:
                 planes[i] = [float(v) for v in verts]
             else:
                 raise ValueError('Invalid planes in "' +
-                                 tree['plane', ''] +
+                                 plane +
                                  '"!')
 
-        disp_tree = tree.find_key('dispinfo', [])
-        if len(disp_tree) > 0:
+        if disp_tree is not None and len(disp_tree) > 0:
             disp_data = {
                 'power': disp_tree['power', '4'],
                 'pos': disp_tree['startposition', '4'],
@@ -1060,15 +1945,15 @@ class Side:
             planes=planes,
             des_id=side_id,
             disp_data=disp_data,
-            mat=tree['material', ''],
-            uaxis=UVAxis.parse(tree['uaxis', '[0 1 0 0] 0.25']),
-            vaxis=UVAxis.parse(tree['vaxis', '[0 0 -1 0] 0.25']),
+            mat=values.get('material', ''),
+            uaxis=UVAxis.parse(values.get('uaxis', '[0 1 0 0] 0.25')),
+            vaxis=UVAxis.parse(values.get('vaxis', '[0 0 -1 0] 0.25')),
             rotation=utils.conv_int(
-                tree['rotation', '0']),
+                values.get('rotation', '0')),
             lightmap=utils.conv_int(
-                tree['lightmapscale', '16'], 16),
+                values.get('lightmapscale', '16'), 16),
             smoothing=utils.conv_int(
-                tree['smoothing_groups', '0']),
+                values.get('smoothing_groups', '0')),
         )
 
     def copy(self, des_id=-1, map=None, side_mapping=utils.EmptyMapping):
@@ -1109,49 +1994,57 @@ class Side:
 
     def export(self, buffer, ind=''):
         """Generate the strings required to define this side in a VMF."""
-        buffer.write(ind + 'side\n')
-        buffer.write(ind + '{\n')
-        buffer.write(ind + '\t"id" "' + str(self.id) + '"\n')
-        pl_str = ('(' + p.join(' ') + ')' for p in self.planes)
-        buffer.write(ind + '\t"plane" "' + ' '.join(pl_str) + '"\n')
-        buffer.write(ind + '\t"material" "' + self.mat + '"\n')
-        buffer.write(ind + '\t"uaxis" "' + str(self.uaxis) + '"\n')
-        buffer.write(ind + '\t"vaxis" "' + str(self.vaxis) + '"\n')
-        buffer.write(ind + '\t"rotation" "' + str(self.ham_rot) + '"\n')
-        buffer.write(ind + '\t"lightmapscale" "' + str(self.lightmap) + '"\n')
-        buffer.write(ind + '\t"smoothing_groups" "' + str(self.smooth) + '"\n')
-        if self.is_disp:
-            buffer.write(ind + '\tdispinfo\n')
-            buffer.write(ind + '\t{\n')
+        buffer.write(self.export_str(ind))
 
-            buffer.write(ind + '\t\t"power" "' + str(self.disp_power) + '"\n')
-            buffer.write(ind + '\t\t"startposition" "[' +
-                         self.disp_pos.join(' ') +
-                         ']"\n')
-            buffer.write(ind + '\t\t"flags" "' + str(self.disp_flags) +
-                         '"\n')
-            buffer.write(ind + '\t\t"elevation" "' + str(self.disp_elev) +
-                         '"\n')
-            buffer.write(ind + '\t\t"subdiv" "' +
-                         utils.bool_as_int(self.disp_is_subdiv) +
-                         '"\n')
-            for v in _DISP_ROWS:
-                if len(self.disp_data[v]) > 0:
-                    buffer.write(ind + '\t\t' + v + '\n')
-                    buffer.write(ind + '\t\t{\n')
-                    for i, data in enumerate(self.disp_data[v]):
-                        buffer.write(ind + '\t\t\t"row' + str(i) +
-                                     '" "' + data +
-                                     '"\n')
-                    buffer.write(ind + '\t\t}\n')
-            if len(self.disp_allowed_verts) > 0:
-                buffer.write(ind + '\t\tallowed_verts\n')
-                buffer.write(ind + '\t\t{\n')
-                for k, v in self.disp_allowed_verts.items():
-                    buffer.write(ind + '\t\t\t"' + k + '" "' + v + '"\n')
-                buffer.write(ind + '\t\t}\n')
-            buffer.write(ind + '\t}\n')
-        buffer.write(ind + '}\n')
+    def export_str(self, ind=''):
+        """Return the text for this side as a single string.
+
+        Solids use this to write all their sides in one call.
+        """
+        p1, p2, p3 = self.planes
+        u = self.uaxis
+        v = self.vaxis
+        text = _side_template(ind).format(
+            self.id,
+            p1.x, p1.y, p1.z,
+            p2.x, p2.y, p2.z,
+            p3.x, p3.y, p3.z,
+            self.mat,
+            u.x, u.y, u.z, u.offset, u.scale,
+            v.x, v.y, v.z, v.offset, v.scale,
+            self.ham_rot,
+            self.lightmap,
+            self.smooth,
+        )
+        if not self.is_disp:
+            return text + ind + '}\n'
+
+        parts = [
+            text,
+            _DISP_FMT.format(
+                ind=ind,
+                power=self.disp_power,
+                pos=self.disp_pos.join(' '),
+                flags=self.disp_flags,
+                elev=self.disp_elev,
+                subdiv=utils.bool_as_int(self.disp_is_subdiv),
+            ),
+        ]
+        for v in _DISP_ROWS:
+            if len(self.disp_data[v]) > 0:
+                parts.append(ind + '\t\t' + v + '\n' + ind + '\t\t{\n')
+                for i, data in enumerate(self.disp_data[v]):
+                    parts.append(
+                        ind + '\t\t\t"row' + str(i) + '" "' + data + '"\n'
+                    )
+                parts.append(ind + '\t\t}\n')
+        if len(self.disp_allowed_verts) > 0:
+            parts.append(ind + '\t\tallowed_verts\n' + ind + '\t\t{\n')
+            for k, v in self.disp_allowed_verts.items():
+                parts.append(ind + '\t\t\t"' + k + '" "' + v + '"\n')
+            parts.append(ind + '\t\t}\n')
+        parts.append(ind + '\t}\n' + ind + '}\n')
+        return ''.join(parts)
 
     def __str__(self):
         """Dump a user-friendly representation of the side."""
@@ -1161,11 +2054,6 @@ class Side:
         st += '\tplane: ' + ", ".join(pl_str) + '\n'
         return st
 
-    def __del__(self):
-        """Forget this side's ID when the object is destroyed."""
-        if self.id in self.map.face_id:
-            self.map.face_id.remove(self.id)
-
     def get_bbox(self) -> Tuple[Vec, Vec]:
         """Generate the highest and lowest points these planes form."""
         bbox_max = self.planes[0].copy()
@@ -1186,44 +2074,14 @@ class Side:
 
         - A tuple can be passed in instead if desired.
         """
-        for p in self.planes:
-            p += diff
-
-        u_axis = Vec(self.uaxis.x, self.uaxis.y, self.uaxis.z)
-        v_axis = Vec(self.vaxis.x, self.vaxis.y, self.vaxis.z)
-
-        # Fix offset - see source-sdk: utils/vbsp/map.cpp line 2237
-        self.uaxis.offset -= diff.dot(u_axis) / self.uaxis.scale
-        self.vaxis.offset -= diff.dot(v_axis) / self.vaxis.scale
+        translate_sides([self], diff)
 
     def localise(self, origin: Vec, angles: Vec=None):
         """Shift the face by the given origin and angles.
 
         This preserves texture offsets
         """
-        for p in self.planes:
-            p.localise(origin, angles)
-        # Rotate the uaxis values
-        u_axis = Vec(self.uaxis.x, self.uaxis.y, self.uaxis.z)
-        v_axis = Vec(self.vaxis.x, self.vaxis.y, self.vaxis.z)
-
-        if angles is not None:
-            u_axis.rotate(angles.x, angles.y, angles.z)
-            v_axis.rotate(angles.x, angles.y, angles.z)
-
-            self.uaxis.x, self.uaxis.y, self.uaxis.z = u_axis
-            self.vaxis.x, self.vaxis.y, self.vaxis.z = v_axis
-
-        # Fix offset - see source-sdk: utils/vbsp/map.cpp line 2237
-        self.uaxis.offset -= origin.dot(u_axis) / self.uaxis.scale
-        self.vaxis.offset -= origin.dot(v_axis) / self.vaxis.scale
-
-        # Keep the values low. The highest texture size in P2 is 1024, so
-        # do the next power just to be safe.
-        # Add and subtract 1024 so the value is between -1024, 1024 not 0, 2048
-        # (This just looks nicer)
-        self.uaxis.offset = (self.uaxis.offset + 1024) % 2048 - 1024
-        self.vaxis.offset = (self.vaxis.offset + 1024) % 2048 - 1024
+        localise_sides([self], origin, angles)
 
     def plane_desc(self):
         """Return a string which describes this face.
@@ -1270,6 +2128,19 @@ class Entity:
     Supports [] operations to read and write keyvalues.
     To read instance $replace values operate on entity.fixup[]
     """
+    __slots__ = [
+        'map',
+        'keys',
+        'fixup',
+        'outputs',
+        'solids',
+        'id',
+        'hidden',
+        'editor',
+        'groups',
+        'hidden_brushes',  # Only set on worldspawn.
+    ]
+
     def __init__(
             self,
             vmf_file: VMF,
@@ -1282,13 +2153,13 @@ class Entity:
             hidden=False,
             groups=()):
         self.map = vmf_file
-        self.keys = {
+        self.keys = KeyValues(
             # Ensure all values are strings. This allows passing ints and Vecs
             # normally.
-            k: str(v)
+            (k, str(v))
             for k, v in
             keys.items()
-        }
+        )
         self.fixup = EntityFixup(fixup)
         self.outputs = outputs or []  # type: List[Output]
         self.solids = solids or []  # type: List[Solid]
@@ -1341,10 +2212,14 @@ class Entity:
         )
 
     @staticmethod
-    def parse(vmf_file, tree_list: Property, hidden=False):
-        """Parse a property tree into an Entity object."""
+    def parse(vmf_file, tree_list: Property, hidden=False, solids=None):
+        """Parse a property tree into an Entity object.
+
+        If solids is passed, those brushes are added to the entity before
+        any in the tree.
+        """
         ent_id = -1
-        solids = []
+        solids = list(solids or ())
         keys = {}
         outputs = []
         editor = {'visgroup': []}
@@ -1431,14 +2306,16 @@ class Entity:
             buffer.write(ind + 'hidden\n' + ind + '{\n')
             ind += '\t'
 
-        buffer.write(ind + ent_name + '\n')
-        buffer.write(ind + '{\n')
-        buffer.write(ind + '\t"id" "' + str(self.id) + '"\n')
-        for key, value in sorted(self.keys.items(), key=operator.itemgetter(0)):
-            buffer.write(
-                ind +
-                '\t"{}" "{!s}"\n'.format(key, value)
-            )
+        buffer.write(
+            ind + ent_name + '\n' +
+            ind + '{\n' +
+            ind + '\t"id" "' + str(self.id) + '"\n' +
+            ''.join([
+                ind + '\t"{}" "{!s}"\n'.format(key, value)
+                for key, value in
+                sorted(self.keys.items(), key=operator.itemgetter(0))
+            ])
+        )
 
         self.fixup.export(buffer, ind)
 
@@ -1541,12 +2418,7 @@ class Entity:
         """
         if isinstance(key, tuple):
             key, default = key
-        key = key.casefold()
-        for k in self.keys:
-            if k.casefold() == key:
-                return self.keys[k]
-        else:
-            return default
+        return self.keys.get(key, default)
 
     def __setitem__(self, key, val):
         """Allow using [] syntax to save a keyvalue.
@@ -1555,15 +2427,8 @@ class Entity:
           differs by case.
         """
         key_fold = key.casefold()
-        for k in self.keys:
-            if k.casefold() == key_fold:
-                # Check case-insensitively for this key first
-                orig_val = self.keys.get(k)
-                self.keys[k] = str(val)
-                break
-        else:
-            orig_val = self.keys.get(key)
-            self.keys[key] = str(val)
+        orig_val = self.keys.get(key)
+        self.keys[key] = str(val)
 
         # Update the by_class/target dicts with our new value
         if key_fold == 'classname':
@@ -1574,6 +2439,12 @@ class Entity:
             with suppress(KeyError):
                 self.map.by_target[orig_val].remove(self)
             self.map.by_target[val].add(self)
+        elif key_fold == 'file':
+            with suppress(KeyError):
+                self.map.by_file[_fold_file(orig_val)].remove(self)
+            self.map.by_file[_fold_file(str(val))].add(self)
+        elif key_fold == 'origin' and self.map._spatial is not None:
+            self.map._spatial.update_ent(self)
 
     def __delitem__(self, key):
         key = key.casefold()
@@ -1591,36 +2462,32 @@ class Entity:
                 ].remove(self)
             self.map.by_class[None].add(self)
 
-        for k in self.keys:
-            if k.casefold() == key:
-                del self.keys[k]
-                break
+        if key == 'file':
+            with suppress(KeyError):
+                self.map.by_file[
+                    _fold_file(self['file', None])
+                ].remove(self)
+            self.map.by_file[None].add(self)
+
+        with suppress(KeyError):
+            del self.keys[key]
 
     get = __getitem__
 
     def clear_keys(self):
         """Remove all keyvalues from an item."""
-        # Delete these so the .by_class/name values are cleared.
+        # Delete these so the .by_class/name/file values are cleared.
         del self['targetname']
         del self['classname']
+        del self['file']
         self.keys.clear()
 
     def __contains__(self, key: str):
         """Determine if a value exists for the given key."""
-        key = key.casefold()
-        for k in self.keys:
-            if k.casefold() == key:
-                return True
-        else:
-            return False
+        return key in self.keys
 
     get_key = __contains__
 
-    def __del__(self):
-        """Forget this entity's ID when the object is destroyed."""
-        if self.id in self.map.ent_id:
-            self.map.ent_id.remove(self.id)
-
     def get_bbox(self) -> (Vec, Vec):
         """Get two vectors representing the space this entity takes up."""
         if self.is_brush():
@@ -1652,6 +2519,7 @@ class EntityFixup:
     This also treats variable names case-insensitively, and strips $
     signs off the front of them.
     """
+    __slots__ = ['_fixup']
 
     def __init__(self, fixup=()):
         self._fixup = {}
@@ -1988,12 +2856,41 @@ class Output:
             )
 
 if __name__ == '__main__':
-    # Test the VMF parser by duplicating a test file
-    print('parsing...')
-    map_file = VMF.parse('test.vmf')
+    # Test the VMF parser by duplicating a test file.
+    # This also compares the time and peak memory use of reading the
+    # file via a Property tree, and streaming it directly.
+    import sys
+    import time
+    import tracemalloc
+
+    test_path = sys.argv[1] if len(sys.argv) > 1 else 'test.vmf'
+
+    def parse_tree():
+        with open(test_path) as file:
+            return VMF.parse(Property.parse(file, test_path))
+
+    def parse_stream():
+        return VMF.parse(test_path)
+
+    for mode, func in [('Tree', parse_tree), ('Stream', parse_stream)]:
+        print(mode + ' parsing...')
+        start = time.perf_counter()
+        map_file = func()
+        duration = time.perf_counter() - start
+        del map_file
+
+        tracemalloc.start()
+        map_file = func()
+        peak_mem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{}: {:.2f}s, peak {:.1f} MB'.format(
+            mode,
+            duration,
+            peak_mem / 1024 / 1024,
+        ))
 
     print('saving...')
-
+    start = time.perf_counter()
     with open('test_out.vmf', 'w') as test_file:
         map_file.export(test_file)
-    print('done!')
\ No newline at end of file
+    print('done! ({:.2f}s)'.format(time.perf_counter() - start))
@@ -1,5 +1,5 @@
 from datetime import datetime
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_STORED
 from io import BytesIO
 
 import os
@@ -8,8 +8,9 @@ import stat
 import shutil
 import sys
 import subprocess
+import zlib
 
-from property_parser import Property
+from property_parser import Property, KeyValError
 from BSP import BSP, BSP_LUMPS
 import utils
 
@@ -29,6 +30,11 @@ RES_ROOT = [
     ('bee2', 'bee2_dev', 'portal2_dlc2')
 ]
 
+# Remembers where resources were found, and their CRCs.
+PACK_CACHE_LOC = 'bee2/pack_cache.cfg'
+# Block size used when computing the CRC of resources.
+CRC_BLOCK_SIZE = 64 * 1024
+
 GAME_FOLDER = {
     # The game's root folder, where screenshots are saved/
     utils.STEAM_IDS['PORTAL2']: 'portal2',
@@ -82,27 +88,141 @@ def load_config():
     LOGGER.info('Config Loaded!')
 
 
-def pack_file(zipfile, filename):
-    """Check multiple locations for a resource file.
+def load_pack_cache():
+    """Read the cache of resource locations from the last compile.
+
+    This maps resource names (before any renaming) to
+    (root, size, mtime, crc), where root is the position in RES_ROOT.
     """
-    if '\t' in filename:
-        # We want to rename the file!
-        filename, arcname = filename.split('\t')
-    else:
-        arcname = filename
+    cache = {}
+    try:
+        with open(PACK_CACHE_LOC) as f:
+            props = Property.parse(f, PACK_CACHE_LOC)
+    except FileNotFoundError:
+        return cache
+    except KeyValError:
+        LOGGER.warning('Pack cache is corrupt, ignoring.')
+        return cache
+
+    for prop in props.find_key('PackCache', []):
+        root = utils.conv_int(prop['root', ''], -1)
+        if not 0 <= root < len(RES_ROOT):
+            continue
+        cache[prop['name']] = (
+            root,
+            utils.conv_int(prop['size']),
+            utils.conv_float(prop['mtime']),
+            utils.conv_int(prop['crc']),
+        )
+    return cache
+
+
+def save_pack_cache(cache):
+    """Write out the resource locations, for the next compile."""
+    props = Property('PackCache', [
+        Property('File', [
+            Property('name', filename),
+            Property('root', str(root)),
+            Property('size', str(size)),
+            Property('mtime', repr(mtime)),
+            Property('crc', str(crc)),
+        ])
+        for filename, (root, size, mtime, crc) in
+        sorted(cache.items())
+    ])
+    try:
+        with open(PACK_CACHE_LOC, 'w') as f:
+            for line in props.export():
+                f.write(line)
+    except OSError:
+        LOGGER.warning('Could not save pack cache!')
 
-    for poss_path in RES_ROOT:
+
+def find_resource(filename, pack_cache):
+    """Locate a resource in RES_ROOT.
+
+    This returns (root, path, stat, crc), or (None, None, None, None) if
+    not found. root is the position in RES_ROOT. The earliest location
+    with the file is always used. crc comes from the cache, and is None
+    if the file or its location has changed since it was cached.
+    """
+    try:
+        cache_root, size, mtime, crc = pack_cache[filename]
+    except KeyError:
+        cache_root = crc = None
+
+    for root, poss_path in enumerate(RES_ROOT):
         full_path = os.path.normpath(
             os.path.join(poss_path, filename)
         )
-        if os.path.isfile(full_path):
-            zipfile.write(
-                filename=full_path,
-                arcname=arcname,
-            )
-            break
+        try:
+            file_stat = os.stat(full_path)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            if (
+                root == cache_root and
+                file_stat.st_size == size and
+                file_stat.st_mtime == mtime
+            ):
+                return root, full_path, file_stat, crc
+            return root, full_path, file_stat, None
+    return None, None, None, None
+
+
+def file_crc(path):
+    """Compute the CRC32 of a file, the same way zipfile does."""
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CRC_BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+    return crc & 0xFFFFFFFF
+
+
+def pack_file(zipfile, filename, pack_cache):
+    """Check multiple locations for a resource file, and add it to the zip.
+
+    If the zip already has an identical copy of the file it is skipped.
+    This returns True if the file was written.
+    """
+    if '\t' in filename:
+        # We want to rename the file!
+        res_name, arcname = filename.split('\t')
+    else:
+        res_name = arcname = filename
+
+    root, full_path, file_stat, crc = find_resource(res_name, pack_cache)
+    if full_path is None:
+        LOGGER.warning('"bee2/' + res_name + '" not found!')
+        pack_cache.pop(res_name, None)
+        return False
+
+    try:
+        existing = zipfile.getinfo(arcname)
+    except KeyError:
+        existing = None
     else:
-        LOGGER.warning('"bee2/' + filename + '" not found!')
+        if crc is None:
+            crc = file_crc(full_path)
+        if existing.CRC == crc and existing.file_size == file_stat.st_size:
+            pack_cache[res_name] = (
+                root, file_stat.st_size, file_stat.st_mtime, crc,
+            )
+            return False
+
+    # Portal 2 can't read compressed pakfiles, so always store.
+    zipfile.write(
+        filename=full_path,
+        arcname=arcname,
+        compress_type=ZIP_STORED,
+    )
+    pack_cache[res_name] = (
+        root,
+        file_stat.st_size,
+        file_stat.st_mtime,
+        zipfile.getinfo(arcname).CRC,
+    )
+    return True
 
 
 def pack_content(path):
@@ -136,23 +256,44 @@ def pack_content(path):
 
     # Manipulate the zip entirely in memory
     zip_data = BytesIO()
-    zip_data.write(bsp_file.get_lump(BSP_LUMPS.PAKFILE))
+    with bsp_file.get_lump(BSP_LUMPS.PAKFILE) as pak_lump:
+        zip_data.write(pak_lump)
     zipfile = ZipFile(zip_data, mode='a')
     LOGGER.debug(' - Existing zip read')
 
+    pack_cache = load_pack_cache()
+    written = 0
     for file in files:
-        pack_file(zipfile, file)
+        if pack_file(zipfile, file, pack_cache):
+            written += 1
 
-    LOGGER.debug(' - Added files')
+    LOGGER.debug(
+        ' - Added files ({} written, {} already packed)',
+        written,
+        len(files) - written,
+    )
 
     zipfile.close()  # Finalise the zip modification
 
-    # Copy the zipfile into the BSP file, and adjust the headers
-    bsp_file.replace_lump(
-        path,
+    # Forget resources which aren't packed anymore.
+    used_res = {file.split('\t')[0] for file in files}
+    for res_name in list(pack_cache):
+        if res_name not in used_res:
+            del pack_cache[res_name]
+    save_pack_cache(pack_cache)
+
+    if not written:
+        LOGGER.info('Pakfile unchanged!')
+        bsp_file.close()
+        return
+
+    # Copy the zipfile into the BSP file, and adjust the headers.
+    # The PAKFILE is normally last, so this only needs to write the end.
+    bsp_file.set_lump(
         BSP_LUMPS.PAKFILE,
-        zip_data.getvalue(),  # Get the binary data we need
+        zip_data.getbuffer(),  # Get the binary data we need
     )
+    bsp_file.commit()
     LOGGER.debug(' - BSP written!')
 
     LOGGER.info("Packing complete!")